@@ -0,0 +1,658 @@
+"""
+MediaServer benchmarks.
+
+Run from this directory (like main.py) so config.ini and the bundled
+modules are found, e.g.
+
+    python3 bench.py rows --rows 100000
+    python3 bench.py decode
+    python3 bench.py executemany --rows 10000
+    python3 bench.py fetch
+    python3 bench.py titles --rows 1000000
+    python3 bench.py metadata --rows 1000000
+    python3 bench.py summaries --scale 1 10 100 --writes 10000
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+
+from modules import *
+from modules.pg8000 import core
+import database
+
+
+def best_of(repeat, func):
+    """Fastest of `repeat` timed calls of func(), in seconds"""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def allocated_by(func):
+    """Bytes still allocated by what func() returns, and the result"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return size, result
+
+#####################################################
+#   Row factories
+#####################################################
+
+def bench_rows(args):
+    """Memory per row and time to build a result set, dict rows vs slotted rows"""
+    cols = ['song_id', 'song_title', 'artists', 'length'][:args.columns]
+    values = [
+        [i, 'Song %d' % i, 'Artist %d,Artist %d' % (i, i + 1), 180 + i % 240][:args.columns]
+        for i in range(args.rows)
+    ]
+
+    print("%d rows of %d columns, best of %d" % (args.rows, len(cols), args.repeat))
+    print("%-12s %12s %12s %14s %14s" % (
+        "factory", "bytes/row", "build ms", "row['col'] ms", "row.col ms"))
+    for factory in (database.dict_row, database.slotted_row):
+        make_row = factory(cols)
+        build = lambda: [make_row(v) for v in values]
+        size, rows = allocated_by(build)
+        build_s = best_of(args.repeat, build)
+        by_key = best_of(args.repeat, lambda: [r['song_title'] for r in rows])
+        if factory is database.dict_row:
+            by_attr = None
+        else:
+            by_attr = best_of(args.repeat, lambda: [r.song_title for r in rows])
+        print("%-12s %12.1f %12.2f %14.2f %14s" % (
+            factory.__name__, size / args.rows, build_s * 1000, by_key * 1000,
+            "-" if by_attr is None else "%.2f" % (by_attr * 1000)))
+        del rows
+
+
+#####################################################
+#   pg8000 DataRow decoding
+#####################################################
+
+def text_recv(data, offset, length):
+    return str(data[offset:offset + length], 'utf8')
+
+# (recv function, encoder) per column type, as pg8000 reads them
+COLUMN_TYPES = {
+    'int2': (core.int2_recv, core.h_pack),
+    'int4': (core.int4_recv, core.i_pack),
+    'int8': (core.int8_recv, core.q_pack),
+    'float8': (core.float8_recv, core.d_pack),
+    'date': (core.date_recv, core.i_pack),
+    'text': (text_recv, lambda v: v.encode('utf8')),
+}
+
+# Column types and a sample value for each, shaped like real result sets
+ROW_SHAPES = {
+    # get_allsongs: song_id, song_title, artists
+    'songs': [('int4', 1042), ('text', 'Song 1042'), ('text', 'Artist 7,Artist 12')],
+    # get_movie: movie and metadata columns (title_words left out)
+    'movie': [('int4', 7), ('text', 'Movie title 7'), ('int2', 1994), ('int4', 7),
+              ('int4', 311), ('int4', 2), ('text', 'An overlong description of the film'),
+              ('text', 'description')],
+    # all fixed width, e.g. ids and counts
+    'fixed': [('int4', 1), ('int8', 2 ** 40), ('int2', 3), ('float8', 0.5), ('date', 7300)],
+    # a wide report row
+    'wide': [('int4', i) if i % 3 == 0 else ('text', 'value %d' % i) if i % 3 == 1
+             else ('float8', i / 3.0) for i in range(24)],
+}
+
+def loop_decoder(funcs):
+    """pg8000's original DataRow decoding, one column at a time"""
+    def decode_row(data):
+        data_idx = 2
+        row = []
+        for func in funcs:
+            vlen = core.i_unpack(data, data_idx)[0]
+            data_idx += 4
+            if vlen == -1:
+                row.append(None)
+            else:
+                row.append(func(data, data_idx, vlen))
+                data_idx += vlen
+        return row
+    return decode_row
+
+def bench_decode(args):
+    """pg8000 DataRow decoding, the per-column loop vs the compiled decoder"""
+    print("%d rows per shape, best of %d" % (args.rows, args.repeat))
+    print("%-8s %8s %12s %14s %8s" % ("shape", "columns", "loop ms", "compiled ms", "speedup"))
+    for name, columns in ROW_SHAPES.items():
+        funcs = tuple(COLUMN_TYPES[typ][0] for typ, _ in columns)
+        fields = [COLUMN_TYPES[typ][1](value) for typ, value in columns]
+        row = core.h_pack(len(fields)) + b''.join(core.i_pack(len(f)) + f for f in fields)
+        rows = [row] * args.rows
+
+        loop = loop_decoder(funcs)
+        compiled = core.compile_row_decoder(funcs, text_funcs=(text_recv,))
+        assert loop(row) == compiled(row)
+        loop_s = best_of(args.repeat, lambda: [loop(r) for r in rows])
+        compiled_s = best_of(args.repeat, lambda: [compiled(r) for r in rows])
+        print("%-8s %8d %12.2f %14.2f %7.2fx" % (
+            name, len(funcs), loop_s * 1000, compiled_s * 1000, loop_s / compiled_s))
+
+
+#####################################################
+#   pg8000 executemany
+#####################################################
+
+def bench_executemany(args):
+    """Inserts through one execute() per row vs batched executemany()"""
+    params = [(i, 'Song %d' % i, 180 + i % 240) for i in range(args.rows)]
+    insert = "insert into bench_executemany values (%s, %s, %s)"
+
+    def one_by_one(cur):
+        for p in params:
+            cur.execute(insert, p)
+
+    def batched(cur):
+        cur.executemany(insert, params)
+
+    print("%d rows, best of %d" % (args.rows, args.repeat))
+    print("%-12s %10s %12s %10s" % ("method", "batch", "ms", "rows/s"))
+    # A plain pg8000 cursor, so the query log doesn't collect every insert
+    with database.get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""create temp table bench_executemany
+                       (song_id int, title text, length int)
+                       on commit drop""")
+        methods = [('execute', '-', one_by_one)]
+        for size in args.batch_size:
+            methods.append(('executemany', size, batched))
+        for name, size, method in methods:
+            if size != '-':
+                cur.executemany_batch_size = size
+            def run():
+                method(cur)
+                cur.execute("truncate bench_executemany")
+            elapsed = best_of(args.repeat, run)
+            print("%-12s %10s %12.1f %10.0f" % (
+                name, size, elapsed * 1000, args.rows / elapsed))
+
+
+#####################################################
+#   pg8000 fetch size
+#####################################################
+
+# The queries behind the /list/* pages
+LIST_QUERIES = {
+    'artists': database._ALL_ARTISTS_SQL,
+    'songs': database._ALL_SONGS_SQL,
+    'movies': database._ALL_MOVIES_SQL,
+}
+
+def bench_fetch(args):
+    """Round trips and time to read the list pages' results, per fetch size"""
+    print("best of %d" % args.repeat)
+    print("%-8s %8s %10s %8s %12s %10s" % (
+        "query", "rows", "fetch", "trips", "first trips", "ms"))
+    for name, sql in LIST_QUERIES.items():
+        for fetch_size in args.fetch_size:
+            conn = database._connect()
+            conn.fetch_size = database._fetch_size(fetch_size)
+            cur = conn.cursor()
+            trips = []
+            def run():
+                started = conn.round_trips
+                cur.execute(sql)
+                rows = cur.fetchall()
+                trips.append(conn.round_trips - started)
+                return rows
+            nrows = len(run())
+            elapsed = best_of(args.repeat, run)
+            print("%-8s %8d %10s %8d %12d %10.1f" % (
+                name, nrows, fetch_size, trips[-1], trips[0], elapsed * 1000))
+            conn.close()
+
+
+#####################################################
+#   Title search
+#####################################################
+
+TITLE_WORDS = """
+    the of a and in love story star night day man woman last first dark return
+    king queen war game house city dead life world time girl boy black white red
+    blue secret lost little big great new old home river road sun moon sea fire
+    ice shadow ghost heart dream summer winter blood gold silver iron stone
+    storm island mountain garden kingdom empire legend hunter killer angel devil
+    brother sister father mother son daughter family friend stranger lady lord
+    captain doctor professor spy agent thief soldier ship train car street
+    school hotel castle forest desert planet galaxy space future past lucky
+    wild silent final hidden broken golden eternal crazy beautiful dangerous
+    """.split()
+
+def trigram_opclass(cur):
+    """gin_trgm_ops, qualified by the schema pg_trgm is in, or None without pg_trgm"""
+    cur.execute("""select quote_ident(n.nspname) || '.gin_trgm_ops'
+                   from pg_extension e join pg_namespace n on (n.oid = e.extnamespace)
+                   where e.extname = 'pg_trgm'""")
+    row = cur.fetchone()
+    return row[0] if row else None
+
+def bench_titles(args):
+    """Title search over generated titles: the old regex vs LIKE, without and with a trigram index"""
+    searches = {
+        'regex': "select count(*) from bench_titles where lower(title) ~ lower(%s)",
+        'like': "select count(*) from bench_titles where lower(title) like lower(%s)",
+    }
+    pick = "words[1 + floor(random() * n)::int]"
+    with database.get_connection() as conn:
+        cur = conn.cursor()
+        # Titles of 2 to 5 words
+        started = time.perf_counter()
+        cur.execute("""create temp table bench_titles on commit drop as
+                       with w(words, n) as (select %s::text[], %s::int)
+                       select i as title_id,
+                              concat_ws(' ', initcap({pick}), {pick},
+                                        case when i %% 4 > 0 then {pick} end,
+                                        case when i %% 4 > 1 then {pick} end,
+                                        case when i %% 4 > 2 then {pick} end) as title
+                       from w, generate_series(1, %s) i""".format(pick=pick),
+                    (TITLE_WORDS, len(TITLE_WORDS), args.rows))
+        cur.execute("analyze bench_titles")
+        print("%d titles from %d words, made in %.1fs; best of %d" % (
+            args.rows, len(TITLE_WORDS), time.perf_counter() - started, args.repeat))
+
+        def run(search, term):
+            sql = searches[search]
+            param = term if search == 'regex' else database._like_pattern(term)
+            counts = []
+            def query():
+                cur.execute(sql, (param,))
+                counts.append(cur.fetchone()[0])
+            return best_of(args.repeat, query) * 1000, counts[-1]
+
+        results = {term: [run('regex', term), run('like', term)] for term in args.term}
+
+        opclass = trigram_opclass(cur)
+        if opclass is None:
+            print("pg_trgm is not installed here, so there are no trigram index timings")
+        else:
+            started = time.perf_counter()
+            cur.execute("create index on bench_titles using gin (lower(title) %s)" % opclass)
+            cur.execute("analyze bench_titles")
+            print("trigram index built in %.1fs" % (time.perf_counter() - started))
+            for term in args.term:
+                results[term].append(run('like', term))
+
+        print("%-16s %8s %10s %10s %14s" % ("term", "matches", "regex ms", "like ms", "like+gin ms"))
+        for term, timings in results.items():
+            print("%-16s %8d %10.1f %10.1f %14s" % (
+                term, timings[0][1], timings[0][0], timings[1][0],
+                "%.1f" % timings[2][0] if len(timings) > 2 else "-"))
+
+
+#####################################################
+#   Metadata filters
+#####################################################
+
+# Generated metadata types and their values; every movie gets one to three
+# genres, a language and a rating
+BENCH_METADATA = {
+    'genre': """action adventure animation biography comedy crime documentary
+                drama family fantasy history horror music musical mystery
+                romance scifi sport thriller western""".split(),
+    'language': "english french spanish german italian japanese korean hindi chinese russian".split(),
+    'rating': "g pg pg-13 r nc-17".split(),
+}
+
+# /api/search metadata, as app.js sends it
+METADATA_FILTERS = [
+    {'genre': ['drama']},
+    {'genre': ['drama', 'comedy']},
+    {'genre': ['horror'], 'language': ['-english']},
+    {'genre': ['drama'], 'language': ['french'], 'rating': ['pg']},
+    {'genre': ['western'], 'language': ['korean'], 'rating': ['nc-17']},
+    {'-genre': ['horror', 'thriller'], 'rating': ['g', 'pg']},
+]
+
+def count_metadata_filter(md_id, md_values):
+    """The correlated count(*) != 0 filter movie_fuzzy_search used to build, on q1.movie_id
+
+    Less its syntax error when a key only had '-' values.
+    """
+    could_include = [v for v in md_values if v[0] != '-']
+    not_include = [v[1:] for v in md_values if v[0] == '-' and len(v) > 1]
+    where = ["mtm.media_id = q1.movie_id", "mt.md_type_id = %s"]
+    if not_include:
+        where.append("(md_value not in (%s))" % ",".join("%s" for _ in not_include))
+    if could_include:
+        where.append("((md_value in (%s)))" % ",".join("%s" for _ in could_include))
+    sql = """((select count(*) from mediaserver.metadata as mt natural
+    join mediaserver.mediaitemmetadata as mtm where ({})) != 0)""".format(" and ".join(where))
+    return sql, [md_id, *not_include, *could_include]
+
+def bench_metadata(args):
+    """Movie search with metadata filters: count(*) subqueries after the limit vs EXISTS before it"""
+    type_ids = {name: i for i, name in enumerate(BENCH_METADATA, 1)}
+    exists_filter = getattr(database, '__movie_metadata_filter')
+
+    def filters(build, metadata, on):
+        and_where, params = [], []
+        for mk, values in metadata.items():
+            if mk[0] == '-':
+                sql, param = build(type_ids[mk[1:]], values, True)
+            else:
+                sql, param = build(type_ids[mk], values)
+            and_where.append(sql)
+            params.extend(param)
+        # The same tables under pg_temp, which is searched before mediaserver
+        sql = " and ".join(and_where).replace("mediaserver.", "pg_temp.")
+        return sql.replace("q1.movie_id", on), params
+
+    def old(metadata):
+        sql, params = filters(lambda i, v, disallow=False: count_metadata_filter(i, v), metadata, "q1.movie_id")
+        return """select * from (
+                      select movie_id, movie_title, release_year, 1 as similarity
+                      from pg_temp.movie as t order by similarity desc limit %s
+                  ) as q1 where ({})""".format(sql), [args.limit, *params]
+
+    def count(metadata):
+        sql, params = filters(lambda i, v, disallow=False: count_metadata_filter(i, v), metadata, "t.movie_id")
+        return """select movie_id, movie_title, release_year, 1 as similarity
+                  from pg_temp.movie as t where ({})
+                  order by movie_id limit %s offset %s""".format(sql), [*params, args.limit, args.offset]
+
+    def exists(metadata):
+        sql, params = filters(exists_filter, metadata, "t.movie_id")
+        return """select movie_id, movie_title, release_year, 1 as similarity
+                  from pg_temp.movie as t where ({})
+                  order by movie_id limit %s offset %s""".format(sql), [*params, args.limit, args.offset]
+
+    with database.get_connection() as conn:
+        cur = conn.cursor()
+        started = time.perf_counter()
+        cur.execute("""create temp table movie on commit drop as
+                       select i as movie_id, 'Movie ' || i as movie_title, 1950 + i %% 70 as release_year
+                       from generate_series(1, %s) i""", (args.rows,))
+        cur.execute("alter table movie add primary key (movie_id)")
+        cur.execute("""create temp table MetaData (md_id bigserial primary key,
+                       md_type_id int not null, md_value text not null) on commit drop""")
+        cur.execute("""create temp table MediaItemMetaData (media_id int, md_id bigint,
+                       primary key (media_id, md_id)) on commit drop""")
+        for name, values in BENCH_METADATA.items():
+            cur.execute("insert into MetaData (md_type_id, md_value) select %s, unnest(%s::text[])",
+                        (type_ids[name], values))
+            per_movie = "movie_id %% 3" if name == 'genre' else "0"
+            cur.execute("""insert into MediaItemMetaData
+                           select movie_id, md_ids[1 + floor(random() * cardinality(md_ids))::int]
+                           from movie, generate_series(0, {}),
+                                (select array_agg(md_id) as md_ids from MetaData where md_type_id = %s) md
+                           on conflict do nothing""".format(per_movie), (type_ids[name],))
+        cur.execute("analyze movie, MetaData, MediaItemMetaData")
+        cur.execute("select count(*) from MediaItemMetaData")
+        print("%d movies with %d metadata rows, made in %.1fs; limit %d offset %d, best of %d" % (
+            args.rows, cur.fetchone()[0], time.perf_counter() - started,
+            args.limit, args.offset, args.repeat))
+
+        def run(build, metadata):
+            sql, params = build(metadata)
+            counts = []
+            def query():
+                cur.execute(sql, params)
+                counts.append(len(cur.fetchall()))
+            return best_of(args.repeat, query) * 1000, counts[-1]
+
+        print("%-52s %16s %16s %16s" % ("filters", "old ms (rows)", "count ms (rows)", "exists ms (rows)"))
+        for metadata in METADATA_FILTERS:
+            timings = [run(build, metadata) for build in (old, count, exists)]
+            print("%-52s %s" % (
+                json.dumps(metadata)[:52],
+                " ".join("%16s" % ("%.1f (%d)" % t) for t in timings)))
+
+
+#####################################################
+#   List summaries
+#####################################################
+
+# get_all* as they were before the summary tables
+AGGREGATE_LIST_QUERIES = {
+    'artists': """select
+            a.artist_id, a.artist_name, count(amd.md_id) as count
+        from
+            mediaserver.artist a left outer join mediaserver.artistmetadata amd on (a.artist_id=amd.artist_id)
+        group by a.artist_id, a.artist_name
+        order by a.artist_name;""",
+    'songs': """select
+            s.song_id, s.song_title, string_agg(saa.artist_name,',') as artists
+        from
+            mediaserver.song s left outer join
+            (mediaserver.Song_Artists sa join mediaserver.Artist a on (sa.performing_artist_id=a.artist_id)
+            ) as saa  on (s.song_id=saa.song_id)
+        group by s.song_id, s.song_title
+        order by s.song_id""",
+    'podcasts': """select
+                p.*, pnew.count as count
+            from
+                mediaserver.podcast p,
+                (select
+                    p1.podcast_id, count(*) as count
+                from
+                    mediaserver.podcast p1 left outer join mediaserver.podcastepisode pe1 on (p1.podcast_id=pe1.podcast_id)
+                    group by p1.podcast_id) pnew
+            where p.podcast_id = pnew.podcast_id;""",
+    'tvshows': """
+        SELECT tvshow_id,
+               tvshow_title,
+               count(episode)
+        FROM mediaserver.TVShow NATURAL JOIN mediaserver.TVEpisode
+        GROUP BY tvshow_id
+        ORDER BY tvshow_id asc;
+        """,
+}
+
+SUMMARY_LIST_QUERIES = {
+    'artists': database._ALL_ARTISTS_SQL,
+    'songs': database._ALL_SONGS_SQL,
+    'podcasts': database._ALL_PODCASTS_SQL,
+    'tvshows': database._ALL_TVSHOWS_SQL,
+}
+
+# Generated stand-ins for the tables, `n` rows each (`parent` rows in the
+# table a child table refers to), with the same keys and indexes
+SUMMARY_BENCH_TABLES = [
+    ('Artist', None, """select i as artist_id, 'Artist ' || i as artist_name
+                        from generate_series(1, %(n)s) i""",
+     ["primary key (artist_id)"]),
+    ('ArtistMetaData', 'Artist', """select 1 + mod(i::bigint * 7919, %(parent)s)::int as artist_id, i::bigint as md_id
+                                    from generate_series(1, %(n)s) i""",
+     ["primary key (artist_id, md_id)"]),
+    ('Song', None, """select i as song_id, 'Song ' || i as song_title, 180 as length
+                      from generate_series(1, %(n)s) i""",
+     ["primary key (song_id)"]),
+    ('Song_Artists', 'Song', """select distinct 1 + mod(i, %(parent)s) as song_id,
+                                       1 + mod(i::bigint * 7919, %(artists)s)::int as performing_artist_id
+                                from generate_series(1, %(n)s) i""",
+     ["primary key (song_id, performing_artist_id)"]),
+    ('Podcast', None, """select i as podcast_id, 'Podcast ' || i as podcast_title,
+                                'http://example.com/' || i as podcast_uri, date '2020-01-01' as podcast_last_updated
+                         from generate_series(1, %(n)s) i""",
+     ["primary key (podcast_id)"]),
+    ('PodcastEpisode', 'Podcast', """select 1 + mod(i, %(parent)s) as podcast_id, i as media_id
+                                     from generate_series(1, %(n)s) i""",
+     ["primary key (podcast_id, media_id)"]),
+    ('TVShow', None, """select i as tvshow_id, 'Show ' || i as tvshow_title
+                        from generate_series(1, %(n)s) i""",
+     ["primary key (tvshow_id)"]),
+    ('TVEpisode', 'TVShow', """select i as media_id, 1 + mod(i, %(parent)s) as tvshow_id, 1 as season, i as episode
+                               from generate_series(1, %(n)s) i""",
+     ["primary key (media_id, tvshow_id, season, episode)", "index (tvshow_id)"]),
+]
+
+# What refresh_list_summaries() fills the summary tables with
+SUMMARY_REFRESH = {
+    'ArtistSummary': """select a.artist_id, count(amd.md_id)::int as metadata_count
+        from mediaserver.Artist a left outer join mediaserver.ArtistMetaData amd on (amd.artist_id = a.artist_id)
+        group by a.artist_id""",
+    'SongSummary': """select s.song_id, string_agg(a.artist_name, ',' order by a.artist_name) as artists
+        from mediaserver.Song s
+            left outer join (mediaserver.Song_Artists sa join mediaserver.Artist a on (a.artist_id = sa.performing_artist_id))
+            on (sa.song_id = s.song_id)
+        group by s.song_id""",
+    'PodcastSummary': """select p.podcast_id, count(pe.media_id)::int as episode_count
+        from mediaserver.Podcast p left outer join mediaserver.PodcastEpisode pe on (pe.podcast_id = p.podcast_id)
+        group by p.podcast_id""",
+    'TVShowSummary': """select t.tvshow_id, count(e.media_id)::int as episode_count
+        from mediaserver.TVShow t left outer join mediaserver.TVEpisode e on (e.tvshow_id = t.tvshow_id)
+        group by t.tvshow_id""",
+}
+
+def in_temp(sql):
+    """sql on the tables of the same names under pg_temp"""
+    return sql.replace("mediaserver.", "pg_temp.")
+
+def server_ms(cur, sql):
+    """Execution time of sql as the server reports it, without sending the rows"""
+    cur.execute("explain (analyze, timing off, format json) " + sql)
+    return cur.fetchone()[0][0]['Execution Time']
+
+def bench_summaries(args):
+    """get_all* aggregating the child tables vs reading the summary tables, at multiples of the catalog"""
+    with database.get_cursor() as cur:
+        live = {}
+        for table, _, _, _ in SUMMARY_BENCH_TABLES:
+            cur.execute("select count(*) from mediaserver.%s" % table)
+            live[table] = cur.fetchone()[0]
+    print("catalog now: " + ", ".join("%s %d" % t for t in live.items()))
+    print("server ms, best of %d" % args.repeat)
+    print("%6s %-9s %10s %10s %10s %12s" % ("scale", "listing", "rows", "aggregate", "summary", "refresh"))
+
+    for scale in args.scale:
+        with database.get_connection() as conn:
+            cur = conn.cursor()
+            counts = {}
+            for table, parent, sql, keys in SUMMARY_BENCH_TABLES:
+                # Every parent has some children to aggregate
+                n = max(live[table], live[parent] if parent else 1) * scale
+                counts[table] = n
+                cur.execute("create temp table %s on commit drop as %s" % (
+                    table, sql % {'n': n, 'parent': counts.get(parent), 'artists': counts['Artist']}))
+                for key in keys:
+                    if key.startswith('index'):
+                        cur.execute("create index on %s %s" % (table, key[len('index'):]))
+                    else:
+                        cur.execute("alter table %s add %s" % (table, key))
+                cur.execute("analyze %s" % table)
+
+            refresh = {}
+            for table, sql in SUMMARY_REFRESH.items():
+                started = time.perf_counter()
+                cur.execute("create temp table %s on commit drop as %s" % (table, in_temp(sql)))
+                cur.execute("alter table %s add primary key (%s)" % (table, table[:-len('Summary')].lower() + '_id'))
+                cur.execute("analyze %s" % table)
+                refresh[table] = (time.perf_counter() - started) * 1000
+
+            for name, summary in zip(AGGREGATE_LIST_QUERIES, SUMMARY_REFRESH):
+                timings = []
+                for sql in (AGGREGATE_LIST_QUERIES[name], SUMMARY_LIST_QUERIES[name]):
+                    sql = in_temp(sql).rstrip().rstrip(';')
+                    timings.append(min(server_ms(cur, sql) for _ in range(args.repeat)))
+                cur.execute("select count(*) from %s" % summary)
+                print("%6s %-9s %10d %10.1f %10.1f %12.1f" % (
+                    "%dx" % scale, name, cur.fetchone()[0], timings[0], timings[1], refresh[summary]))
+
+    if args.writes:
+        bench_summary_writes(args)
+
+# Child rows added for the write timings, and the trigger keeping their summary
+SUMMARY_WRITES = [
+    ('ArtistMetaData', 'artistmetadata_summary',
+     """insert into mediaserver.ArtistMetaData
+        select a.artist_id, m.md_id
+        from (select artist_id, row_number() over () as rn from mediaserver.Artist) a
+             join (select md_id, row_number() over () as rn from mediaserver.MetaData limit %s) m using (rn)
+        on conflict do nothing"""),
+    ('Song_Artists', 'song_artists_summary',
+     """insert into mediaserver.Song_Artists
+        select s.song_id, a.artist_id
+        from (select song_id, row_number() over () as rn from mediaserver.Song limit %s) s
+             join (select artist_id, row_number() over (order by artist_id desc) as rn from mediaserver.Artist) a using (rn)
+        on conflict do nothing"""),
+]
+
+def bench_summary_writes(args):
+    """Rows added to the child tables with and without their summary trigger, each rolled back"""
+    print("%d child rows added at once, rolled back; best of %d" % (args.writes, args.repeat))
+    print("%-16s %8s %14s %14s" % ("table", "rows", "no trigger ms", "trigger ms"))
+    with database.get_connection() as conn:
+        cur = conn.cursor()
+        for table, trigger, sql in SUMMARY_WRITES:
+            timings = []
+            for enabled in (False, True):
+                def run():
+                    if not enabled:
+                        cur.execute("alter table mediaserver.%s disable trigger %s" % (table, trigger))
+                    started = time.perf_counter()
+                    cur.execute(sql, (args.writes,))
+                    timings.append((time.perf_counter() - started, cur.rowcount))
+                    conn.rollback()
+                best_of(args.repeat, run)
+            plain = min(t for t, _ in timings[:args.repeat])
+            triggered = min(t for t, _ in timings[args.repeat:])
+            print("%-16s %8d %14.1f %14.1f" % (table, timings[-1][1], plain * 1000, triggered * 1000))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MediaServer benchmarks")
+    benchmarks = parser.add_subparsers(dest='benchmark')
+    benchmarks.required = True
+
+    p = benchmarks.add_parser('rows', help=bench_rows.__doc__)
+    p.add_argument('--rows', type=int, default=100000)
+    p.add_argument('--columns', type=int, default=3, choices=range(2, 5))
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=bench_rows)
+
+    p = benchmarks.add_parser('decode', help=bench_decode.__doc__)
+    p.add_argument('--rows', type=int, default=100000)
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=bench_decode)
+
+    p = benchmarks.add_parser('executemany', help=bench_executemany.__doc__)
+    p.add_argument('--rows', type=int, default=10000)
+    p.add_argument('--batch-size', type=int, nargs='+', default=[100, 1000])
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_executemany)
+
+    p = benchmarks.add_parser('fetch', help=bench_fetch.__doc__)
+    p.add_argument('--fetch-size', nargs='+', default=['100', '1000', '0', 'adaptive'])
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_fetch)
+
+    p = benchmarks.add_parser('titles', help=bench_titles.__doc__)
+    p.add_argument('--rows', type=int, default=1000000)
+    p.add_argument('--term', nargs='+', default=['star', 'the', 'love story', 'zq', '100%'])
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_titles)
+
+    p = benchmarks.add_parser('metadata', help=bench_metadata.__doc__)
+    p.add_argument('--rows', type=int, default=1000000)
+    p.add_argument('--limit', type=int, default=20)
+    p.add_argument('--offset', type=int, default=0)
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_metadata)
+
+    p = benchmarks.add_parser('summaries', help=bench_summaries.__doc__)
+    p.add_argument('--scale', type=int, nargs='+', default=[1, 10, 100])
+    p.add_argument('--writes', type=int, default=0,
+                   help="also time adding this many rows to the real child tables, rolled back")
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_summaries)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
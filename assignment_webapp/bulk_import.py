@@ -0,0 +1,66 @@
+"""
+Bulk catalogue import.
+
+Loads a CSV (with a header row) or NDJSON (one JSON object per line) file
+of movies or songs through database.import_movies / database.import_songs.
+Run from this directory (like main.py) so config.ini and the bundled
+modules are found, e.g.
+
+    python3 bulk_import.py movies new_movies.csv
+    python3 bulk_import.py songs new_songs.ndjson
+    python3 bulk_import.py songs - --format csv < new_songs.csv
+
+Movie fields: title, release_year, description, storage_location, genre
+Song fields:  title, length, description, storage_location, genre, artwork, artist
+"""
+import argparse
+import csv
+import io
+import json
+import sys
+
+from modules import *
+import database
+
+
+def read_csv(fp):
+    for row in csv.DictReader(fp):
+        yield row
+
+def read_ndjson(fp):
+    for lineno, line in enumerate(fp, 1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as e:
+                raise ValueError("line {}: {}".format(lineno, e)) from None
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+IMPORTERS = {'movies': database.import_movies, 'songs': database.import_songs}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import movies or songs")
+    parser.add_argument('kind', choices=sorted(IMPORTERS))
+    parser.add_argument('file', help="input file, or - for standard input")
+    parser.add_argument('--format', choices=sorted(READERS),
+                        help="input format (default: from the file extension, else csv)")
+    args = parser.parse_args(argv)
+
+    fmt = args.format
+    if fmt is None:
+        fmt = 'ndjson' if args.file.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+    if args.file == '-':
+        fp = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+    else:
+        fp = open(args.file, encoding='utf-8', newline='')
+    with fp:
+        result = IMPORTERS[args.kind](READERS[fmt](fp))
+
+    print("imported {rows} {kind} in {seconds:.2f}s ({rows_per_second:.0f} rows/s; "
+          "copy {copy_seconds:.2f}s, insert {insert_seconds:.2f}s)".format(
+              kind=args.kind, **result))
+
+if __name__ == '__main__':
+    main()
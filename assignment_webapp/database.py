@@ -3,12 +3,27 @@ MediaServer Database module.
 Contains all interactions between the webapp and the queries to the database.
 """
 
+import atexit
+import bisect
 import configparser
+import csv
+import functools
+import hashlib
+import io
 import json
+import logging
+import random
+import re
 import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
 from contextlib import contextmanager
 from typing import Iterable
 from modules import pg8000
+from flask import g, has_app_context
+from werkzeug.contrib.cache import SharedMemoryCache
 
 class UserException(Exception):
     """Used for display information for user,
@@ -17,36 +32,535 @@ class UserException(Exception):
 class NoResultFound(Exception):
     pass
 
+class PoolTimeout(Exception):
+    """No pooled connection became free within the pool's wait timeout"""
+
 _db_config = configparser.ConfigParser()
 with open('config.ini', "r") as fp:
     _db_config.read_file(fp)
 
 
-@contextmanager
-def get_connection():
-    conn = pg8000.connect(
-        database=_db_config['DATABASE']['database'],
+def _fetch_size(value):
+    # rows per round trip: a number, 0 for all at once, or 'adaptive'
+    return value if value == 'adaptive' else int(value)
+
+def _connect():
+    return pg8000.connect(
+        database=_db_config['DATABASE'].get('database', _db_config['DATABASE']['user']),
         user=_db_config['DATABASE']['user'],
         password=_db_config['DATABASE']['password'],
         host=_db_config['DATABASE']['host'],
+        max_prepared_statements=_db_config.getint('POOL', 'max_prepared_statements', fallback=256),
+        fetch_size=_fetch_size(_db_config.get('POOL', 'fetch_size', fallback='100')),
     )
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of pg8000 connections.
+
+    Connections are opened lazily, at most `max_size` at a time. Idle
+    connections unused for `max_idle` seconds are closed, but the pool never
+    shrinks below `min_size` that way. A connection that sat idle for longer
+    than `ping_after` seconds is checked with a `select 1` before it is handed
+    out. When every connection is borrowed, `acquire` waits up to
+    `wait_timeout` seconds and then raises PoolTimeout.
+    """
+
+    def __init__(self, connect, min_size=1, max_size=10, max_idle=300.0,
+                 ping_after=30.0, wait_timeout=10.0):
+        if max_size < 1 or not 0 <= min_size <= max_size:
+            raise ValueError("pool size must satisfy 0 <= min_size <= max_size and max_size >= 1")
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self.wait_timeout = wait_timeout
+
+        self._cond = threading.Condition()
+        self._idle = []     # (conn, released_at), most recently released last
+        self._size = 0      # idle + borrowed + being opened
+        self._closed = False
+        self._opened = weakref.WeakSet()
+        self._stats = {'borrowed': 0, 'waiting': 0, 'created': 0, 'discarded': 0}
+
+    def stats(self):
+        """
+        borrowed/waiting are the current number of connections handed out and
+        callers blocked on the pool; created/discarded are running totals.
+        """
+        with self._cond:
+            return dict(self._stats, idle=len(self._idle), size=self._size)
+
+    def open_connections(self):
+        with self._cond:
+            return [conn for conn in self._opened if conn._sock is not None]
+
+    def acquire(self):
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            conn, released_at = self._checkout(deadline)
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    self._forget()
+                    raise
+                with self._cond:
+                    self._stats['created'] += 1
+                    self._opened.add(conn)
+            elif time.monotonic() - released_at > self.ping_after and not self._is_alive(conn):
+                self._discard(conn)
+                continue
+            with self._cond:
+                self._stats['borrowed'] += 1
+            return conn
+
+    def release(self, conn):
+        broken = False
+        if conn._sock is not None and conn.in_transaction:
+            try:
+                conn.rollback()
+            except Exception:
+                # State unknown: don't hand it to the next borrower
+                broken = True
+        with self._cond:
+            self._stats['borrowed'] -= 1
+            closed = self._closed
+        if closed or broken or conn._sock is None:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close every idle connection; borrowed ones are closed on release"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def _checkout(self, deadline):
+        """Either an idle (conn, released_at) or (None, None) meaning
+        a slot was reserved for a new connection"""
+        with self._cond:
+            expired = self._evict_idle()
+        for conn in expired:
+            self._close_quietly(conn)
+
+        with self._cond:
+            if self._closed:
+                raise PoolTimeout("connection pool is closed")
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        f"no database connection free after {self.wait_timeout}s "
+                        f"({self.max_size} in use)")
+                self._stats['waiting'] += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._stats['waiting'] -= 1
+
+    def _evict_idle(self):
+        """Drop connections idle longer than max_idle, oldest first.
+        Must hold the lock; the caller closes what is returned."""
+        now = time.monotonic()
+        expired = []
+        while (self._idle and self._size > self.min_size
+               and now - self._idle[0][1] > self.max_idle):
+            expired.append(self._idle.pop(0)[0])
+            self._size -= 1
+            self._stats['discarded'] += 1
+        return expired
+
+    def _is_alive(self, conn):
+        if conn._sock is None:
+            return False
+        autocommit = conn.autocommit
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            cur.execute("select 1")
+            cur.close()
+            return True
+        except Exception:
+            return False
+        finally:
+            conn.autocommit = autocommit
+
+    def _discard(self, conn):
+        self._forget(discarded=True)
+        self._close_quietly(conn)
+
+    def _forget(self, discarded=False):
+        with self._cond:
+            self._size -= 1
+            if discarded:
+                self._stats['discarded'] += 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            if conn._sock is not None:
+                conn.close()
+        except Exception:
+            pass
+
+
+_pool = ConnectionPool(
+    _connect,
+    min_size=_db_config.getint('POOL', 'min_size', fallback=1),
+    max_size=_db_config.getint('POOL', 'max_size', fallback=10),
+    max_idle=_db_config.getfloat('POOL', 'max_idle', fallback=300.0),
+    ping_after=_db_config.getfloat('POOL', 'ping_after', fallback=30.0),
+    wait_timeout=_db_config.getfloat('POOL', 'wait_timeout', fallback=10.0),
+)
+atexit.register(_pool.close)
+
+def pool_stats():
+    return _pool.stats()
+
+def statement_cache_stats():
+    """pg8000 prepared statement cache counters, summed over the pool's open connections"""
+    totals = {}
+    for conn in _pool.open_connections():
+        for name, stats in conn.statement_cache_stats().items():
+            total = totals.setdefault(name, {})
+            for k, v in stats.items():
+                total[k] = total.get(k, 0) + v
+    return totals
+
+
+class QueryStats:
+    """
+    Aggregated query metrics keyed by call site, i.e. the public function
+    in this module that opened the cursor. Each get_cursor() block counts
+    as one call: its latency, the connection wait before it, and the rows
+    and bytes of row data decoded while it ran.
+
+    Calls slower than `slow_ms` are logged as warnings, failed ones as
+    errors, and a `sample_rate` fraction of the rest at info level. Log
+    records are single-line JSON objects.
+    """
+
+    # Upper bounds of the latency histogram buckets, in milliseconds
+    BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+    def __init__(self, slow_ms=200.0, sample_rate=0.01, logger=None):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.log = logger or logging.getLogger(__name__ + '.queries')
+        self._lock = threading.Lock()
+        self._sites = {}
+
+    def record(self, site, seconds, wait, rows, nbytes, statements=(), error=None):
+        ms = seconds * 1000.0
+        wait_ms = wait * 1000.0
+        with self._lock:
+            s = self._sites.get(site)
+            if s is None:
+                s = self._sites[site] = {
+                    'calls': 0, 'errors': 0, 'slow': 0, 'rows': 0, 'bytes': 0,
+                    'total_ms': 0.0, 'max_ms': 0.0, 'wait_ms': 0.0, 'max_wait_ms': 0.0,
+                    'histogram': [0] * (len(self.BUCKETS_MS) + 1),
+                }
+            s['calls'] += 1
+            s['rows'] += rows
+            s['bytes'] += nbytes
+            s['total_ms'] += ms
+            s['max_ms'] = max(s['max_ms'], ms)
+            s['wait_ms'] += wait_ms
+            s['max_wait_ms'] = max(s['max_wait_ms'], wait_ms)
+            s['histogram'][bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+            if error is not None:
+                s['errors'] += 1
+            if ms >= self.slow_ms:
+                s['slow'] += 1
+
+        if error is not None:
+            level = logging.ERROR
+        elif ms >= self.slow_ms:
+            level = logging.WARNING
+        elif random.random() < self.sample_rate:
+            level = logging.INFO
+        else:
+            return
+        if self.log.isEnabledFor(level):
+            event = {
+                'site': site, 'ms': round(ms, 3), 'wait_ms': round(wait_ms, 3),
+                'rows': rows, 'bytes': nbytes,
+                'sql': [" ".join(sql.split()) for sql in statements],
+            }
+            if error is not None:
+                event['error'] = repr(error)
+            self.log.log(level, json.dumps(event, default=str))
+
+    def snapshot(self):
+        with self._lock:
+            sites = {site: dict(s, histogram=list(s['histogram']))
+                     for site, s in self._sites.items()}
+        bounds = ["<=%g" % b for b in self.BUCKETS_MS] + [">%g" % self.BUCKETS_MS[-1]]
+        for s in sites.values():
+            hist = s['histogram']
+            s['mean_ms'] = s['total_ms'] / s['calls']
+            for q in (50, 95, 99):
+                s['p%d_ms' % q] = self._percentile(hist, q, s['max_ms'])
+            s['histogram'] = dict(zip(bounds, hist))
+        return sites
+
+    def reset(self):
+        with self._lock:
+            self._sites.clear()
+
+    def _percentile(self, hist, q, max_ms):
+        """Upper bound of the bucket holding the q-th percentile"""
+        rank = sum(hist) * q / 100.0
+        seen = 0
+        for bound, count in zip(self.BUCKETS_MS, hist):
+            seen += count
+            if seen >= rank:
+                return min(bound, max_ms)
+        return max_ms
+
+
+_query_stats = QueryStats(
+    slow_ms=_db_config.getfloat('QUERYLOG', 'slow_ms', fallback=200.0),
+    sample_rate=_db_config.getfloat('QUERYLOG', 'sample_rate', fallback=0.01),
+)
+
+def query_stats():
+    return _query_stats.snapshot()
+
+def reset_query_stats():
+    _query_stats.reset()
+
+# Helpers that run queries on behalf of the function being measured
+_NOT_CALL_SITES = {'get_cursor', 'get_connection', 'dictfetchall', 'dictfetchone'}
+
+def _call_site():
+    """Name of the public function in this module that is running the query,
+    or module.function of the outside caller if there is none"""
+    frame = sys._getframe(1)
+    while frame is not None:
+        name = frame.f_code.co_name
+        if frame.f_globals is globals():
+            if name[0] not in '_<' and name not in _NOT_CALL_SITES:
+                return name
+        elif frame.f_globals.get('__name__') != 'contextlib':
+            return "%s.%s" % (frame.f_globals.get('__name__'), name)
+        frame = frame.f_back
+    return 'unknown'
+
+
+# The statements this thread's cursors run while capture_statements() is
+# active, with their parameters
+_captured = threading.local()
+
+@contextmanager
+def capture_statements():
+    """
+    Collect the (sql, params) of every statement run through get_cursor in
+    this thread until the block ends, e.g. to EXPLAIN what a function runs
+    """
+    statements = _captured.statements = []
     try:
-        yield conn
-        conn.commit()
-    except Exception:
-        conn.rollback()
-        raise
+        yield statements
     finally:
-        conn.close()
+        _captured.statements = None
+
+def _capture(operation, args):
+    statements = getattr(_captured, 'statements', None)
+    if statements is not None:
+        statements.append((operation, args))
+
+
+class _TracedCursor(pg8000.Cursor):
+    """Cursor that keeps the statements it ran, for the query log"""
+
+    def __init__(self, connection):
+        super().__init__(connection)
+        self.statements = []
+
+    def execute(self, operation, args=None, stream=None):
+        self.statements.append(operation)
+        _capture(operation, args)
+        return super().execute(operation, args, stream)
+
+    def executemany(self, operation, param_sets):
+        self.statements.append(operation)
+        return super().executemany(operation, param_sets)
+
+    def pipelined(self, queries):
+        """Run (sql, params) pairs in one round trip; one cursor per query"""
+        with self._c.pipeline() as p:
+            cursors = [p.execute(sql, params) for sql, params in queries]
+        self.statements.extend(sql for sql, _ in queries)
+        for sql, params in queries:
+            _capture(sql, params)
+        return cursors
+
+
+class _UnitOfWork:
+    """
+    One pooled connection and one transaction shared by every
+    get_connection() call made while it is bound to the app context.
+    The connection is only borrowed when the first query runs.
+    """
+
+    def __init__(self):
+        self.conn = None
+        self.catalog_changed = False
+        # _catalog_state(), once read
+        self.catalog_state = None
+        self._on_close = []
+
+    def connection(self):
+        if self.conn is None:
+            self.conn = _pool.acquire()
+        return self.conn
+
+    def on_close(self, callback):
+        """
+        Call callback(committed) once the transaction has ended, with
+        whether it was committed
+        """
+        self._on_close.append(callback)
+
+    def abort(self):
+        """Roll back everything done so far; later queries start afresh"""
+        if self.conn is not None and self.conn._sock is not None:
+            self.conn.rollback()
+        self._ended(False)
+
+    def commit(self):
+        if self.conn is not None and self.conn._sock is not None and self.conn.in_transaction:
+            # The server rolls a failed transaction back whatever it's told
+            committed = not self.conn.in_failed_transaction
+            self.conn.commit()
+            self._ended(committed)
+
+    def close(self, commit=True):
+        conn, self.conn = self.conn, None
+        committed = False
+        try:
+            if conn is None:
+                return
+            try:
+                if conn._sock is not None and conn.in_transaction:
+                    if commit and not conn.in_failed_transaction:
+                        conn.commit()
+                        committed = True
+                    else:
+                        conn.rollback()
+            finally:
+                _pool.release(conn)
+        finally:
+            self._ended(committed)
+
+    def _ended(self, committed):
+        self.catalog_changed = False
+        self.catalog_state = None
+        callbacks, self._on_close = self._on_close, []
+        for callback in callbacks:
+            callback(committed)
+
+def _current_unit_of_work():
+    if has_app_context():
+        return g.get('_db_unit_of_work')
+    return None
+
+def open_request_session():
+    """
+    Make every database call for the rest of this request share one
+    connection and one transaction. Call from a before_request hook.
+    """
+    g._db_unit_of_work = _UnitOfWork()
+
+def commit_request_session():
+    """Commit the request's transaction, e.g. from an after_request hook
+    so a failing commit still turns into an error response"""
+    uow = _current_unit_of_work()
+    if uow is not None:
+        uow.commit()
+
+def close_request_session(exc=None):
+    """Commit (or roll back if `exc` is set) and give the connection back
+    to the pool. Call from a teardown_request hook."""
+    uow = _current_unit_of_work()
+    if uow is not None:
+        del g._db_unit_of_work
+        uow.close(commit=exc is None)
+
+
+@contextmanager
+def get_connection():
+    uow = _current_unit_of_work()
+    if uow is not None:
+        conn = uow.connection()
+        try:
+            yield conn
+        except Exception as e:
+            # Only a failed statement breaks the transaction; the request's
+            # earlier writes stay when e.g. a UserException is caught
+            if isinstance(e, pg8000.Error) or conn.in_failed_transaction:
+                uow.abort()
+            raise
+        return
+
+    with _pool.connection() as conn:
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if conn._sock is not None:
+                conn.rollback()
+            raise
 
 @contextmanager
-def get_cursor():
+def get_cursor(fetch_size=None):
+    """
+    A cursor on the current connection whose queries go to the query log.
+    `fetch_size` overrides the connection's rows per round trip, e.g. 0 for
+    a result that is read into a list anyway.
+    """
+    site = _call_site()
+    started = time.perf_counter()
     with get_connection() as conn:
-        cur = conn.cursor()
+        waited = time.perf_counter() - started
+        rows, nbytes = conn.rows_received, conn.bytes_received
+        cur = _TracedCursor(conn)
+        cur.fetch_size = fetch_size
+        error = None
         try:
             yield cur
+        except Exception as e:
+            error = e
+            raise
         finally:
             cur.close()
+            _query_stats.record(
+                site, time.perf_counter() - started - waited, waited,
+                conn.rows_received - rows, conn.bytes_received - nbytes,
+                cur.statements, error)
 
 ################################################################################
 #   Welcome to the database file, where all the query magic happens.
@@ -66,43 +580,85 @@ def get_cursor():
 ################################################################################
 
 #####################################################
-#   Database Connect
-#   (No need to touch
-#       (unless the exception is potatoing))
+#   Row factories
+#   A row factory is called once per result with the column names and
+#   returns the function that turns each row's values into a row object.
+#       dict_row:    {col1name:col1value, col2name:col2value, etc.}
+#       slotted_row: a tuple with row['col1name'] and row.col1name access
 #####################################################
 
-def database_connect():
+def dict_row(cols):
+    """Row factory building a fresh dict per row"""
+    return lambda values: {a:b for a,b in zip(cols, values)}
+
+class Row(tuple):
     """
-    Connects to the database using the connection string.
-    If 'None' was returned it means there was an issue connecting to
-    the database. It would be wise to handle this ;)
+    Base class of the row classes made by slotted_row. A row is a plain
+    tuple of the values; the column names live once on its class, so a
+    row is far smaller than a dict. Columns can be read as row['col'],
+    row.col or row[0], and keys()/get()/items() behave as on a dict.
     """
-    config = configparser.ConfigParser()
-    with open('config.ini', "r") as fp:
-        config.read_file(fp)
-    if 'database' not in config['DATABASE']:
-        config['DATABASE']['database'] = config['DATABASE']['user']
+    __slots__ = ()
+    _fields = ()
+    _index = {}
 
-    # Create a connection to the database
-    return pg8000.connect(database=config['DATABASE']['database'],
-                          user=config['DATABASE']['user'],
-                          password=config['DATABASE']['password'],
-                          host=config['DATABASE']['host'])
+    def __getitem__(self, key, _getitem=tuple.__getitem__):
+        if key.__class__ is str:
+            try:
+                key = self._index[key]
+            except KeyError:
+                raise KeyError(key) from None
+        return _getitem(self, key)
 
-##################################################
-# Print a SQL string to see how it would insert  #
-##################################################
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
-def print_sql_string(inputstring, params=None):
-    """
-    Prints out a string as a SQL string parameterized assuming all strings
-    """
+    def keys(self):
+        return self._fields
+
+    def items(self):
+        return zip(self._fields, self)
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def __repr__(self):
+        return "Row(%s)" % ", ".join("%s=%r" % kv for kv in zip(self._fields, self))
+
+    def __reduce__(self):
+        # Row classes are made at run time, so pickle can't find them by name
+        return _unpickle_row, (self._fields, tuple(self))
+
+def _column_getter(i, _getitem=tuple.__getitem__):
+    # Not operator.itemgetter, which would go through Row.__getitem__
+    return lambda row: _getitem(row, i)
 
-    if params is not None:
-        if params != []:
-           inputstring = inputstring.replace("%s","'%s'")
+@functools.lru_cache(maxsize=256)
+def _row_class(cols):
+    namespace = {
+        '__slots__': (),
+        '_fields': cols,
+        '_index': {col: i for i, col in enumerate(cols)},
+    }
+    for i, col in enumerate(cols):
+        # Columns win over tuple methods (a "count" column is common)
+        # but not over the Row API or private names
+        if col.isidentifier() and not col.startswith('_') and col not in Row.__dict__:
+            namespace[col] = property(_column_getter(i))
+    return type('Row', (Row,), namespace)
 
-    print(inputstring % params)
+def slotted_row(cols):
+    """Row factory building instances of one Row class per result shape"""
+    return _row_class(tuple(cols))
+
+def _unpickle_row(cols, values):
+    return _row_class(cols)(values)
+
+def _columns(cursor):
+    return [a[0].decode("utf-8") for a in cursor.description]
 
 #####################################################
 #   SQL Dictionary Fetch
@@ -114,53 +670,734 @@ def print_sql_string(inputstring, params=None):
 #       multiplerow: [{col1name:col1value,col2name:col2value, etc.},
 #           {col1name:col1value,col2name:col2value, etc.},
 #           etc.]
+#   Pass row_factory=slotted_row for compact rows instead of dicts
 #####################################################
 
-def dictfetchall(cursor,sqltext,params=None):
+def dictfetchall(cursor,sqltext,params=None,row_factory=dict_row):
     """ Returns query results as list of dictionaries."""
 
-    result = []
-    if (params is None):
-        print(sqltext)
-    else:
-        print("we HAVE PARAMS!")
-        print_sql_string(sqltext,params)
-
     cursor.execute(sqltext,params)
-    cols = [a[0].decode("utf-8") for a in cursor.description]
-    print(cols)
-    returnres = cursor.fetchall()
-    for row in returnres:
-        result.append({a:b for a,b in zip(cols, row)})
-    # cursor.close()
-    return result
+    return _make_rows(cursor, row_factory)
 
-def dictfetchone(cursor,sqltext,params=None):
+def dictfetchone(cursor,sqltext,params=None,row_factory=dict_row):
     """ Returns query results as list of dictionaries."""
     # cursor = conn.cursor()
-    result = []
     cursor.execute(sqltext,params)
-    cols = [a[0].decode("utf-8") for a in cursor.description]
-    returnres = cursor.fetchone()
-    result.append({a:b for a,b in zip(cols, returnres)})
-    return result
+    make_row = row_factory(_columns(cursor))
+    return [make_row(cursor.fetchone())]
+
+def _make_rows(cursor, row_factory=dict_row):
+    make_row = row_factory(_columns(cursor))
+    return [make_row(row) for row in cursor.fetchall()]
 
-def _fetch_all(cursor, sqltext, params=None):
+def _iter_rows(cursor, sqltext, params=None, row_factory=dict_row):
+    """Yield rows while pg8000 reads them, a batch at a time"""
     cursor.execute(sqltext, params)
+    make_row = row_factory(_columns(cursor))
+    for row in cursor:
+        yield make_row(row)
 
-    cols = [a[0].decode("utf-8") for a in cursor.description]
-    return [
-        {a:b for a,b in zip(cols, row)} for row in cursor.fetchall()
-    ]
+def _fetch_all(cursor, sqltext, params=None, row_factory=dict_row):
+    cursor.execute(sqltext, params)
+    return _make_rows(cursor, row_factory)
 
-def _fetch_one(cur, sql, params=None):
+def _fetch_all_pipelined(*queries, row_factory=dict_row):
+    """
+    Run several (sql, params) queries in one network round trip and
+    return one list of rows per query, in order.
+    """
+    with get_cursor() as cur:
+        return [_make_rows(c, row_factory) for c in cur.pipelined(queries)]
+
+def _fetch_one(cur, sql, params=None, row_factory=dict_row):
     cur.execute(sql, params)
-    cols = [a[0].decode("utf-8") for a in cur.description]
     r = cur.fetchone()
     if r:
-        return {a:b for a,b in zip(cols, r)}
+        return row_factory(_columns(cur))(r)
     raise NoResultFound
 
+
+#####################################################
+#   Shared cache
+#   With a [SHAREDCACHE] path set, the caches below keep
+#   their entries in one memory-mapped file that every
+#   worker process on this machine opens.
+#####################################################
+
+def _open_shared_cache():
+    path = _db_config.get('SHAREDCACHE', 'path', fallback='')
+    if not path:
+        return None
+    return SharedMemoryCache(
+        path,
+        size=_db_config.getint('SHAREDCACHE', 'size_mb', fallback=64) * 1024 * 1024,
+        slot_size=_db_config.getint('SHAREDCACHE', 'slot_size', fallback=1024),
+    )
+
+_shared_cache = _open_shared_cache()
+
+def shared_cache_stats():
+    return None if _shared_cache is None else _shared_cache.stats()
+
+#####################################################
+#   Reference data
+#   Small lookup tables that almost never change,
+#   kept in memory instead of read on every call.
+#####################################################
+
+class ReferenceTable:
+    """
+    A lookup table read whole by `load()` into a {name: id} dict and
+    served from memory. It is read again on the first use more than `ttl`
+    seconds after the last load, or on the next use after refresh().
+    """
+
+    def __init__(self, load, ttl=3600.0):
+        self.load = load
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._tables = None
+        self._expires = 0.0
+        self.loads = 0
+        self.loaded_at = None
+
+    def ids(self):
+        """{name: id}"""
+        return self._current()[0]
+
+    def names(self):
+        """{id: name}"""
+        return self._current()[1]
+
+    def refresh(self):
+        """Read the table again on next use"""
+        self._expires = 0.0
+
+    def stats(self):
+        tables = self._tables
+        return {
+            'size': 0 if tables is None else len(tables[0]),
+            'loads': self.loads,
+            'age_s': None if self.loaded_at is None else time.time() - self.loaded_at,
+        }
+
+    def _current(self):
+        tables = self._tables
+        if tables is not None and time.monotonic() < self._expires:
+            return tables
+        with self._lock:
+            # Another thread may have loaded it while we waited
+            if self._tables is None or time.monotonic() >= self._expires:
+                ids = self.load()
+                self._tables = ids, {v: k for k, v in ids.items()}
+                self.loads += 1
+                self.loaded_at = time.time()
+                self._expires = time.monotonic() + self.ttl
+            return self._tables
+
+
+class SharedReferenceTable(ReferenceTable):
+    """
+    A ReferenceTable kept under `key` in `backend`, a cache shared by the
+    worker processes, so the table is read once for all of them and a
+    refresh() in one is seen by all.
+    """
+
+    def __init__(self, load, key, backend, ttl=3600.0):
+        super().__init__(load, ttl)
+        self.key = key
+        self.backend = backend
+
+    def refresh(self):
+        self.backend.delete(self.key)
+
+    def _current(self):
+        shared = self.backend.get(self.key)    # (loaded_at, {name: id})
+        tables = self._tables
+        if shared is not None and tables is not None and shared[0] == self.loaded_at:
+            return tables
+        with self._lock:
+            if shared is None:
+                shared = time.time(), self.load()
+                self.backend.set(self.key, shared, timeout=self.ttl)
+                self.loads += 1
+            self.loaded_at, ids = shared
+            self._tables = ids, {v: k for k, v in ids.items()}
+            return self._tables
+
+
+def read_metadata_types():
+    """{md_type_name: md_type_id}, straight from the database"""
+    with get_cursor() as cur:
+        cur.execute("""select md_type_name, md_type_id from mediaserver.MetaDataType;""")
+        return dict(cur.fetchall())
+
+def read_contact_types():
+    """{contact_type_name: contact_type_id}, straight from the database"""
+    with get_cursor() as cur:
+        cur.execute("""select contact_type_name, contact_type_id from mediaserver.ContactType;""")
+        return dict(cur.fetchall())
+
+_REFERENCE_TTL = _db_config.getfloat('REFERENCEDATA', 'ttl', fallback=3600.0)
+if _shared_cache is None:
+    _metadata_types = ReferenceTable(read_metadata_types, _REFERENCE_TTL)
+    _contact_types = ReferenceTable(read_contact_types, _REFERENCE_TTL)
+else:
+    _metadata_types = SharedReferenceTable(
+        read_metadata_types, 'reference/metadata_types', _shared_cache, _REFERENCE_TTL)
+    _contact_types = SharedReferenceTable(
+        read_contact_types, 'reference/contact_types', _shared_cache, _REFERENCE_TTL)
+
+def metadata_type_ids():
+    return _metadata_types.ids()
+
+def metadata_type_names():
+    return _metadata_types.names()
+
+def contact_type_ids():
+    return _contact_types.ids()
+
+def refresh_reference_data():
+    """Forget the cached lookup tables, e.g. after editing one by hand"""
+    _metadata_types.refresh()
+    _contact_types.refresh()
+
+def reference_data_stats():
+    return {'metadata_types': _metadata_types.stats(),
+            'contact_types': _contact_types.stats()}
+
+def _name_metadata_types(rows):
+    """Fill in md_type_name from md_type_id, for queries that skip the MetaDataType join"""
+    names = metadata_type_names()
+    for r in rows:
+        r['md_type_name'] = names.get(r['md_type_id'])
+    return rows
+
+#####################################################
+#   Catalog version
+#   Moved on by triggers whenever the catalog tables
+#   change, whoever changes them (see
+#   migrations/006_catalog_version.sql). The caches
+#   below keep what they read under the version it
+#   was read at.
+#####################################################
+
+def _catalog_state():
+    """
+    (version, changed_at) of the catalog as committed, read once per request
+    and on every call outside one
+    """
+    uow = _current_unit_of_work()
+    if uow is not None and uow.catalog_state is not None:
+        return uow.catalog_state
+    with get_cursor() as cur:
+        cur.execute("""select version, extract(epoch from changed_at)::float8
+                       from mediaserver.CatalogVersion""")
+        state = tuple(cur.fetchone())
+    if uow is not None:
+        uow.catalog_state = state
+    return state
+
+def catalog_version():
+    """
+    (version, changed_at): a string that changes whenever the catalog does,
+    whoever changes it, and the Unix time that last happened
+    """
+    version, changed_at = _catalog_state()
+    return str(version), changed_at
+
+def catalog_changed():
+    """
+    Call after writing to the catalog, so this process drops what it has
+    cached straight away; the catalog version moves on by itself. Inside a
+    request the caches are also bypassed for the rest of it, as its writes
+    aren't committed yet.
+    """
+    uow = _current_unit_of_work()
+    if uow is None:
+        _bump_catalog()
+    elif not uow.catalog_changed:
+        uow.catalog_changed = True
+        uow.on_close(_bump_catalog)
+
+def _bump_catalog(committed=True):
+    if not committed:
+        return
+    _catalog_cache.bump()
+    _search_cache.bump()
+
+#####################################################
+#   Catalog listing cache
+#   get_all* / iter_all* results, kept until the
+#   catalog changes. They're kept as slotted rows and
+#   handed out as dicts unless the caller passes
+#   row_factory=slotted_row.
+#####################################################
+
+class CatalogCache:
+    """
+    Listing results keyed by name, each kept with the catalog version it
+    was read at and only handed out at that version, so readers never get
+    data older than the last committed write. bump() drops everything
+    early, after a write by this process.
+
+    At most `max_entries` results are kept, least recently used first out,
+    and results of more than `max_rows` rows are not kept at all.
+    """
+
+    def __init__(self, max_entries=16, max_rows=100000):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # name: (version, rows)
+        self.hits = self.misses = self.evictions = self.bumps = 0
+
+    def get(self, name, version):
+        """The rows read at `version`, or None"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] != version:
+                del self._entries[name]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, name, version, rows):
+        if self.max_entries <= 0 or len(rows) > self.max_rows:
+            return
+        with self._lock:
+            self._entries[name] = (version, rows)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def bump(self):
+        with self._lock:
+            self.bumps += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'rows': sum(len(rows) for _, rows in self._entries.values()),
+                'max_entries': self.max_entries, 'max_rows': self.max_rows,
+                'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'bumps': self.bumps,
+            }
+
+
+class SharedCatalogCache(CatalogCache):
+    """
+    A CatalogCache whose listings are kept in `backend` as well, a cache
+    shared by the worker processes, so a listing read by one is there for
+    all. Listings are still kept in this process too.
+    """
+
+    def __init__(self, backend, max_entries=16, max_rows=100000):
+        super().__init__(max_entries, max_rows)
+        self.backend = backend
+        self.shared_hits = 0
+
+    def get(self, name, version):
+        rows = super().get(name, version)
+        if rows is None and self.max_entries > 0:
+            rows = self.backend.get(self._key(version, name))
+            if rows is not None:
+                with self._lock:
+                    self.misses -= 1
+                    self.shared_hits += 1
+                super().put(name, version, rows)
+        return rows
+
+    def put(self, name, version, rows):
+        if self.max_entries <= 0 or len(rows) > self.max_rows:
+            return
+        super().put(name, version, rows)
+        # Under its version, so it is never read once the catalog has changed
+        self.backend.set(self._key(version, name), rows, timeout=0)
+
+    def stats(self):
+        stats = super().stats()
+        stats['shared_hits'] = self.shared_hits
+        return stats
+
+    @staticmethod
+    def _key(version, name):
+        return 'catalog/%d/%s' % (version, name)
+
+
+if _shared_cache is None:
+    _catalog_cache = CatalogCache(
+        max_entries=_db_config.getint('CATALOGCACHE', 'max_entries', fallback=16),
+        max_rows=_db_config.getint('CATALOGCACHE', 'max_rows', fallback=100000),
+    )
+else:
+    _catalog_cache = SharedCatalogCache(
+        _shared_cache,
+        max_entries=_db_config.getint('CATALOGCACHE', 'max_entries', fallback=16),
+        max_rows=_db_config.getint('CATALOGCACHE', 'max_rows', fallback=100000),
+    )
+
+def catalog_cache_stats():
+    return _catalog_cache.stats()
+
+def _catalog_lookup(name):
+    """(version, rows); both None when the cache is bypassed, rows None on a miss"""
+    uow = _current_unit_of_work()
+    if uow is not None and uow.catalog_changed:
+        # This request's own writes aren't in the cache, or committed yet
+        return None, None
+    version = _catalog_state()[0]
+    return version, _catalog_cache.get(name, version)
+
+def _cached_listing(name, sql, row_factory=dict_row):
+    version, rows = _catalog_lookup(name)
+    if rows is None:
+        with get_cursor(fetch_size=0) as cur:
+            rows = dictfetchall(cur, sql, row_factory=slotted_row)
+        if version is not None:
+            _catalog_cache.put(name, version, rows)
+    # Rows are immutable, the list isn't
+    return list(_made_by(row_factory, rows))
+
+def _iter_cached_listing(name, sql, row_factory=dict_row):
+    version, rows = _catalog_lookup(name)
+    if rows is None:
+        rows = _iter_caching(name, sql, version)
+    yield from _made_by(row_factory, rows)
+
+def _iter_caching(name, sql, version):
+    # Keep what streams past, unless it grows too big to cache
+    rows = [] if version is not None else None
+    with get_cursor() as cur:
+        for row in _iter_rows(cur, sql, row_factory=slotted_row):
+            if rows is not None:
+                rows.append(row)
+                if len(rows) > _catalog_cache.max_rows:
+                    rows = None
+            yield row
+    if rows is not None:
+        _catalog_cache.put(name, version, rows)
+
+def _made_by(row_factory, rows):
+    """
+    The cache keeps slotted rows; they're handed out as they are unless the
+    caller asked for another kind, e.g. the dicts get_all* return by default
+    """
+    if row_factory is slotted_row:
+        yield from rows
+        return
+    make_row = None
+    for row in rows:
+        if make_row is None:
+            make_row = row_factory(row._fields)
+        yield make_row(row)
+
+#####################################################
+#   Search result cache
+#   The same searches come in over and over, e.g. a
+#   prefix per keystroke from /api/gethint.
+#####################################################
+
+class SearchCache:
+    """
+    Search results keyed by the normalised query. Entries expire `ttl`
+    seconds after they were stored, and once their estimated size passes
+    `max_bytes` the least recently used go first. Like CatalogCache's, an
+    entry is only handed out at the catalog version it was read at, and
+    bump() drops everything.
+    """
+
+    def __init__(self, max_bytes=8 * 1024 * 1024, ttl=300.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # key: (expires, nbytes, version, rows)
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key, version):
+        """The rows read at `version`, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] <= time.monotonic() or entry[2] != version):
+                self._drop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[3]
+
+    def put(self, key, version, rows):
+        nbytes = _approx_size(rows)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + self.ttl, nbytes, version, rows)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def bump(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries), 'bytes': self.nbytes,
+                'max_bytes': self.max_bytes, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+                'evictions': self.evictions, 'expirations': self.expirations,
+            }
+
+    def _drop(self, key):
+        self.nbytes -= self._entries.pop(key)[1]
+
+
+def _approx_size(rows):
+    """Rough bytes held by a list of dict rows, not counting shared keys"""
+    size = sys.getsizeof(rows)
+    for r in rows:
+        size += sys.getsizeof(r) + sum(sys.getsizeof(v) for v in r.values())
+    return size
+
+class SharedSearchCache(SearchCache):
+    """
+    A SearchCache kept in `backend`, a cache shared by the worker processes,
+    under the catalog version like SharedCatalogCache's. Entries still
+    expire after `ttl`; room is up to the backend, which evicts as it needs to.
+    """
+
+    def __init__(self, backend, ttl=300.0):
+        super().__init__(max_bytes=0, ttl=ttl)
+        self.backend = backend
+
+    def get(self, key, version):
+        rows = self.backend.get(self._key(version, key))
+        with self._lock:
+            if rows is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return rows
+
+    def put(self, key, version, rows):
+        self.backend.set(self._key(version, key), rows, timeout=self.ttl)
+
+    def bump(self):
+        # Nothing to drop: the next reads are under the new version
+        pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'shared': True, 'ttl': self.ttl,
+                'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else None,
+            }
+
+    @staticmethod
+    def _key(version, key):
+        digest = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+        return 'search/%d/%s' % (version, digest)
+
+
+if _shared_cache is None:
+    _search_cache = SearchCache(
+        max_bytes=_db_config.getint('SEARCHCACHE', 'max_kb', fallback=8192) * 1024,
+        ttl=_db_config.getfloat('SEARCHCACHE', 'ttl', fallback=300.0),
+    )
+else:
+    _search_cache = SharedSearchCache(
+        _shared_cache, ttl=_db_config.getfloat('SEARCHCACHE', 'ttl', fallback=300.0))
+
+def search_cache_stats():
+    return _search_cache.stats()
+
+def _cached_search(key, search):
+    """search() through the search cache; the rows are copies, so callers may change them"""
+    uow = _current_unit_of_work()
+    if uow is not None and uow.catalog_changed:
+        return search()
+    version = _catalog_state()[0]
+    rows = _search_cache.get(key, version)
+    if rows is None:
+        rows = search()
+        _search_cache.put(key, version, rows)
+    return [dict(r) for r in rows]
+
+#####################################################
+#   Missing item cache
+#   Bad links and crawlers ask for the same ids that
+#   don't exist over and over.
+#####################################################
+
+class MissingIds:
+    """
+    Keys of catalog items found not to exist, each remembered for `ttl`
+    seconds along with the catalog version it was missing at; once the
+    catalog has changed the item may exist, so the key is forgotten. At
+    most `max_entries` are kept, oldest first out.
+    """
+
+    def __init__(self, ttl=30.0, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # key: (expires, catalog version)
+        self.hits = self.misses = 0
+
+    def known(self, key, version):
+        """Whether key is known to be missing at catalog `version`"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[0] <= time.monotonic() or entry[1] != version):
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, key, version):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic() + self.ttl, version)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries), 'ttl': self.ttl,
+                'max_entries': self.max_entries,
+                'hits': self.hits, 'misses': self.misses,
+            }
+
+
+_missing_ids = MissingIds(
+    ttl=_db_config.getfloat('MISSINGIDS', 'ttl', fallback=30.0),
+    max_entries=_db_config.getint('MISSINGIDS', 'max_entries', fallback=10000),
+)
+
+def missing_ids_stats():
+    return _missing_ids.stats()
+
+def _unless_missing(key, fetch, missing):
+    """
+    fetch() the item's rows, or a tuple of which they are the first part,
+    unless the item is known not to exist: then return `missing`. An
+    item with no rows doesn't exist.
+    """
+    uow = _current_unit_of_work()
+    if uow is not None and uow.catalog_changed:
+        return fetch()
+    # Ids come from URLs as ints and from elsewhere as strings
+    key = tuple(str(k) for k in key)
+    version = _catalog_state()[0]
+    if _missing_ids.known(key, version):
+        return missing
+    result = fetch()
+    if not (result[0] if isinstance(result, tuple) else result):
+        _missing_ids.add(key, version)
+    return result
+
+#####################################################
+#   List page keys
+#   Where the pages of a listing start, so the next
+#   page is read by keyset instead of by offset.
+#####################################################
+
+class PageKeys:
+    """
+    For each listing, sort order and search, the (sort key, id) of the last
+    row of each page served, by the position of the row after it. A page
+    that starts at a known position is read from there by its key; other
+    pages are read from the nearest known position before them, skipping
+    the rows in between. Keys go with the catalog version they were read
+    at. At most `max_orders` orders are kept, least recently used first
+    out, each with at most `max_positions` positions, oldest first out.
+    """
+
+    def __init__(self, max_orders=1024, max_positions=1000):
+        self.max_orders = max_orders
+        self.max_positions = max_positions
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()    # order: (catalog version, {position: key})
+        self.hits = self.nearby = self.misses = 0
+
+    def nearest(self, order, version, start):
+        """(position, key) of the nearest known page start at or before `start`"""
+        with self._lock:
+            entry = self._entries.get(order)
+            if entry is None or entry[0] != version:
+                positions = {}
+            else:
+                self._entries.move_to_end(order)
+                positions = entry[1]
+            position = max((p for p in positions if p <= start), default=0)
+            if position == start:
+                self.hits += 1
+            elif position > 0:
+                self.nearby += 1
+            else:
+                self.misses += 1
+            return position, positions.get(position)
+
+    def add(self, order, version, position, key):
+        if self.max_orders <= 0:
+            return
+        with self._lock:
+            entry = self._entries.get(order)
+            if entry is None or entry[0] != version:
+                entry = self._entries[order] = (version, OrderedDict())
+            self._entries.move_to_end(order)
+            positions = entry[1]
+            positions.pop(position, None)
+            positions[position] = key
+            while len(positions) > self.max_positions:
+                positions.popitem(last=False)
+            while len(self._entries) > self.max_orders:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'orders': len(self._entries),
+                'positions': sum(len(e[1]) for e in self._entries.values()),
+                'max_orders': self.max_orders, 'max_positions': self.max_positions,
+                'hits': self.hits, 'nearby': self.nearby, 'misses': self.misses,
+            }
+
+
+_page_keys = PageKeys(
+    max_orders=_db_config.getint('LISTPAGES', 'max_orders', fallback=1024),
+    max_positions=_db_config.getint('LISTPAGES', 'max_positions', fallback=1000),
+)
+
+def page_keys_stats():
+    return _page_keys.stats()
+
 #####################################################
 #   Query (1)
 #   Login
@@ -185,6 +1422,7 @@ def check_login(username, password) -> dict:
 #####################################################
 
 def ensure_super(username: str):
+    """Raise UserException unless username is a superuser; always asks the database"""
     with get_cursor() as cur:
         try:
             if not _fetch_one(
@@ -203,71 +1441,135 @@ def is_superuser(username):
         - False => Return None
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         # Try executing the SQL and get from the database
         sql = """SELECT isSuper
                  FROM mediaserver.useraccount
                  WHERE username=%s AND isSuper"""
-        print("username is: "+username)
-        cur.execute(sql, (username))
+        cur.execute(sql, (username,))
         r = cur.fetchone()              # Fetch the first row
-        print(r)
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error:", sys.exc_info()[0])
-        raise
-    finally:
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
-    return None
+
+#####################################################
+#   Authorization kept in the session
+#   A superuser check is answered from the session
+#   until the user's credentials change.
+#####################################################
+
+# The newest UserAccount.credential_version this process has seen changed,
+# per username; with a shared cache, every worker's changes are in there too
+_credential_versions = {}
+_credential_versions_lock = threading.Lock()
+# Changes this app didn't make (by hand, another machine) are picked up this late
+_AUTH_RECHECK_AFTER = _db_config.getfloat('AUTH', 'recheck_after', fallback=300.0)
+
+def credential_version(username: str) -> int:
+    """The user's credential version, from the database; 0 for no such user"""
+    with get_cursor() as cur:
+        cur.execute("select credential_version from mediaserver.UserAccount where username = %s",
+                    (username,))
+        r = cur.fetchone()
+    return r[0] if r else 0
+
+def _known_credential_version(username):
+    """The newest credential version of the user this app has seen, or None"""
+    if _shared_cache is not None:
+        version = _shared_cache.get('auth/' + username)
+        if version is not None:
+            return version
+    return _credential_versions.get(username)
+
+def _credentials_changed(username, version):
+    with _credential_versions_lock:
+        if version > _credential_versions.get(username, -1):
+            _credential_versions[username] = version
+    if _shared_cache is not None:
+        # A session older than this rechecks anyway
+        _shared_cache.set('auth/' + username, version, timeout=_AUTH_RECHECK_AFTER)
+
+def authorization(username: str, issuper: bool, version: int) -> dict:
+    """
+    Authorization state to keep in the signed session. `version` is the
+    credential_version() read before `issuper` was.
+    """
+    return {'username': username, 'issuper': bool(issuper),
+            'version': version, 'checked_at': time.time()}
+
+def check_super(auth, username: str) -> dict:
+    """
+    Raise UserException unless username is a superuser. `auth` is the
+    session's authorization state, or None. It is trusted while it is for
+    this user, no change to the user's credentials newer than its version
+    is known and it is no older than [AUTH] recheck_after seconds;
+    otherwise the database's flag and credential version are read again.
+    Returns the state to keep, `auth` itself if still good.
+    """
+    version = auth.get('version') if auth is not None else None
+    known = _known_credential_version(username)
+    # Versions used to be strings; a session holding one checks again
+    if (isinstance(version, int) and auth.get('username') == username
+            and (known is None or version >= known)
+            and time.time() - auth.get('checked_at', 0) <= _AUTH_RECHECK_AFTER):
+        if not auth['issuper']:
+            raise UserException("You are not allow to access this page")
+        return auth
+
+    with get_cursor() as cur:
+        try:
+            r = _fetch_one(
+                cur,
+                """select issuper, credential_version from mediaserver.UserAccount
+                   where username = %s""",
+                (username,))
+        except NoResultFound:
+            raise UserException(f"user {username} not exists") from None
+    if known is None or r['credential_version'] > known:
+        # Remembered, so sessions still holding an older version check too
+        _credentials_changed(username, r['credential_version'])
+    if not r['issuper']:
+        raise UserException("You are not allow to access this page")
+    return authorization(username, True, r['credential_version'])
 
 #####################################################
 #   Query (1 b)
 #   Get user playlists
 #####################################################
-def user_playlists(username):
-    """Get playlists for current user """
-    with get_cursor() as cur:
-        sql = """select mc.collection_id, mc.collection_name, count(media_id)
+_USER_PLAYLISTS_SQL = """select mc.collection_id, mc.collection_name, count(media_id)
         from mediaserver.MediaCollectionContents as mcc
         natural join mediaserver.MediaCollection as mc
         where username = %s
         group by mc.collection_id;
         """
 
+def user_playlists(username):
+    """Get playlists for current user """
+    with get_cursor() as cur:
+        sql = _USER_PLAYLISTS_SQL
         return _fetch_all(cur, sql, (username, ))
 
 #####################################################
 #   Query (1 c)
 #   Get user podcasts
 #####################################################
-def user_podcast_subscriptions(username):
-    """ Get user podcast subscriptions."""
-    # We first connect to the db
-    with get_cursor() as cur:
-        sql = """select pd.podcast_id, pd.podcast_title, pd.podcast_uri,
+_USER_PODCAST_SUBSCRIPTIONS_SQL = """select pd.podcast_id, pd.podcast_title, pd.podcast_uri,
         pd.podcast_last_updated
         from mediaserver.podcast as pd
         natural join mediaserver.Subscribed_Podcasts as spd
         where username = %s;
         """
+
+def user_podcast_subscriptions(username):
+    """ Get user podcast subscriptions."""
+    # We first connect to the db
+    with get_cursor() as cur:
+        sql = _USER_PODCAST_SUBSCRIPTIONS_SQL
         return _fetch_all(cur, sql, (username,))
 
 #####################################################
 #   Query (1 c)
 #   Get user in progress items
 #####################################################
-def user_in_progress_items(username):
-    """ Get user in progress items that aren't 100% """
-    with get_cursor() as cur:
-        return _fetch_all(
-            cur,
-            """
+_USER_IN_PROGRESS_ITEMS_SQL = """
             select
                 ums.media_id as media_id,
                 ums.progress as progress,
@@ -277,142 +1579,93 @@ def user_in_progress_items(username):
             from mediaserver.UserMediaConsumption ums
             natural join mediaserver.MediaItem mi
             where ums.username = %s and progress < 1;
-            """,
-            (username,)
-        )
+            """
+
+def user_in_progress_items(username):
+    """ Get user in progress items that aren't 100% """
+    with get_cursor() as cur:
+        return _fetch_all(cur, _USER_IN_PROGRESS_ITEMS_SQL, (username,))
 
 
 #####################################################
 #   Get all artists
 #####################################################
-def get_allartists():
+_ALL_ARTISTS_SQL = """select
+            a.artist_id, a.artist_name, coalesce(s.metadata_count, 0) as count
+        from
+            mediaserver.artist a left outer join mediaserver.ArtistSummary s on (a.artist_id=s.artist_id)
+        order by a.artist_name;"""
+
+def get_allartists(row_factory=dict_row):
     """
     Get all the artists in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
-        # Try executing the SQL and get from the database
-        sql = """select
-            a.artist_id, a.artist_name, count(amd.md_id) as count
-        from
-            mediaserver.artist a left outer join mediaserver.artistmetadata amd on (a.artist_id=amd.artist_id)
-        group by a.artist_id, a.artist_name
-        order by a.artist_name;"""
+    return _cached_listing('artists', _ALL_ARTISTS_SQL, row_factory)
 
-        r = dictfetchall(cur,sql)
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
-        return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All Artists:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
+
+def iter_allartists(row_factory=dict_row):
+    """
+    Like get_allartists, but yields each artist as it is read from the database
+    instead of building the whole list first
+    """
+    yield from _iter_cached_listing('artists', _ALL_ARTISTS_SQL, row_factory)
 
 
 #####################################################
 #   Get all songs
 #####################################################
-def get_allsongs():
+_ALL_SONGS_SQL = """select
+            s.song_id, s.song_title, ss.artists
+        from
+            mediaserver.song s left outer join mediaserver.SongSummary ss on (s.song_id=ss.song_id)
+        order by s.song_id"""
+
+def get_allsongs(row_factory=dict_row):
     """
     Get all the songs in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
-        # Try executing the SQL and get from the database
-        sql = """select
-            s.song_id, s.song_title, string_agg(saa.artist_name,',') as artists
-        from
-            mediaserver.song s left outer join
-            (mediaserver.Song_Artists sa join mediaserver.Artist a on (sa.performing_artist_id=a.artist_id)
-            ) as saa  on (s.song_id=saa.song_id)
-        group by s.song_id, s.song_title
-        order by s.song_id"""
+    return _cached_listing('songs', _ALL_SONGS_SQL, row_factory)
 
-        r = dictfetchall(cur,sql)
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
-        return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All Songs:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
+
+def iter_allsongs(row_factory=dict_row):
+    """
+    Like get_allsongs, but yields each song as it is read from the database
+    instead of building the whole list first
+    """
+    yield from _iter_cached_listing('songs', _ALL_SONGS_SQL, row_factory)
 
 
 #####################################################
 #   Get all podcasts
 #####################################################
-def get_allpodcasts():
+_ALL_PODCASTS_SQL = """select
+                p.*, coalesce(ps.episode_count, 0) as count
+            from
+                mediaserver.podcast p left outer join mediaserver.PodcastSummary ps on (p.podcast_id=ps.podcast_id);"""
+
+def get_allpodcasts(row_factory=dict_row):
     """
     Get all the podcasts in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    return _cached_listing('podcasts', _ALL_PODCASTS_SQL, row_factory)
 
-        # Try executing the SQL and get from the database
-        sql = """select
-                p.*, pnew.count as count
-            from
-                mediaserver.podcast p,
-                (select
-                    p1.podcast_id, count(*) as count
-                from
-                    mediaserver.podcast p1 left outer join mediaserver.podcastepisode pe1 on (p1.podcast_id=pe1.podcast_id)
-                    group by p1.podcast_id) pnew
-            where p.podcast_id = pnew.podcast_id;"""
-
-        r = dictfetchall(cur,sql)
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
-        return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All Podcasts:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
+
+def iter_allpodcasts(row_factory=dict_row):
+    """
+    Like get_allpodcasts, but yields each podcast as it is read from the database
+    instead of building the whole list first
+    """
+    yield from _iter_cached_listing('podcasts', _ALL_PODCASTS_SQL, row_factory)
 
 
 
 #####################################################
 #   Get all albums
 #####################################################
-def get_allalbums():
-    """
-    Get all the Albums in your media server
-    """
-
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
-        # Try executing the SQL and get from the database
-        sql = """select
+_ALL_ALBUMS_SQL = """select
                 a.album_id, a.album_title, anew.count as count, anew.artists
             from
                 mediaserver.album a,
@@ -427,19 +1680,20 @@ def get_allalbums():
                 group by a1.album_id) anew
             where a.album_id = anew.album_id;"""
 
-        r = dictfetchall(cur,sql)
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
-        return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All Albums:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
+def get_allalbums(row_factory=dict_row):
+    """
+    Get all the Albums in your media server
+    """
+
+    return _cached_listing('albums', _ALL_ALBUMS_SQL, row_factory)
+
+
+def iter_allalbums(row_factory=dict_row):
+    """
+    Like get_allalbums, but yields each album as it is read from the database
+    instead of building the whole list first
+    """
+    yield from _iter_cached_listing('albums', _ALL_ALBUMS_SQL, row_factory)
 
 
 
@@ -447,98 +1701,247 @@ def get_allalbums():
 #   Query (3 a,b c)
 #   Get all tvshows
 #####################################################
-def get_alltvshows():
+_ALL_TVSHOWS_SQL = """
+        SELECT tvshow_id,
+               tvshow_title,
+               episode_count as count
+        FROM mediaserver.TVShow NATURAL JOIN mediaserver.TVShowSummary
+        WHERE episode_count > 0
+        ORDER BY tvshow_id asc;
+        """
+
+def get_alltvshows(row_factory=dict_row):
     """
     Get all the TV Shows in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
-        #########
-        # TODO  # --- Done ---
-        #########
+    #########
+    # TODO  # --- Done ---
+    #########
 
-        #############################################################################
-        # Fill in the SQL below with a query to get all tv shows and episode counts #
-        #############################################################################
-        sql = """
-        SELECT tvshow_id,
-               tvshow_title,
-               count(episode)
-        FROM mediaserver.TVShow NATURAL JOIN mediaserver.TVEpisode
-        GROUP BY tvshow_id
-        ORDER BY tvshow_id asc;
-        """
+    #############################################################################
+    # Fill in the SQL below with a query to get all tv shows and episode counts #
+    #############################################################################
+    return _cached_listing('tvshows', _ALL_TVSHOWS_SQL, row_factory)
 
-        r = dictfetchall(cur,sql)
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
-        return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All TV Shows:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
+
+def iter_alltvshows(row_factory=dict_row):
+    """
+    Like get_alltvshows, but yields each TV show as it is read from the database
+    instead of building the whole list first
+    """
+    yield from _iter_cached_listing('tvshows', _ALL_TVSHOWS_SQL, row_factory)
 
 
 #####################################################
 #   Get all movies
 #####################################################
-def get_allmovies():
-    """
-    Get all the Movies in your media server
-    """
-
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
-        # Try executing the SQL and get from the database
-        sql = """select
+_ALL_MOVIES_SQL = """select
             m.movie_id, m.movie_title, m.release_year, count(mimd.md_id) as count
         from
             mediaserver.movie m left outer join mediaserver.mediaitemmetadata mimd on (m.movie_id = mimd.media_id)
         group by m.movie_id, m.movie_title, m.release_year
         order by movie_id;"""
 
-        r = dictfetchall(cur,sql)
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
-        return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All Movies:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
+def get_allmovies(row_factory=dict_row):
+    """
+    Get all the Movies in your media server
+    """
+
+    return _cached_listing('movies', _ALL_MOVIES_SQL, row_factory)
+
+
+def iter_allmovies(row_factory=dict_row):
+    """
+    Like get_allmovies, but yields each movie as it is read from the database
+    instead of building the whole list first
+    """
+    yield from _iter_cached_listing('movies', _ALL_MOVIES_SQL, row_factory)
 
 
 #####################################################
-#   Get one artist
+#   List pages
+#   The get_all* listings a page at a time, for the
+#   DataTables on the /list pages.
 #####################################################
-def get_artist(artist_id):
+
+class Listing:
     """
-    Get an artist by their ID in your media server
+    A listing read a page at a time. The page's rows come from `table`
+    (aliased t), which has the `id` column; `sorts` maps each column the
+    page can be ordered by to the indexed expression it sorts by, and a
+    search matches `search` (lowered) anywhere. `sql` then reads the rest
+    of each row from the page, a CTE aliased p with t's `columns` and
+    sort_key (grouped by those if it aggregates), mostly from the list
+    summary tables. `where` keeps rows of t out altogether.
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
+    def __init__(self, name, table, id, columns, sorts, search, sql, where=None):
+        self.name = name
+        self.table = table
+        self.id = id
+        self.columns = columns
+        self.sorts = sorts
+        self.search = search
+        self.sql = sql
+        self.where = where
+
+LISTINGS = {listing.name: listing for listing in [
+    Listing(
+        'artists', 'mediaserver.Artist', 'artist_id', ['artist_name'],
+        {'artist_id': "t.artist_id", 'artist_name': "coalesce(t.artist_name, '')"},
+        "t.artist_name",
+        """select p.artist_id, p.artist_name, coalesce(s.metadata_count, 0) as count, p.sort_key
+        from page p left outer join mediaserver.ArtistSummary s on (s.artist_id = p.artist_id)"""),
+    Listing(
+        'songs', 'mediaserver.Song', 'song_id', ['song_title'],
+        {'song_id': "t.song_id", 'song_title': "coalesce(t.song_title, '')"},
+        "t.song_title",
+        """select p.song_id, p.song_title, s.artists, p.sort_key
+        from page p left outer join mediaserver.SongSummary s on (s.song_id = p.song_id)"""),
+    Listing(
+        'podcasts', 'mediaserver.Podcast', 'podcast_id',
+        ['podcast_title', 'podcast_uri', 'podcast_last_updated'],
+        {'podcast_id': "t.podcast_id", 'podcast_title': "coalesce(t.podcast_title, '')"},
+        "t.podcast_title",
+        """select p.podcast_id, p.podcast_title, p.podcast_uri,
+            p.podcast_last_updated::text as podcast_last_updated,
+            coalesce(s.episode_count, 0) as count, p.sort_key
+        from page p left outer join mediaserver.PodcastSummary s on (s.podcast_id = p.podcast_id)"""),
+    Listing(
+        'albums', 'mediaserver.Album', 'album_id', ['album_title'],
+        {'album_id': "t.album_id", 'album_title': "t.album_title"},
+        "t.album_title",
+        """select p.album_id, p.album_title, count(distinct als.song_id) as count,
+            array_to_string(array_agg(distinct a.artist_name), ',') as artists, p.sort_key
+        from page p
+            left outer join mediaserver.Album_Songs als on (als.album_id = p.album_id)
+            left outer join mediaserver.Song_Artists sa on (sa.song_id = als.song_id)
+            left outer join mediaserver.Artist a on (a.artist_id = sa.performing_artist_id)
+        group by p.album_id, p.album_title, p.sort_key"""),
+    Listing(
+        'tvshows', 'mediaserver.TVShow', 'tvshow_id', ['tvshow_title'],
+        {'tvshow_id': "t.tvshow_id", 'tvshow_title': "coalesce(t.tvshow_title, '')"},
+        "t.tvshow_title",
+        """select p.tvshow_id, p.tvshow_title, s.episode_count as count, p.sort_key
+        from page p join mediaserver.TVShowSummary s on (s.tvshow_id = p.tvshow_id)""",
+        # Like get_alltvshows, only the shows with episodes
+        where="""exists (select 1 from mediaserver.TVShowSummary s
+                         where s.tvshow_id = t.tvshow_id and s.episode_count > 0)"""),
+    Listing(
+        'movies', 'mediaserver.Movie', 'movie_id', ['movie_title', 'release_year'],
+        {'movie_id': "t.movie_id", 'movie_title': "coalesce(t.movie_title, '')",
+         'release_year': "coalesce(t.release_year, 0)"},
+        "t.movie_title",
+        """select p.movie_id, p.movie_title, p.release_year, count(mimd.md_id) as count, p.sort_key
+        from page p left outer join mediaserver.MediaItemMetaData mimd on (mimd.media_id = p.movie_id)
+        group by p.movie_id, p.movie_title, p.release_year, p.sort_key"""),
+]}
+
+_max_page_length = _db_config.getint('LISTPAGES', 'max_length', fallback=500)
+
+def _listing_where(listing, search):
+    where_and = [listing.where] if listing.where else []
+    params = []
+    if search:
+        where_and.append("lower({}) like lower(%s)".format(listing.search))
+        params.append(_like_pattern(search))
+    return where_and, params
+
+def list_page(name, start, length, order_by, descending=False, search=''):
+    """
+    (total, matching, rows): how many rows the listing `name` has, how
+    many of them match `search`, and the `length` matching rows from
+    `start` on, ordered by the column `order_by`. A negative length, or one
+    over [LISTPAGES] max_length, is the most rows a page may have.
+    """
+    try:
+        listing = LISTINGS[name]
+        sort = listing.sorts[order_by]
+    except KeyError:
+        raise UserException("invaild listing or sort column")
+    if start < 0:
+        raise UserException("invaild page start")
+    if length < 0 or length > _max_page_length:
+        length = _max_page_length
+    search = search.strip()
+
+    # The counts only change with the catalog, so they're kept like searches
+    total = _cached_search(('listcount', name, ''), lambda: _count_listing(listing, ''))[0]['count']
+    matching = total
+    if search:
+        matching = _cached_search(('listcount', name, search),
+                                  lambda: _count_listing(listing, search))[0]['count']
+    if length == 0 or start >= matching:
+        return total, matching, []
+    return total, matching, _list_page(listing, sort, start, length, descending, search)
+
+def _count_listing(listing, search):
+    where_and, params = _listing_where(listing, search)
+    sql = "select count(*) as count from {} as t where ({})".format(
+        listing.table, " and ".join(where_and) or "true")
+    with get_cursor() as cur:
+        return _fetch_all(cur, sql, params)
 
+def _list_page(listing, sort, start, length, descending, search):
+    uow = _current_unit_of_work()
+    # This request's own writes may have moved the pages
+    remember = uow is None or not uow.catalog_changed
+    order = (listing.name, sort, descending, search)
+    version = _catalog_state()[0] if remember else None
+    position, key = _page_keys.nearest(order, version, start) if remember else (0, None)
+
+    where_and, params = _listing_where(listing, search)
+    direction = "desc" if descending else "asc"
+    id_column = "t." + listing.id
+    if sort == id_column:
+        order_by = "{} {}".format(sort, direction)
+    else:
+        order_by = "{sort} {dir}, {id} {dir}".format(sort=sort, dir=direction, id=id_column)
+    if key is not None:
+        # Rows after the last one of the page before, in the order's index
+        after = "<" if descending else ">"
+        if sort == id_column:
+            where_and.append("{} {} %s".format(id_column, after))
+            params.append(key[1])
+        else:
+            where_and.append("({}, {}) {} (%s, %s)".format(sort, id_column, after))
+            params.extend(key)
+
+    sql = """with page as (
+            select t.{id}, {columns}, {sort} as sort_key
+            from {table} as t
+            where ({where})
+            order by {order_by}
+            limit %s offset %s
+        )
+        {rows}
+        order by p.sort_key {dir}, p.{id} {dir}""".format(
+        id=listing.id, columns=", ".join("t." + c for c in listing.columns),
+        sort=sort, table=listing.table, where=" and ".join(where_and) or "true",
+        order_by=order_by, rows=listing.sql, dir=direction)
+    with get_cursor() as cur:
+        rows = _fetch_all(cur, sql, (*params, length, start - position))
+
+    if rows and remember:
+        last = rows[-1]
+        _page_keys.add(order, version, start + len(rows), (last['sort_key'], last[listing.id]))
+    for r in rows:
+        del r['sort_key']
+    return rows
+
+
+#####################################################
+#   Get one artist
+#####################################################
+def get_artist(artist_id):
+    """
+    Get an artist by their ID in your media server
+    """
+    return _unless_missing(('artist', artist_id), lambda: _get_artist(artist_id), [])
 
-    try:
+def _get_artist(artist_id):
+    with get_cursor() as cur:
         # Try executing the SQL and get from the database
         sql = """select *
         from mediaserver.artist a left outer join
@@ -547,18 +1950,7 @@ def get_artist(artist_id):
         where a.artist_id=%s"""
 
         r = dictfetchall(cur,sql,(artist_id,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting Artist with ID: '"+artist_id+"'", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 
 #####################################################
@@ -570,13 +1962,7 @@ def get_song(song_id):
     Get a song by their ID in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-
-
-    try:
+    with get_cursor() as cur:
         #########
         # TODO  #
         #########
@@ -594,18 +1980,7 @@ def get_song(song_id):
 
         r = dictfetchall(cur,sql,(song_id,))
 
-        print(r)
-        print()
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All Songs:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 #####################################################
 #   Query (2 d)
@@ -616,11 +1991,7 @@ def get_song_metadata(song_id):
     Get the meta for a song by their ID in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         #########
         # TODO  #
         #########
@@ -635,68 +2006,47 @@ def get_song_metadata(song_id):
         where a.media_id=%s"""
 
         r = dictfetchall(cur,sql,(song_id,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting song metadata for ID: "+song_id, sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 #####################################################
 #   Query (7 a,b,c,d,e)
 #   Get one podcast and return all metadata associated with it
 #####################################################
 # Get the whole meta of a podcast
-def get_podcast_metadata(podcast_id):
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
-        # We need to show the list of episodes of this podcast, and then order them in the order latest to earliest.
-        sql = """
+# md_type_name comes from the metadata_type_names() cache
+_PODCAST_METADATA_SQL = """
         select *
-        from (((mediaserver.Podcast
+        from ((mediaserver.Podcast
             join
             mediaserver.PodcastMetaData using (podcast_id))
             join
-        mediaserver.MetaData using (md_id)) join
-        mediaserver.MetaDataType using (md_type_id))
+        mediaserver.MetaData using (md_id))
         where podcast_id = %s
         ;
         """
+
+def get_podcast_metadata(podcast_id):
+    with get_cursor() as cur:
+        # We need to show the list of episodes of this podcast, and then order them in the order latest to earliest.
+        sql = _PODCAST_METADATA_SQL
         r = dictfetchall(cur,sql,(podcast_id,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
-        return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting Podcast with ID: "+podcast_id, sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
+        return _name_metadata_types(r)
 
 
 
 # Main function to get podcast
+_PODCAST_SQL = """
+        select podcast_id, podcast_title, podcast_uri, podcast_last_updated
+        from mediaserver.Podcast
+        where podcast_id = %s;
+        """
+
 def get_podcast(podcast_id):
     """
     Get a podcast by their ID in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         #########
         # TODO  #
         #########
@@ -708,41 +2058,29 @@ def get_podcast(podcast_id):
         # This returns all the meta data and episodes of the selected podcats
 
         # We need to show the list of episodes of this podcast, and then order them in the order latest to earliest.
-        sql = """
-        select podcast_id, podcast_title, podcast_uri, podcast_last_updated
-        from mediaserver.Podcast
-        where podcast_id = %s;
-        """
+        sql = _PODCAST_SQL
         r = dictfetchall(cur,sql,(podcast_id,))
-        print("return val is:")
-        print("--------------------------")
-        print(r)
-        print("--------------------------")
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r[0]
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting Podcast with ID: "+podcast_id, sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 #####################################################
 #   Query (7 f)
 #   Get all podcast eps for one podcast
 #####################################################
+_PODCAST_EPISODES_SQL = """
+        select *
+        from mediaserver.Podcast
+                full outer join
+                mediaserver.podcastepisode using (podcast_id)
+        where podcast_id = %s
+        order by podcast_episode_published_date DESC;
+        """
+
 def get_all_podcasteps_for_podcast(podcast_id):
     """
     Get all podcast eps for one podcast by their podcast ID in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         #########
         # TODO  #
         #########
@@ -752,28 +2090,10 @@ def get_all_podcasteps_for_podcast(podcast_id):
         # podcast episodes in a podcast                                             #
         #############################################################################
 
-        sql = """
-        select *
-        from mediaserver.Podcast
-                full outer join
-                mediaserver.podcastepisode using (podcast_id)
-        where podcast_id = %s
-        order by podcast_episode_published_date DESC;
-        """
+        sql = _PODCAST_EPISODES_SQL
 
         r = dictfetchall(cur,sql,(podcast_id,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All Podcast Episodes for Podcast with ID: "+podcast_id, sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 
 #####################################################
@@ -784,12 +2104,11 @@ def get_podcastep(podcast_id, podcastep_id):
     """
     Get a podcast ep by their ID in your media server
     """
+    return _unless_missing(('podcastep', podcast_id, podcastep_id),
+                           lambda: _get_podcastep(podcast_id, podcastep_id), [])
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+def _get_podcastep(podcast_id, podcastep_id):
+    with get_cursor() as cur:
         #########
         # TODO  #
         #########
@@ -798,44 +2117,35 @@ def get_podcastep(podcast_id, podcastep_id):
         # Fill in the SQL below with a query to get all information about a         #
         # podcast episodes and it's associated metadata                             #
         #############################################################################
+        # md_type_name comes from the metadata_type_names() cache
         sql = """
         select *
-        from (((mediaserver.PodcastEpisode join mediaserver.AudioMedia using (media_id)) left outer join
+        from ((mediaserver.PodcastEpisode join mediaserver.AudioMedia using (media_id)) left outer join
             mediaserver.MediaItemMetaData using (media_id)
-            left outer join mediaserver.MetaData using (md_id)) join mediaserver.MetaDataType using (md_type_id)) as pd
+            left outer join mediaserver.MetaData using (md_id)) as pd
             where media_id = %s and podcast_id = %s
         ;
         """
 
         r = dictfetchall(cur,sql,(podcastep_id,podcast_id,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
-        return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting Podcast Episode with ID: "+podcastep_id, sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
+        return _name_metadata_types(r)
 
 
 #####################################################
 #   Query (5 a,b)
 #   Get one album
 #####################################################
+_ALBUM_SQL = """SELECT album_title, md_type_name, md_value
+                FROM mediaserver.Album LEFT OUTER JOIN (mediaserver.AlbumMetaData NATURAL JOIN mediaserver.MetaData NATURAL JOIN mediaserver.MetaDataType) USING (album_id)
+                WHERE album_id=%s
+        """
+
 def get_album(album_id):
     """
     Get an album by their ID in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         #########
         # TODO  #
         #########
@@ -844,42 +2154,34 @@ def get_album(album_id):
         # Fill in the SQL below with a query to get all information about an album  #
         # including all relevant metadata                                           #
         #############################################################################
-        sql = """SELECT album_title, md_type_name, md_value
-                FROM mediaserver.Album LEFT OUTER JOIN (mediaserver.AlbumMetaData NATURAL JOIN mediaserver.MetaData NATURAL JOIN mediaserver.MetaDataType) USING (album_id)
-                WHERE album_id=%s
-        """
+        sql = _ALBUM_SQL
 
 
 
         r = dictfetchall(cur,sql,(album_id,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting Albums with ID: "+album_id, sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 
 #####################################################
 #   Query (5 c)
 #   Get all songs for one album
 #####################################################
+_ALBUM_SONGS_SQL = """select s.song_id, s.song_title, string_agg(saa.artist_name,',') as artists
+                from
+                        (mediaserver.album_songs als natural join mediaserver.song s) left outer join
+                        (mediaserver.Song_Artists sa join mediaserver.Artist a on (sa.performing_artist_id=a.artist_id)
+                        ) as saa  on (s.song_id=saa.song_id)
+                where als.album_id=%s
+                group by s.song_id, s.song_title, als.track_num
+                order by als.track_num
+        """
+
 def get_album_songs(album_id):
     """
     Get all songs for an album by the album ID in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         #########
         # TODO  #
         #########
@@ -888,45 +2190,28 @@ def get_album_songs(album_id):
         # Fill in the SQL below with a query to get all information about all       #
         # songs in an album, including their artists                                #
         #############################################################################
-        sql = """select s.song_id, s.song_title, string_agg(saa.artist_name,',') as artists
-                from
-                        (mediaserver.album_songs als natural join mediaserver.song s) left outer join
-                        (mediaserver.Song_Artists sa join mediaserver.Artist a on (sa.performing_artist_id=a.artist_id)
-                        ) as saa  on (s.song_id=saa.song_id)
-                where als.album_id=%s
-                group by s.song_id, s.song_title, als.track_num
-                order by als.track_num
-        """
+        sql = _ALBUM_SONGS_SQL
 
         r = dictfetchall(cur,sql,(album_id,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting Albums songs with ID: "+album_id, sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 
 #####################################################
 #   Query (6)
 #   Get all genres for one album
 #####################################################
+_ALBUM_GENRES_SQL = """SELECT DISTINCT md_value as songgenres
+            FROM (mediaserver.Album NATURAL JOIN mediaserver.Album_Songs)
+                        INNER JOIN (mediaserver.MediaItemMetaData natural join mediaserver.MetaData natural join mediaserver.MetaDataType) ON (song_id = media_id)
+            where album_id=%s AND md_type_name='song genre'
+        """
+
 def get_album_genres(album_id):
     """
     Get all genres for an album by the album ID in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         #########
         # TODO  #
         #########
@@ -935,41 +2220,31 @@ def get_album_genres(album_id):
         # Fill in the SQL below with a query to get all information about all       #
         # genres in an album (based on all the genres of the songs in that album)   #
         #############################################################################
-        sql = """SELECT DISTINCT md_value as songgenres
-            FROM (mediaserver.Album NATURAL JOIN mediaserver.Album_Songs)
-                        INNER JOIN (mediaserver.MediaItemMetaData natural join mediaserver.MetaData natural join mediaserver.MetaDataType) ON (song_id = media_id)
-            where album_id=%s AND md_type_name='song genre'
-        """
+        sql = _ALBUM_GENRES_SQL
 
         r = dictfetchall(cur,sql,(album_id,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting Albums genres with ID: "+album_id, sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 
 #####################################################
 #   Query (4 a,b)
 #   Get one tvshow
 #####################################################
+_TVSHOW_SQL = """
+            SELECT *
+            FROM mediaserver.TVShow LEFT OUTER JOIN
+                (mediaserver.TVShowMetaData NATURAL JOIN mediaserver.MetaData
+                                            NATURAL JOIN mediaserver.MetaDataType)
+                                            USING (tvshow_id)
+            WHERE tvshow_id = %s;
+        """
+
 def get_tvshow(tvshow_id):
     """
     Get one tvshow in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         #########
         # TODO  # --- Done ---
         #########
@@ -978,44 +2253,35 @@ def get_tvshow(tvshow_id):
         # Fill in the SQL below with a query to get all information about a tv show #
         # including all relevant metadata       #
         #############################################################################
-        sql = """
-            SELECT *
-            FROM mediaserver.TVShow LEFT OUTER JOIN
-                (mediaserver.TVShowMetaData NATURAL JOIN mediaserver.MetaData
-                                            NATURAL JOIN mediaserver.MetaDataType)
-                                            USING (tvshow_id)
-            WHERE tvshow_id = %s;
-        """
+        sql = _TVSHOW_SQL
 
         r = dictfetchall(cur,sql,(tvshow_id,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All TV Shows:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 
 #####################################################
 #   Query (4 c)
 #   Get all tv show episodes for one tv show
 #####################################################
+_TVSHOW_EPISODES_SQL = """
+        SELECT media_id,
+               tvshow_episode_title,
+               season,
+               episode,
+               air_date
+        FROM mediaserver.TVEpisode
+        WHERE tvshow_id = %s
+        ORDER BY season, episode
+
+
+        """
+
 def get_all_tvshoweps_for_tvshow(tvshow_id):
     """
     Get all tvshow episodes for one tv show in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         #########
         # TODO  # --- Done ---
         #########
@@ -1024,32 +2290,10 @@ def get_all_tvshoweps_for_tvshow(tvshow_id):
         # Fill in the SQL below with a query to get all information about all       #
         # tv episodes in a tv show                                                  #
         #############################################################################
-        sql = """
-        SELECT media_id,
-               tvshow_episode_title,
-               season,
-               episode,
-               air_date
-        FROM mediaserver.TVEpisode
-        WHERE tvshow_id = %s
-        ORDER BY season, episode
-
-
-        """
+        sql = _TVSHOW_EPISODES_SQL
 
         r = dictfetchall(cur,sql,(tvshow_id,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All TV Shows:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 
 #####################################################
@@ -1059,12 +2303,10 @@ def get_tvshowep(tvshowep_id):
     """
     Get one tvshow episode in your media server
     """
+    return _unless_missing(('tvshowep', tvshowep_id), lambda: _get_tvshowep(tvshowep_id), [])
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+def _get_tvshowep(tvshowep_id):
+    with get_cursor() as cur:
         # Try executing the SQL and get from the database
         sql = """select *
         from mediaserver.TVEpisode te left outer join
@@ -1073,18 +2315,7 @@ def get_tvshowep(tvshowep_id):
         where te.media_id = %s"""
 
         r = dictfetchall(cur,sql,(tvshowep_id,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All TV Shows:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 
 #####################################################
@@ -1095,12 +2326,10 @@ def get_movie(movie_id):
     """
     Get one movie in your media server
     """
+    return _unless_missing(('movie', movie_id), lambda: _get_movie(movie_id), [])
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+def _get_movie(movie_id):
+    with get_cursor() as cur:
         # Try executing the SQL and get from the database
         sql = """select *
         from mediaserver.movie m left outer join
@@ -1109,18 +2338,7 @@ def get_movie(movie_id):
         where m.movie_id=%s;"""
 
         r = dictfetchall(cur,sql,(movie_id,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All Movies:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 
 #####################################################
@@ -1130,39 +2348,30 @@ def find_matchingtvshows(searchterm):
     """
     Get all the matching TV Shows in your media server
     """
+    # The query lower-cases the pattern too
+    return _cached_search(('tvshows', searchterm.lower()),
+                          lambda: _find_matchingtvshows(searchterm))
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+def _like_pattern(term):
+    """A LIKE pattern matching term anywhere, its own % _ and \\ taken literally"""
+    return '%' + re.sub(r'([\\%_])', r'\\\1', term) + '%'
+
+def _find_matchingtvshows(searchterm):
+    with get_cursor() as cur:
         # Try executing the SQL and get from the database
+        # The title match can use tvshow_title_trgm_idx, and only the
+        # matching shows' episodes are counted
         sql = """
             select
-                t.*, tnew.count as count
+                t.*, count(te.media_id) as count
             from
-                mediaserver.tvshow t,
-                (select
-                    t1.tvshow_id, count(te1.media_id) as count
-                from
-                    mediaserver.tvshow t1 left outer join mediaserver.TVEpisode te1 on (t1.tvshow_id=te1.tvshow_id)
-                    group by t1.tvshow_id) tnew
-            where t.tvshow_id = tnew.tvshow_id and lower(tvshow_title) ~ lower(%s)
+                mediaserver.tvshow t left outer join mediaserver.TVEpisode te on (t.tvshow_id=te.tvshow_id)
+            where lower(t.tvshow_title) like lower(%s)
+            group by t.tvshow_id
             order by t.tvshow_id;"""
 
-        r = dictfetchall(cur,sql,(searchterm,))
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
+        r = dictfetchall(cur,sql,(_like_pattern(searchterm),))
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error getting All TV Shows:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 
 #####################################################
@@ -1173,22 +2382,20 @@ def find_matchingmovies(searchterm):
     """
     Get all the matching Movies in your media server
     """
+    # The query lower-cases the pattern too
+    return _cached_search(('movies', searchterm.lower()),
+                          lambda: _find_matchingmovies(searchterm))
 
-    try:
-        conn = database_connect()
-        cur = conn.cursor()
-
-        #Query
+def _find_matchingmovies(searchterm):
+    with get_cursor() as cur:
+        #Query, served by movie_title_trgm_idx
         sql = """
             select m.* from mediaserver.movie m
-            where lower(m.movie_title) ~ lower(%s)
+            where lower(m.movie_title) like lower(%s)
             order by m.movie_id;
         """
 
-        return dictfetchall(cur, sql, (searchterm,))
-    finally:
-        cur.close()
-        conn.close()
+        return dictfetchall(cur, sql, (_like_pattern(searchterm),))
 
 
 
@@ -1199,11 +2406,7 @@ def add_movie_to_db(title,release_year,description,storage_location,genre):
     """
     Add a new Movie to your media server
     """
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         # Try executing the SQL and get from the database
         sql = """
         SELECT
@@ -1213,20 +2416,9 @@ def add_movie_to_db(title,release_year,description,storage_location,genre):
         """
 
         cur.execute(sql,(storage_location,description,title,release_year,genre))
-        conn.commit()                   # Commit the transaction
         r = cur.fetchone()
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
-        return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error adding a movie:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
+    catalog_changed()
+    return r
 
 #####################################################
 #   Query (9)
@@ -1244,12 +2436,7 @@ def add_song_to_db(*song_params):
     # Fill in the Function  with a query and management for how to add a new    #
     # song to your media server. Make sure you manage all constraints           #
     #############################################################################
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-
-    try:
+    with get_cursor() as cur:
         # Try executing the SQL and get from the database
         sql = """
         SELECT
@@ -1265,20 +2452,192 @@ def add_song_to_db(*song_params):
         artist = song_params[6]
 
         cur.execute(sql,(location, desc, title, length, genre, artwork, artist))
-        conn.commit()                   # Commit the transaction
         r = cur.fetchone()
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
-        return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error adding a song:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
+    catalog_changed()
+    return r
+
+
+#####################################################
+#   Bulk import
+#   Many movies or songs at once: the records are streamed through COPY
+#   into a staging table and then inserted with a few set-based statements,
+#   all in one transaction. Records are dicts with the keys listed in
+#   columns below; missing keys and empty strings are NULL.
+#####################################################
+
+_MOVIE_IMPORT = {
+    'columns': ('title', 'release_year', 'description', 'storage_location', 'genre'),
+    'staging': """create temp table import_staging (
+            title varchar(250),
+            release_year smallint,
+            description text,
+            storage_location text,
+            genre text,
+            media_id integer default nextval('mediaserver.mediaitem_media_id_seq')
+        ) on commit drop""",
+    'inserts': (
+        """insert into mediaserver.VideoMedia(media_id)
+           select media_id from import_staging""",
+        """insert into mediaserver.Movie(movie_id, movie_title, release_year)
+           select media_id, title, release_year from import_staging""",
+    ),
+    # (staging column, MetaDataType name)
+    'metadata': (('description', 'description'), ('genre', 'film genre')),
+}
+
+_SONG_IMPORT = {
+    'columns': ('title', 'length', 'description', 'storage_location', 'genre',
+                'artwork', 'artist'),
+    'staging': """create temp table import_staging (
+            title varchar(100),
+            length integer,
+            description text,
+            storage_location text,
+            genre text,
+            artwork text,
+            artist text,
+            media_id integer default nextval('mediaserver.mediaitem_media_id_seq')
+        ) on commit drop""",
+    'inserts': (
+        """insert into mediaserver.AudioMedia(media_id)
+           select media_id from import_staging""",
+        """insert into mediaserver.Song(song_id, song_title, length)
+           select media_id, title, length from import_staging""",
+        # New artists once each, stored lower case as addSong does
+        """insert into mediaserver.Artist(artist_name)
+           select distinct lower(s.artist) from import_staging s
+           where s.artist is not null and not exists (
+               select 1 from mediaserver.Artist a
+               where lower(a.artist_name) = lower(s.artist))""",
+        """insert into mediaserver.Song_Artists(song_id, performing_artist_id)
+           select distinct s.media_id, a.artist_id
+           from import_staging s join (
+               select lower(artist_name) as name, min(artist_id) as artist_id
+               from mediaserver.Artist
+               where lower(artist_name) in (select lower(artist) from import_staging)
+               group by lower(artist_name)) a on (a.name = lower(s.artist))""",
+    ),
+    'metadata': (('description', 'description'), ('genre', 'song genre'),
+                 ('artwork', 'artwork')),
+}
+
+class _CopyStream(io.RawIOBase):
+    """The records as COPY csv data, encoded as pg8000 reads it"""
+
+    def __init__(self, records, columns, chunk_size=65536):
+        self._chunks = self._encode(records, columns, chunk_size)
+        self._pending = memoryview(b'')
+
+    @staticmethod
+    def _encode(records, columns, chunk_size):
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator='\n')
+        for record in records:
+            writer.writerow([record.get(col) for col in columns])
+            if buf.tell() >= chunk_size:
+                yield buf.getvalue().encode('utf-8')
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue().encode('utf-8')
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._pending:
+            try:
+                self._pending = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+def _bulk_import(records, spec):
+    # One (md_type_id, md_value) row per metadata column of each staged row
+    staged_metadata = """import_staging s
+        cross join lateral (values {values}) as v(md_type_name, md_value)
+        join mediaserver.MetaDataType t on (t.md_type_name = v.md_type_name)""".format(
+            values=", ".join("(%%s, s.%s)" % col for col, _ in spec['metadata']))
+    type_names = tuple(name for _, name in spec['metadata'])
+
+    started = time.perf_counter()
+    with get_cursor() as cur:
+        # The search documents are worked out once at the end, not by the
+        # triggers for every row inserted
+        cur.execute("select set_config('mediaserver.defer_search_documents', 'on', true)")
+        cur.execute("drop table if exists pg_temp.import_staging, pg_temp.import_metadata")
+        cur.execute(spec['staging'])
+        cur.execute(
+            "copy import_staging ({}) from stdin with (format csv)".format(
+                ", ".join(spec['columns'])),
+            stream=_CopyStream(records, spec['columns']))
+        rows = cur.rowcount
+        copied = time.perf_counter()
+        cur.execute("analyze import_staging")
+
+        cur.execute("""insert into mediaserver.MediaItem(media_id, storage_location)
+                       select media_id, storage_location from import_staging""")
+        for sql in spec['inserts']:
+            cur.execute(sql)
+
+        # Each distinct (type, value) pair becomes one MetaData row, reusing
+        # an existing row with the same value where there is one
+        cur.execute("""create temp table import_metadata on commit drop as
+                       select distinct t.md_type_id, v.md_value, null::bigint as md_id
+                       from """ + staged_metadata + """
+                       where v.md_value is not null""", type_names)
+        cur.execute("""update import_metadata i set md_id = m.md_id
+                       from (select md_type_id, md_value, min(md_id) as md_id
+                             from mediaserver.MetaData
+                             where (md_type_id, md_value) in (
+                                 select md_type_id, md_value from import_metadata)
+                             group by md_type_id, md_value) m
+                       where i.md_type_id = m.md_type_id and i.md_value = m.md_value""")
+        cur.execute("""with created as (
+                           insert into mediaserver.MetaData(md_type_id, md_value)
+                           select md_type_id, md_value from import_metadata
+                           where md_id is null
+                           returning md_id, md_type_id, md_value)
+                       update import_metadata i set md_id = c.md_id from created c
+                       where i.md_type_id = c.md_type_id and i.md_value = c.md_value""")
+        cur.execute("""insert into mediaserver.MediaItemMetaData(media_id, md_id)
+                       select distinct s.media_id, i.md_id
+                       from """ + staged_metadata + """
+                           join import_metadata i on (
+                               i.md_type_id = t.md_type_id and i.md_value = v.md_value)""",
+                    type_names)
+        cur.execute("""select mediaserver.refresh_search_documents(
+                           'media', array(select media_id from import_staging))""")
+        # Later writes in a request's unit of work are the triggers' again
+        cur.execute("select set_config('mediaserver.defer_search_documents', 'off', true)")
+    finished = time.perf_counter()
+    catalog_changed()
+
+    return {
+        'rows': rows,
+        'seconds': finished - started,
+        'copy_seconds': copied - started,
+        'insert_seconds': finished - copied,
+        'rows_per_second': rows / (finished - started) if finished > started else 0.0,
+    }
+
+def import_movies(records: Iterable[dict]) -> dict:
+    """
+    Add many movies in one transaction. Each record has the fields of
+    add_movie_to_db: title, release_year, description, storage_location
+    and genre. Returns the row count and timings.
+    """
+    return _bulk_import(records, _MOVIE_IMPORT)
+
+def import_songs(records: Iterable[dict]) -> dict:
+    """
+    Add many songs in one transaction. Each record has the fields of
+    add_song_to_db: title, length, description, storage_location, genre,
+    artwork and artist. Returns the row count and timings.
+    """
+    return _bulk_import(records, _SONG_IMPORT)
 
 
 
@@ -1291,28 +2650,13 @@ def get_last_movie():
     Get all the latest entered movie in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         # Try executing the SQL and get from the database
         sql = """
         select max(movie_id) as movie_id from mediaserver.movie"""
 
         r = dictfetchone(cur,sql)
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error adding a movie:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 
 #####################################################
@@ -1323,31 +2667,98 @@ def get_last_song():
     Get all the latest entered movie in your media server
     """
 
-    conn = database_connect()
-    if(conn is None):
-        return None
-    cur = conn.cursor()
-    try:
+    with get_cursor() as cur:
         # Try executing the SQL and get from the database
         sql = """
         select max(song_id) as song_id from mediaserver.Song"""
 
         r = dictfetchone(cur,sql)
-        print("return val is:")
-        print(r)
-        cur.close()                     # Close the cursor
-        conn.close()                    # Close the connection to the db
         return r
-    except:
-        # If there were any errors, return a NULL row printing an error to the debug
-        print("Unexpected error adding a song:", sys.exc_info()[0])
-        raise
-    cur.close()                     # Close the cursor
-    conn.close()                    # Close the connection to the db
-    return None
 
 
 
+#####################################################
+#   Whole pages in one round trip
+#   Same queries as the single getters above, sent
+#   together through a pg8000 pipeline or folded into
+#   one. A page whose item has no rows is remembered
+#   as missing for a while (see _unless_missing).
+#####################################################
+
+def get_user_dashboard(username):
+    """
+    Everything the index page shows for a user:
+    (playlists, podcast subscriptions, in progress items, contacts)
+    """
+    return tuple(_fetch_all_pipelined(
+        (_USER_PLAYLISTS_SQL, (username,)),
+        (_USER_PODCAST_SUBSCRIPTIONS_SQL, (username,)),
+        (_USER_IN_PROGRESS_ITEMS_SQL, (username,)),
+        (_USER_CONTACTS_SQL, (username,)),
+    ))
+
+def get_podcast_page(podcast_id):
+    """
+    (podcast, episodes, metadata) for one podcast, as returned by
+    get_podcast, get_all_podcasteps_for_podcast and get_podcast_metadata;
+    podcast is None if there is no such podcast
+    """
+    return _unless_missing(('podcast', podcast_id), lambda: _podcast_page(podcast_id),
+                           (None, [], []))
+
+def _podcast_page(podcast_id):
+    podcast, episodes, metadata = _fetch_all_pipelined(
+        (_PODCAST_SQL, (podcast_id,)),
+        (_PODCAST_EPISODES_SQL, (podcast_id,)),
+        (_PODCAST_METADATA_SQL, (podcast_id,)),
+    )
+    return podcast[0] if podcast else None, episodes, _name_metadata_types(metadata)
+
+def get_album_page(album_id):
+    """(album, songs, genres) as returned by get_album, get_album_songs and get_album_genres"""
+    return _unless_missing(('album', album_id), lambda: tuple(_fetch_all_pipelined(
+        (_ALBUM_SQL, (album_id,)),
+        (_ALBUM_SONGS_SQL, (album_id,)),
+        (_ALBUM_GENRES_SQL, (album_id,)),
+    )), ([], [], []))
+
+def get_tvshow_page(tvshow_id):
+    """(tvshow, episodes) as returned by get_tvshow and get_all_tvshoweps_for_tvshow"""
+    return _unless_missing(('tvshow', tvshow_id), lambda: tuple(_fetch_all_pipelined(
+        (_TVSHOW_SQL, (tvshow_id,)),
+        (_TVSHOW_EPISODES_SQL, (tvshow_id,)),
+    )), ([], []))
+
+# get_song and get_song_metadata in one: the song's columns repeat on each
+# metadata row, and no rows means no song
+_SONG_PAGE_SQL = """
+        select s.song_title, s.length,
+               (select string_agg(a.artist_name, ',')
+                from mediaserver.Song_Artists sa
+                     join mediaserver.Artist a on (sa.performing_artist_id = a.artist_id)
+                where sa.song_id = s.song_id) as artists,
+               md.md_type_id, md.md_value
+        from mediaserver.Song s
+             left outer join (mediaserver.MediaItemMetaData natural join mediaserver.MetaData) md
+             on (md.media_id = s.song_id)
+        where s.song_id = %s
+        """
+
+def get_song_page(song_id):
+    """(song, metadata) as returned by get_song and get_song_metadata"""
+    return _unless_missing(('song', song_id), lambda: _song_page(song_id), ([], []))
+
+def _song_page(song_id):
+    with get_cursor() as cur:
+        rows = dictfetchall(cur, _SONG_PAGE_SQL, (song_id,))
+    if not rows:
+        return [], []
+    song = [{k: rows[0][k] for k in ('song_title', 'artists', 'length')}]
+    metadata = [{'md_type_id': r['md_type_id'], 'md_value': r['md_value']}
+                for r in rows if r['md_type_id'] is not None]
+    return song, _name_metadata_types(metadata)
+
+
 #  FOR MARKING PURPOSES ONLY
 #  DO NOT CHANGE
 
@@ -1381,17 +2792,24 @@ def update_user_credential(user: str, password: str, is_super: bool=False):
                 mediaserver.UserAccount
             set
                 password = public.crypt(%s, public.gen_salt('bf', 8)),
-                issuper = %s
+                issuper = %s,
+                credential_version = credential_version + 1
             where
-                username = %s; """,
+                username = %s
+            returning credential_version; """,
             (password, is_super, user)
         )
+        r = cur.fetchone()
+    if r is None:
+        return
+    # Sessions holding the old authorization check again once this commits
+    uow = _current_unit_of_work()
+    if uow is None:
+        _credentials_changed(user, r[0])
+    else:
+        uow.on_close(lambda committed: committed and _credentials_changed(user, r[0]))
 
-def get_user_contacts(user: str):
-    with get_cursor() as cur:
-        return _fetch_all(
-            cur,
-            """
+_USER_CONTACTS_SQL = """
             select
                 ct.contact_type_name as type,
                 cm.contact_type_value as value
@@ -1401,24 +2819,18 @@ def get_user_contacts(user: str):
                 mediaserver.ContactType as ct
             where
                 username = %s;
-            """,
-            (user,)
-        )
+            """
 
-def __get_contact_type_id_mapping(cur):
-    """The ContactType table make no sense"""
-    ds = _fetch_all(
-        cur,
-        """select contact_type_name as n, contact_type_id as id from mediaserver.ContactType;"""
-    )
-    return {d['n']: d['id'] for d in ds}
+def get_user_contacts(user: str):
+    with get_cursor() as cur:
+        return _fetch_all(cur, _USER_CONTACTS_SQL, (user,))
 
 def delete_contact(user: str, contact_type: str, value: str):
+    try:
+        ctid = contact_type_ids()[contact_type]
+    except KeyError:
+        raise UserException("Invaild contact type")
     with get_cursor() as cur:
-        try:
-            ctid = __get_contact_type_id_mapping(cur)[contact_type]
-        except KeyError:
-            raise UserException("Invaild contact type")
         cur.execute(
             """delete from mediaserver.ContactMethod
             where (
@@ -1433,11 +2845,11 @@ def delete_contact(user: str, contact_type: str, value: str):
 
 
 def add_contact(user: str, contact_type: str, value: str):
+    try:
+        ctid = contact_type_ids()[contact_type]
+    except KeyError:
+        raise UserException("Invaild contact type")
     with get_cursor() as cur:
-        try:
-            ctid = __get_contact_type_id_mapping(cur)[contact_type]
-        except KeyError:
-            raise UserException("Invaild contact type")
         cur.execute(
             """
             insert into mediaserver.ContactMethod
@@ -1448,26 +2860,21 @@ def add_contact(user: str, contact_type: str, value: str):
             (user, value, ctid)
         )
 
-def __get_metadata_type_id_mapping(cur):
-    ds = _fetch_all(
-        cur,
-        """select md_type_name as n, md_type_id as id from mediaserver.MetaDataType;"""
-    )
-    return {d['n']: d['id'] for d in ds}
-
 def __build_in_clause(item, n_values, not_in=False):
     return "({} {}in ({}))".format(item, "not " if not_in else "", ",".join("%s" for _ in range(n_values)))
 
-def __build_where_clause(and_where, or_where, and_where_params, or_where_params):
-    and_where.append("({})".format(" or ".join(or_where)))
-    if and_where:
-        return "where ({})".format(" and ".join(and_where)), [*and_where_params, *or_where_params]
-    return "", []
-
-def __movie_metadata_subquery_builder(md_id, md_values, disallow=False):
-    and_where = ["mtm.media_id = q1.movie_id", "mt.md_type_id = %s"]
-    or_where = []
+def __movie_metadata_exists(md_id, md_values=(), not_exists=False):
+    # A semi-join on MediaItemMetaData's (media_id, md_id) key: it stops at
+    # the movie's first matching row instead of counting all of them
+    sql = """({}exists (select 1 from mediaserver.MediaItemMetaData as mimd
+        join mediaserver.MetaData as md on (md.md_id = mimd.md_id)
+        where mimd.media_id = t.movie_id and md.md_type_id = %s{}))""".format(
+        "not " if not_exists else "",
+        " and " + __build_in_clause("md.md_value", len(md_values)) if md_values else ""
+    )
+    return sql, [md_id, *md_values]
 
+def __movie_metadata_filter(md_id, md_values, disallow=False):
     not_include = []
     could_include = []
 
@@ -1479,28 +2886,35 @@ def __movie_metadata_subquery_builder(md_id, md_values, disallow=False):
         else:
             could_include.append(v)
 
-    if len(could_include) > 0:
-        or_where.append(
-            __build_in_clause("md_value", len(could_include))
-        )
-    if len(not_include) > 0:
-        and_where.append(
-            __build_in_clause("md_value", len(not_include), True)
-        )
-
-    where_clause, where_params = __build_where_clause(
-        and_where,
-        or_where,
-        (md_id, *not_include),
-        could_include
-    )
-    sql = """((select count(*) from mediaserver.metadata as mt natural
-    join mediaserver.mediaitemmetadata as mtm {}) != 0)""".format(where_clause)
-    return sql, where_params
-
-def movie_fuzzy_search(terms: Iterable[str], metadata=[], limit: int=10):
+    # key=a;key=-b: has a value a, and no value b. A key on its own only
+    # needs the movie to have some value of that type
+    and_where = []
+    params = []
+    if could_include or not not_include:
+        sql, param = __movie_metadata_exists(md_id, could_include)
+        and_where.append(sql)
+        params.extend(param)
+    if not_include:
+        sql, param = __movie_metadata_exists(md_id, not_include, True)
+        and_where.append(sql)
+        params.extend(param)
+
+    sql = "({})".format(" and ".join(and_where))
+    if disallow:
+        # -key=...: the movies the filter without the '-' would leave out
+        sql = "(not {})".format(sql)
+    return sql, params
+
+def movie_fuzzy_search(terms: Iterable[str], metadata={}, limit: int=10, offset: int=0):
+    # Matching ignores case and the order of the terms, so queries that
+    # differ only in those share a cache entry
+    terms = sorted(t.lower() for t in terms)
+    key = ('fuzzy', tuple(terms), json.dumps(metadata, sort_keys=True, default=str), limit, offset)
+    return _cached_search(key, lambda: _movie_fuzzy_search(terms, metadata, limit, offset))
+
+def _movie_fuzzy_search(terms, metadata, limit, offset):
+    md_mapping = metadata_type_ids()
     with get_cursor() as cur:
-        md_mapping = __get_metadata_type_id_mapping(cur)
 
         where_and = []
         where_and_param = []
@@ -1516,10 +2930,9 @@ def movie_fuzzy_search(terms: Iterable[str], metadata=[], limit: int=10):
             else:
                 words.append(t)
 
-        q2_where_and = ["similarity >= 0.7"]
-        q2_where_and_param = []
-
-        for mk in metadata:
+        # The metadata filters go in with the title ones, ahead of the
+        # ranking, so a page is only cut from the movies that pass them
+        for mk, md_values in metadata.items():
             if mk[0] == '-':
                 if len(mk) == 1:
                     continue
@@ -1529,41 +2942,147 @@ def movie_fuzzy_search(terms: Iterable[str], metadata=[], limit: int=10):
                 disallow=False
 
             try:
-                sql, param = __movie_metadata_subquery_builder(md_mapping[mk], metadata[mk], disallow)
-                q2_where_and.append(sql)
-                q2_where_and_param.extend(param)
+                sql, param = __movie_metadata_filter(md_mapping[mk], md_values, disallow)
+                where_and.append(sql)
+                where_and_param.extend(param)
             except KeyError:
                 raise UserException("invaild metadata type")
 
         where_clause = "where(({where_and_clause}))".format(
             where_and_clause=" and ".join(where_and) or "true",
         )
-        q2_where_clause = "where({where_and_clause})".format(
-            where_and_clause=" and ".join(q2_where_and) or "true",
-        )
-        print(words)
         if words:
-            select_stmt = "select movie_id, movie_title, release_year, total_similarity(title_words, %s::varchar[]) as similarity"
+            # Same ranking as total_similarity(title_words, words), without
+            # working it out for every movie: first the title words sharing
+            # a trigram with any term (titleword_trgm_idx; at threshold 0 the
+            # index returns every such word) scored against all the terms,
+            # then the movies with one of those words (movie_title_words_idx)
+            # scored by adding up their words' scores. The threshold is put
+            # back after the query, as the transaction may be the request's
+            cur.execute("""select s.threshold, set_config('pg_trgm.similarity_threshold', '0', true)
+                           from (select current_setting('pg_trgm.similarity_threshold', true)
+                                 as threshold offset 0) s""")
+            threshold = cur.fetchone()[0]
+            sql = """
+            with terms as (
+                select unnest(%s::varchar[]) as term
+            ), word_scores as (
+                select v.word, sum(similarity(v.word, terms.term)) as score
+                from mediaserver.TitleWord v join terms on (v.word %% terms.term)
+                group by v.word
+                having sum(similarity(v.word, terms.term)) > 0
+            ), candidates as (
+                select movie_id, movie_title, release_year, title_words
+                from mediaserver.movie as t
+                {where_clause} and title_words && array(select word from word_scores)::varchar[]
+            )
+            select c.movie_id, c.movie_title, c.release_year, sum(ws.score)::float as similarity
+            from candidates c cross join unnest(c.title_words) w
+                 join word_scores ws on (ws.word = w)
+            group by c.movie_id, c.movie_title, c.release_year
+            having sum(ws.score) >= 0.7
+            order by similarity desc, c.movie_id
+            limit %s offset %s;"""
+            params = (words, *where_and_param, limit, offset)
         else:
-            select_stmt = "select movie_id, movie_title, release_year, 1 as similarity"
-
-        sql = """select * from (
-            {select_stmt}
+            # movie_id breaks the ties so the pages don't overlap
+            sql = """
+            select movie_id, movie_title, release_year, 1 as similarity
             from mediaserver.movie as t
             {where_clause}
-            order by similarity desc
-            limit %s
-        ) as q1 {q2_where_clause};""".format(
-            select_stmt=select_stmt,
-            where_clause=where_clause,
-            q2_where_clause=q2_where_clause,
-        )
+            order by movie_id
+            limit %s offset %s;"""
+            params = (*where_and_param, limit, offset)
+
+        sql = sql.format(where_clause=where_clause)
+        rows = _fetch_all(cur, sql, params)
         if words:
-            print(sql % (words, *where_and_param, limit, *q2_where_and_param))
+            # Unset until pg_trgm is first loaded, when its default applies
+            cur.execute("select set_config('pg_trgm.similarity_threshold', %s, true)",
+                        (threshold or '0.3',))
+        return rows
+
+#####################################################
+#   Search every media type
+#   One query over SearchDocument, which triggers keep
+#   a row in for each movie, song, podcast, episode,
+#   TV show and album.
+#####################################################
+
+# The /api/search types and the SearchDocument media types they cover
+SEARCH_TYPES = {
+    'all': None,
+    'movie': ('movie',),
+    'song': ('song',),
+    'album': ('album',),
+    'podcast': ('podcast', 'podcastepisode'),
+    'podcastepisode': ('podcastepisode',),
+    'tvshow': ('tvshow', 'tvepisode'),
+    'tvepisode': ('tvepisode',),
+}
+
+def _tsquery(words, weights=''):
+    # Each word is a prefix, so a hint matches while the last word is being
+    # typed. Only \w runs reach to_tsquery, which has its own syntax
+    return " & ".join("{}:*{}".format(w, weights) for w in words)
+
+def search_documents(terms: Iterable[str], mtype='all', limit: int=10, offset: int=0,
+                     titles_only=False):
+    """
+    Items of any type whose title or description has every term as a word
+    or the start of one, and none of the '-' terms; failing that, for a
+    search (not titles_only), items with title words similar to the terms.
+    The best matches and the most played come first.
+    """
+    try:
+        types = SEARCH_TYPES[mtype]
+    except KeyError:
+        raise UserException("invaild media type")
+    terms = sorted(t.lower() for t in terms)
+    key = ('documents', mtype, tuple(terms), titles_only, limit, offset)
+    return _cached_search(key, lambda: _search_documents(terms, types, limit, offset, titles_only))
+
+def _search_documents(terms, types, limit, offset, titles_only):
+    words = []
+    excluded = []
+    for t in terms:
+        if t.startswith('-'):
+            excluded.extend(re.findall(r'\w+', t[1:]))
         else:
-            print(sql % (*where_and_param, limit, *q2_where_and_param))
-        if words:
-            params = (words, *where_and_param, limit, *q2_where_and_param)
+            words.extend(re.findall(r'\w+', t))
+
+    where_and = []
+    params = []
+    if words:
+        # Hints only look at the titles, weight A in the document
+        params.append(_tsquery(words, 'A' if titles_only else ''))
+        if titles_only:
+            where_and.append("d.document @@ q.q")
         else:
-            params = (*where_and_param, limit, *q2_where_and_param)
-        return _fetch_all(cur, sql, params)
+            # Title words similar to the terms (titleword_trgm_idx), for
+            # misspelt searches that match no word
+            where_and.append("""(d.document @@ q.q or d.title_words && array(
+                select v.word from mediaserver.TitleWord v
+                    join unnest(%s::varchar[]) as t(term) on (v.word %% t.term))::varchar[])""")
+            params.append(words)
+    else:
+        params.append('')
+    if excluded:
+        where_and.append("not d.document @@ to_tsquery('simple', %s)")
+        params.append(" | ".join("{}:*".format(w) for w in excluded))
+    if types:
+        where_and.append("d.media_type in ({})".format(",".join("%s" for _ in types)))
+        params.extend(types)
+
+    # A full text match outranks a similar title word, and ts_rank weighs a
+    # title match above a description one; plays scale both
+    sql = """
+    select d.media_type, d.item_id, d.parent_id, d.title, d.release_year, d.popularity,
+           ((case when d.document @@ q.q then 1 + ts_rank(d.document, q.q) else 0.5 end)
+            * (1 + ln(1 + d.popularity)))::float as similarity
+    from mediaserver.SearchDocument d, to_tsquery('simple', %s) as q
+    where {where_clause}
+    order by similarity desc, d.media_type, d.item_id
+    limit %s offset %s""".format(where_clause=" and ".join(where_and) or "true")
+    with get_cursor() as cur:
+        return _fetch_all(cur, sql, (*params, limit, offset))
@@ -3,8 +3,8 @@ from .core import (
     Error, OperationalError, IntegrityError, InternalError, NotSupportedError,
     ArrayContentNotHomogenousError, ArrayContentEmptyError,
     ArrayDimensionsNotConsistentError, ArrayContentNotSupportedError, utc,
-    Connection, Cursor, Binary, Date, DateFromTicks, Time, TimeFromTicks,
-    Timestamp, TimestampFromTicks, BINARY, Interval)
+    Connection, Cursor, Pipeline, Binary, Date, DateFromTicks, Time,
+    TimeFromTicks, Timestamp, TimestampFromTicks, BINARY, Interval)
 from ._version import get_versions
 __version__ = get_versions()['version']
 del get_versions
@@ -41,7 +41,8 @@ __author__ = "Mathieu Fenniak"
 
 def connect(
         user=None, host='localhost', unix_sock=None, port=5432, database=None,
-        password=None, ssl=False, timeout=None, **kwargs):
+        password=None, ssl=False, timeout=None, max_prepared_statements=None,
+        fetch_size=None, **kwargs):
     """Creates a connection to a PostgreSQL database.
 
     This function is part of the `DBAPI 2.0 specification
@@ -96,11 +97,22 @@ def connect(
         connection to the database will time out. The default is ``None`` which
         means no timeout.
 
+    :keyword max_prepared_statements:
+        The most prepared statements the connection keeps on the server. Once
+        there are more, the least recently used one is closed. The default is
+        256.
+
+    :keyword fetch_size:
+        How many rows of a result set to fetch per network round trip: a
+        number of rows, ``0`` for all of them at once, or ``'adaptive'``.  See
+        :attr:`Connection.fetch_size`.  The default is 100.
+
     :rtype:
         A :class:`Connection` object.
     """
     return Connection(
-        user, host, unix_sock, port, database, password, ssl, timeout)
+        user, host, unix_sock, port, database, password, ssl, timeout,
+        max_prepared_statements, fetch_size)
 
 apilevel = "2.0"
 """The DBAPI level supported, currently "2.0".
@@ -164,8 +176,8 @@ __all__ = [
     ProgrammingError, Error, OperationalError, IntegrityError, InternalError,
     NotSupportedError, ArrayContentNotHomogenousError, ArrayContentEmptyError,
     ArrayDimensionsNotConsistentError, ArrayContentNotSupportedError, utc,
-    Connection, Cursor, Binary, Date, DateFromTicks, Time, TimeFromTicks,
-    Timestamp, TimestampFromTicks, BINARY, Interval]
+    Connection, Cursor, Pipeline, Binary, Date, DateFromTicks, Time,
+    TimeFromTicks, Timestamp, TimestampFromTicks, BINARY, Interval]
 
 """Version string for pg8000.
 
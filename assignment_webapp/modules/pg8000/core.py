@@ -6,7 +6,7 @@ import threading
 from struct import pack
 from hashlib import md5
 from decimal import Decimal
-from collections import deque, defaultdict
+from collections import deque, defaultdict, OrderedDict
 from itertools import count, islice
 from six.moves import map
 from six import b, PY2, integer_types, next, text_type, u, binary_type
@@ -15,7 +15,7 @@ from copy import deepcopy
 from calendar import timegm
 import os
 from distutils.version import LooseVersion
-from struct import Struct
+from struct import Struct, error as struct_error
 import time
 import pg8000
 
@@ -781,6 +781,114 @@ def int_in(data, offset, length):
     return int(data[offset: offset + length])
 
 
+DATE_EPOCH_ORDINAL = datetime.date(2000, 1, 1).toordinal()
+DATE_INFINITY = 2 ** 31 - 1
+DATE_MINUS_INFINITY = -2 ** 31
+
+
+# data is a 32-bit integer representing days since 2000-01-01
+def date_from_days(days):
+    if days == DATE_INFINITY:
+        return datetime.date.max
+    elif days == DATE_MINUS_INFINITY:
+        return datetime.date.min
+    else:
+        return datetime.date.fromordinal(days + DATE_EPOCH_ORDINAL)
+
+
+def date_recv(data, offset, length):
+    return date_from_days(i_unpack(data, offset)[0])
+
+
+# Binary recv functions whose values always take the same number of bytes,
+# mapped to their struct format character and a conversion for the unpacked
+# value (None if the unpacked value is already the result).
+FIXED_WIDTH_RECV = {
+    int2_recv: ('h', None),
+    int4_recv: ('i', None),
+    int8_recv: ('q', None),
+    float4_recv: ('f', None),
+    float8_recv: ('d', None),
+    date_recv: ('i', date_from_days),
+}
+
+
+def compile_row_decoder(
+        funcs, fixed_width=FIXED_WIDTH_RECV, text_funcs=(), encoding='utf8'):
+    """Builds a function that decodes the body of a DataRow message into a
+    list of values, for rows whose columns are read by ``funcs``.
+
+    The per-column loop is unrolled.  Each run of consecutive fixed-width
+    columns (see :data:`FIXED_WIDTH_RECV`) is read with one precomputed
+    struct, falling back to column by column reads when one of them is NULL.
+    Columns read by one of ``text_funcs`` are decoded inline.
+    """
+    ns = {
+        'i_unpack': i_unpack, 'struct_error': struct_error,
+        'text_type': text_type, 'encoding': encoding}
+    body = ["idx = 2"]
+
+    def column(n):
+        func = funcs[n]
+        if func in text_funcs:
+            value = "text_type(data[idx:idx + vlen], encoding)"
+        else:
+            ns['f%d' % n] = func
+            value = "f%d(data, idx, vlen)" % n
+        return [
+            "vlen = i_unpack(data, idx)[0]",
+            "idx += 4",
+            "if vlen == -1:",
+            "    c%d = None" % n,
+            "else:",
+            "    c%d = %s" % (n, value),
+            "    idx += vlen"]
+
+    n = 0
+    while n < len(funcs):
+        end = n
+        while end < len(funcs) and funcs[end] in fixed_width:
+            end += 1
+        if end == n:
+            body.extend(column(n))
+            n += 1
+            continue
+
+        # A run of fixed-width columns, each an Int32 length and a value
+        codes = [fixed_width[funcs[i]] for i in range(n, end)]
+        run = Struct('!' + ''.join('i' + code for code, _ in codes))
+        ns['run%d' % n] = run.unpack_from
+        checks = []
+        values = []
+        for i, (code, conv) in enumerate(codes):
+            checks.append("v[%d] == %d" % (2 * i, Struct('!' + code).size))
+            if conv is None:
+                values.append("c%d = v[%d]" % (n + i, 2 * i + 1))
+            else:
+                ns['conv%d' % (n + i)] = conv
+                values.append(
+                    "c%d = conv%d(v[%d])" % (n + i, n + i, 2 * i + 1))
+        body.extend([
+            "try:",
+            "    v = run%d(data, idx)" % n,
+            "except struct_error:",
+            "    v = None",
+            "if v is not None and %s:" % " and ".join(checks)])
+        body.extend("    " + line for line in values)
+        body.append("    idx += %d" % run.size)
+        body.append("else:")
+        for i in range(n, end):
+            body.extend("    " + line for line in column(i))
+        n = end
+
+    body.append(
+        "return [%s]" % ", ".join("c%d" % i for i in range(len(funcs))))
+    src = "def decode_row(data):\n" + "".join(
+        "    " + line + "\n" for line in body)
+    exec(compile(src, "<pg8000 row decoder>", "exec"), ns)
+    return ns['decode_row']
+
+
 class Cursor():
     """A cursor object is returned by the :meth:`~Connection.cursor` method of
     a connection. It has the following attributes and methods:
@@ -822,6 +930,24 @@ class Cursor():
         This attribute is part of the `DBAPI 2.0 specification
         <http://www.python.org/dev/peps/pep-0249/>`_.
 
+    .. attribute:: executemany_batch_size
+
+        The most parameter sets :meth:`executemany` sends behind one Sync,
+        i.e. in one network round trip.  It defaults to 1000.
+
+        This attribute is not part of the DBAPI standard; it is a pg8000
+        extension.
+
+    .. attribute:: fetch_size
+
+        How many rows each network round trip fetches, in the same form as
+        :attr:`Connection.fetch_size`.  It defaults to ``None``, meaning the
+        connection's setting is used.  A larger :attr:`arraysize` raises it,
+        so a :meth:`fetchmany` call never needs more than one round trip.
+
+        This attribute is not part of the DBAPI standard; it is a pg8000
+        extension.
+
     .. attribute:: description
 
         This read-only attribute is a sequence of 7-item sequences.  Each value
@@ -834,6 +960,9 @@ class Cursor():
         <http://www.python.org/dev/peps/pep-0249/>`_.
     """
 
+    executemany_batch_size = 1000
+    fetch_size = None
+
     def __init__(self, connection):
         self._c = connection
         self.arraysize = 1
@@ -926,13 +1055,42 @@ class Cursor():
             A sequence of parameters to execute the statement with. The values
             in the sequence should be sequences or mappings of parameters, the
             same as the args argument of the :meth:`execute` method.
+
+        The statement is prepared once, and the parameter sets are sent in
+        batches of :attr:`executemany_batch_size`, each batch costing a single
+        network round trip.  With autocommit on, each batch is committed on
+        its own.  If a batch fails, the exception raised has a ``batch``
+        attribute with the ``(start, stop)`` indexes of the parameter sets in
+        that batch, and :attr:`rowcount` counts the rows of the batches that
+        were run before it.
         """
+        param_sets = iter(param_sets)
         rowcounts = []
-        for parameters in param_sets:
-            self.execute(operation, parameters)
-            rowcounts.append(self._row_count)
-
-        self._row_count = -1 if -1 in rowcounts else sum(rowcounts)
+        start = 0
+        try:
+            with self._c._lock:
+                while True:
+                    batch = list(islice(param_sets, self.executemany_batch_size))
+                    if len(batch) == 0:
+                        break
+                    self._row_count = -1
+                    try:
+                        self._c.execute_pipeline(
+                            [(self, operation, args) for args in batch])
+                    except Error as e:
+                        e.batch = (start, start + len(batch))
+                        raise
+                    rowcounts.append(self._row_count)
+                    start += len(batch)
+        except AttributeError as e:
+            if self._c is None:
+                raise InterfaceError("Cursor closed")
+            elif self._c._sock is None:
+                raise InterfaceError("connection is closed")
+            else:
+                raise e
+        finally:
+            self._row_count = -1 if -1 in rowcounts else sum(rowcounts)
 
     def fetchone(self):
         """Fetch the next row of a query result set.
@@ -1030,9 +1188,9 @@ class Cursor():
                     self._c.send_EXECUTE(self)
                     self._c._write(SYNC_MSG)
                     self._c._flush()
-                    self._c.handle_messages(self)
+                    self._c._fetch_messages(self)
                     if not self.portal_suspended:
-                        self._c.close_portal(self)
+                        self._c._fetch_complete(self)
                 try:
                     return self._cached_rows.popleft()
                 except IndexError:
@@ -1046,6 +1204,68 @@ class Cursor():
 if PY2:
     Cursor.next = Cursor.__next__
 
+
+class Pipeline():
+    """A batch of statements that are sent to the server together and
+    answered in a single network round trip.  It is returned by the
+    :meth:`~Connection.pipeline` method of a connection.
+
+    Each call to :meth:`execute` queues a statement and returns the
+    :class:`Cursor` that will hold its result.  The cursors can be read once
+    :meth:`run` has been called, which happens automatically at the end of a
+    ``with`` block::
+
+        with conn.pipeline() as p:
+            users = p.execute("select * from users where id = %s", (1,))
+            groups = p.execute("select * from groups")
+        users.fetchall(), groups.fetchall()
+
+    Every result set is read in full.  If a statement fails, the statements
+    after it in the batch are not run and the error is raised from
+    :meth:`run`.  COPY is not supported in a pipeline.
+
+    This class is a pg8000 extension, not part of the DBAPI 2.0 specification.
+    """
+
+    def __init__(self, connection):
+        self._c = connection
+        self._items = []
+
+    def execute(self, operation, args=None):
+        """Queues a statement.  Parameters are given as for
+        :meth:`Cursor.execute`.
+
+        :returns: The :class:`Cursor` the result will be read into.
+        """
+        cursor = self._c.cursor()
+        self._items.append((cursor, operation, args))
+        return cursor
+
+    def run(self):
+        """Sends every queued statement and reads back all the results.
+
+        :returns: The cursors for the queued statements, in order.
+        """
+        items, self._items = self._items, []
+        if len(items) == 0:
+            return []
+        try:
+            with self._c._lock:
+                self._c.execute_pipeline(items)
+        except AttributeError as e:
+            if self._c._sock is None:
+                raise InterfaceError("connection is closed")
+            else:
+                raise e
+        return [cursor for cursor, _, _ in items]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.run()
+
 # Message codes
 NOTICE_RESPONSE = b("N")
 AUTHENTICATION_REQUEST = b("R")
@@ -1130,6 +1350,57 @@ class MulticastDelegate(object):
             d(*args, **kwargs)
 
 
+class LRUCache(object):
+    """A mapping holding at most ``maxsize`` entries.  Adding an entry to a
+    full cache drops the least recently used one and passes it to
+    ``on_evict(key, value)``.  Lookups, misses and evictions are counted.
+    """
+
+    def __init__(self, maxsize, on_evict=None):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.hits = self.misses = self.evictions = 0
+        self._data = OrderedDict()
+
+    def __getitem__(self, key):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            self.misses += 1
+            raise
+        self._data[key] = value
+        self.hits += 1
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._evict(*self._data.popitem(last=False))
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def clear(self):
+        data, self._data = self._data, OrderedDict()
+        for key, value in data.items():
+            self._evict(key, value)
+
+    def stats(self):
+        return {
+            'size': len(self._data), 'maxsize': self.maxsize,
+            'hits': self.hits, 'misses': self.misses,
+            'evictions': self.evictions}
+
+    def _evict(self, key, value):
+        self.evictions += 1
+        if self.on_evict is not None:
+            self.on_evict(key, value)
+
+
 class Connection(object):
     """A connection object is returned by the :func:`pg8000.connect` function.
     It represents a single physical connection to a PostgreSQL database.
@@ -1173,6 +1444,37 @@ class Connection(object):
 
         .. versionadded:: 1.9
 
+    .. attribute:: Connection.fetch_size
+
+        How many rows of a result set each Execute message asks the server
+        for; once they have been read, the next Execute costs another network
+        round trip.  One of:
+
+        - A number of rows.  The default is 100.
+        - ``0``, for every row in one Execute.  The whole result set is read
+          into memory at once.
+        - ``'adaptive'``, to start small and ask for more rows each time,
+          sized by how wide the rows turn out to be.  How many rows a
+          statement returned is remembered, so the next execution of it can
+          ask for them all at once.
+
+        A cursor's :attr:`~Cursor.fetch_size`, when set, overrides this.
+
+        This attribute is not part of the DBAPI standard; it is a pg8000
+        extension.
+
+    .. attribute:: Connection.rows_received
+                   Connection.bytes_received
+                   Connection.round_trips
+
+        Running totals of the data rows decoded on this connection, of the
+        bytes of row data they were decoded from, and of the times it waited
+        for the server to answer a batch of messages.  Take the difference
+        before and after some work to see how much it read.
+
+        These attributes are not part of the DBAPI standard; they are a
+        pg8000 extension.
+
     .. exception:: Connection.Error
                    Connection.Warning
                    Connection.InterfaceError
@@ -1208,9 +1510,19 @@ class Connection(object):
     # Reading more rows increases performance at the cost of memory.  The
     # default value is 100 rows.  The effect of this parameter is transparent.
     # That is, the library reads more rows when the cache is empty
-    # automatically.
-    _row_cache_size = 100
-    _row_cache_size_bin = i_pack(_row_cache_size)
+    # automatically.  See the fetch_size attribute.
+    fetch_size = 100
+
+    # With fetch_size 'adaptive', the first Execute asks for this many rows
+    # and each one after that for four times as many as the last, so long as
+    # the rows come to no more than about _adaptive_fetch_bytes per Execute.
+    _adaptive_first_fetch = 100
+    _adaptive_fetch_bytes = 4 * 1024 * 1024
+
+    # The most prepared statements (and converted query strings) kept per
+    # paramstyle.  The least recently used statement beyond this is closed
+    # on the server.
+    _max_prepared_statements = 256
 
     def _getError(self, error):
         warn(
@@ -1220,7 +1532,7 @@ class Connection(object):
 
     def __init__(
             self, user, host, unix_sock, port, database, password, ssl,
-            timeout):
+            timeout, max_prepared_statements=None, fetch_size=None):
         self._client_encoding = "utf8"
         self._commands_with_count = (
             b("INSERT"), b("DELETE"), b("UPDATE"), b("MOVE"),
@@ -1247,8 +1559,23 @@ class Connection(object):
         self.password = password
         self.autocommit = False
         self._xid = None
-
-        self._caches = defaultdict(lambda: defaultdict(dict))
+        self.rows_received = 0
+        self.bytes_received = 0
+        self.round_trips = 0
+        if fetch_size is not None:
+            self.fetch_size = fetch_size
+
+        if max_prepared_statements is None:
+            max_prepared_statements = Connection._max_prepared_statements
+        self._statements_to_close = []
+        self._portals_to_close = []
+
+        def new_caches():
+            return {
+                'statement': LRUCache(max_prepared_statements),
+                'ps': LRUCache(
+                    max_prepared_statements, self._close_statement_later)}
+        self._caches = defaultdict(new_caches)
         self.statement_number = 0
         self.portal_number = 0
 
@@ -1439,17 +1766,6 @@ class Connection(object):
             return datetime.time(
                 hour, minute, int(sec), int((sec - int(sec)) * 1000000))
 
-        def date_in(data, offset, length):
-            year_str = data[offset:offset + 4].decode(self._client_encoding)
-            if year_str == 'infi':
-                return datetime.date.max
-            elif year_str == '-inf':
-                return datetime.date.min
-            else:
-                return datetime.date(
-                    int(year_str), int(data[offset + 5:offset + 7]),
-                    int(data[offset + 8:offset + 10]))
-
         def numeric_in(data, offset, length):
             return Decimal(
                 data[offset: offset + length].decode(self._client_encoding))
@@ -1486,7 +1802,7 @@ class Connection(object):
                 1022: (FC_BINARY, array_recv),  # FLOAT8[]
                 1042: (FC_BINARY, text_recv),  # CHAR type
                 1043: (FC_BINARY, text_recv),  # VARCHAR type
-                1082: (FC_TEXT, date_in),  # date
+                1082: (FC_BINARY, date_recv),  # date
                 1083: (FC_TEXT, time_in),
                 1114: (FC_BINARY, timestamp_recv_float),  # timestamp w/ tz
                 1184: (FC_BINARY, timestamptz_recv_float),
@@ -1499,6 +1815,10 @@ class Connection(object):
                 3802: (FC_TEXT, json_in),  # jsonb
             })
 
+        self._fixed_width_recv = dict(FIXED_WIDTH_RECV)
+        self._fixed_width_recv[bool_recv] = ('?', None)
+        self._text_recv = (text_recv,)
+
         self.py_types = {
             type(None): (-1, FC_BINARY, null_send),  # null
             bool: (16, FC_BINARY, bool_send),
@@ -1612,6 +1932,7 @@ class Connection(object):
                 raise e
 
         self.in_transaction = False
+        self.in_failed_transaction = False
         self.notifies = []
         self.notifies_lock = threading.Lock()
 
@@ -1732,6 +2053,14 @@ class Connection(object):
         """
         return Cursor(self)
 
+    def pipeline(self):
+        """Creates a :class:`Pipeline`, which runs several statements in one
+        network round trip.
+
+        This function is a pg8000 extension.
+        """
+        return Pipeline(self)
+
     def commit(self):
         """Commits the current database transaction.
 
@@ -1837,6 +2166,7 @@ class Connection(object):
     def handle_READY_FOR_QUERY(self, data, ps):
         # Byte1 -   Status indicator.
         self.in_transaction = data != IDLE
+        self.in_failed_transaction = data == IDLE_IN_FAILED_TRANSACTION
 
     def handle_BACKEND_KEY_DATA(self, data, ps):
         self._backend_key_data = data
@@ -1877,7 +2207,7 @@ class Connection(object):
             field['pg8000_fc'], field['func'] = \
                 self.pg_types[field['type_oid']]
 
-    def execute(self, cursor, operation, vals):
+    def _lookup_statement(self, operation, vals):
         if vals is None:
             vals = ()
         paramstyle = pg8000.paramstyle
@@ -1892,98 +2222,88 @@ class Connection(object):
         args = make_args(vals)
         params = self.make_params(args)
         key = operation, params
+        return cache, key, statement, args, params
 
-        try:
-            ps = cache['ps'][key]
-            cursor.ps = ps
-        except KeyError:
-            statement_name = "pg8000_statement_" + str(self.statement_number)
-            self.statement_number += 1
-            statement_name_bin = statement_name.encode('ascii') + NULL_BYTE
-            ps = {
-                'row_desc': [],
-                'param_funcs': tuple(x[2] for x in params),
-            }
-            cursor.ps = ps
-
-            param_fcs = tuple(x[1] for x in params)
-
-            # Byte1('P') - Identifies the message as a Parse command.
-            # Int32 -   Message length, including self.
-            # String -  Prepared statement name. An empty string selects the
-            #           unnamed prepared statement.
-            # String -  The query string.
-            # Int16 -   Number of parameter data types specified (can be zero).
-            # For each parameter:
-            #   Int32 - The OID of the parameter data type.
-            val = bytearray(statement_name_bin)
-            val.extend(statement.encode(self._client_encoding) + NULL_BYTE)
-            val.extend(h_pack(len(params)))
-            for oid, fc, send_func in params:
-                # Parse message doesn't seem to handle the -1 type_oid for NULL
-                # values that other messages handle.  So we'll provide type_oid
-                # 705, the PG "unknown" type.
-                val.extend(i_pack(705 if oid == -1 else oid))
-
-            # Byte1('D') - Identifies the message as a describe command.
-            # Int32 - Message length, including self.
-            # Byte1 - 'S' for prepared statement, 'P' for portal.
-            # String - The name of the item to describe.
-            self._send_message(PARSE, val)
-            self._send_message(DESCRIBE, STATEMENT + statement_name_bin)
-            self._write(SYNC_MSG)
-
-            try:
-                self._flush()
-            except AttributeError as e:
-                if self._sock is None:
-                    raise InterfaceError("connection is closed")
-                else:
-                    raise e
-            except socket.error as e:
-                raise OperationalError(str(e))
-
-            self.handle_messages(cursor)
+    def _close_statement_later(self, key, ps):
+        # Closed on the server just before the next Parse goes out, so it
+        # doesn't cost a round trip of its own.
+        self._statements_to_close.append(ps['statement_name_bin'])
 
-            # We've got row_desc that allows us to identify what we're
-            # going to get back from this statement.
-            output_fc = tuple(
-                self.pg_types[f['type_oid']][0] for f in ps['row_desc'])
-
-            ps['input_funcs'] = tuple(f['func'] for f in ps['row_desc'])
-            # Byte1('B') - Identifies the Bind command.
-            # Int32 - Message length, including self.
-            # String - Name of the destination portal.
-            # String - Name of the source prepared statement.
-            # Int16 - Number of parameter format codes.
-            # For each parameter format code:
-            #   Int16 - The parameter format code.
-            # Int16 - Number of parameter values.
-            # For each parameter value:
-            #   Int32 - The length of the parameter value, in bytes, not
-            #           including this length.  -1 indicates a NULL parameter
-            #           value, in which no value bytes follow.
-            #   Byte[n] - Value of the parameter.
-            # Int16 - The number of result-column format codes.
-            # For each result-column format code:
-            #   Int16 - The format code.
-            ps['bind_1'] = statement_name_bin + h_pack(len(params)) + \
-                pack("!" + "h" * len(param_fcs), *param_fcs) + \
-                h_pack(len(params))
-
-            ps['bind_2'] = h_pack(len(output_fc)) + \
-                pack("!" + "h" * len(output_fc), *output_fc)
+    def _send_pending_closes(self):
+        # Byte1('C') - Identifies the message as a close command.
+        # Int32 - Message length, including self.
+        # Byte1 - 'S' for prepared statement, 'P' for portal.
+        # String - The name of the item to close.
+        while self._statements_to_close:
+            self._send_message(
+                CLOSE, STATEMENT + self._statements_to_close.pop())
+        while self._portals_to_close:
+            self._send_message(CLOSE, PORTAL + self._portals_to_close.pop())
 
-            cache['ps'][key] = ps
+    def statement_cache_stats(self):
+        """Hit, miss and eviction counts for the prepared statement cache
+        ('ps') and the converted query string cache ('statement'), summed
+        over paramstyles.
 
-        cursor._cached_rows.clear()
-        cursor._row_count = -1
-        cursor.portal_name = "pg8000_portal_" + str(self.portal_number)
-        self.portal_number += 1
-        cursor.portal_name_bin = cursor.portal_name.encode('ascii') + NULL_BYTE
-        cursor.execute_msg = cursor.portal_name_bin + \
-            Connection._row_cache_size_bin
+        This function is a pg8000 extension.
+        """
+        totals = {}
+        for caches in self._caches.values():
+            for name, cache in caches.items():
+                total = totals.setdefault(name, dict.fromkeys(
+                    ('size', 'maxsize', 'hits', 'misses', 'evictions'), 0))
+                for k, v in cache.stats().items():
+                    total[k] = max(total[k], v) if k == 'maxsize' \
+                        else total[k] + v
+        return totals
+
+    def _send_parse(self, statement, params):
+        self._send_pending_closes()
+        statement_name = "pg8000_statement_" + str(self.statement_number)
+        self.statement_number += 1
+        statement_name_bin = statement_name.encode('ascii') + NULL_BYTE
+        ps = {
+            'statement_name_bin': statement_name_bin,
+            'row_desc': [],
+            'param_funcs': tuple(x[2] for x in params),
+        }
 
+        # Byte1('P') - Identifies the message as a Parse command.
+        # Int32 -   Message length, including self.
+        # String -  Prepared statement name. An empty string selects the
+        #           unnamed prepared statement.
+        # String -  The query string.
+        # Int16 -   Number of parameter data types specified (can be zero).
+        # For each parameter:
+        #   Int32 - The OID of the parameter data type.
+        val = bytearray(statement_name_bin)
+        val.extend(statement.encode(self._client_encoding) + NULL_BYTE)
+        val.extend(h_pack(len(params)))
+        for oid, fc, send_func in params:
+            # Parse message doesn't seem to handle the -1 type_oid for NULL
+            # values that other messages handle.  So we'll provide type_oid
+            # 705, the PG "unknown" type.
+            val.extend(i_pack(705 if oid == -1 else oid))
+
+        # Byte1('D') - Identifies the message as a describe command.
+        # Int32 - Message length, including self.
+        # Byte1 - 'S' for prepared statement, 'P' for portal.
+        # String - The name of the item to describe.
+        self._send_message(PARSE, val)
+        self._send_message(DESCRIBE, STATEMENT + statement_name_bin)
+        return ps
+
+    def _finish_ps(self, ps, params):
+        # We've got row_desc that allows us to identify what we're
+        # going to get back from this statement.
+        output_fc = tuple(
+            self.pg_types[f['type_oid']][0] for f in ps['row_desc'])
+        param_fcs = tuple(x[1] for x in params)
+
+        ps['input_funcs'] = tuple(f['func'] for f in ps['row_desc'])
+        ps['decode_row'] = compile_row_decoder(
+            ps['input_funcs'], self._fixed_width_recv, self._text_recv,
+            self._client_encoding)
         # Byte1('B') - Identifies the Bind command.
         # Int32 - Message length, including self.
         # String - Name of the destination portal.
@@ -2000,7 +2320,17 @@ class Connection(object):
         # Int16 - The number of result-column format codes.
         # For each result-column format code:
         #   Int16 - The format code.
-        retval = bytearray(cursor.portal_name_bin + ps['bind_1'])
+        ps['bind_1'] = ps['statement_name_bin'] + h_pack(len(params)) + \
+            pack("!" + "h" * len(param_fcs), *param_fcs) + \
+            h_pack(len(params))
+
+        ps['bind_2'] = h_pack(len(output_fc)) + \
+            pack("!" + "h" * len(output_fc), *output_fc)
+
+    def _send_bind(self, portal_name_bin, ps, args):
+        # Byte1('B') - Identifies the Bind command, see _finish_ps for the
+        # layout.
+        retval = bytearray(portal_name_bin + ps['bind_1'])
         for value, send_func in zip(args, ps['param_funcs']):
             if value is None:
                 val = NULL
@@ -2011,10 +2341,53 @@ class Connection(object):
         retval.extend(ps['bind_2'])
 
         self._send_message(BIND, retval)
+
+    def _sync(self):
+        self._write(SYNC_MSG)
+        try:
+            self._flush()
+        except AttributeError as e:
+            if self._sock is None:
+                raise InterfaceError("connection is closed")
+            else:
+                raise e
+        except socket.error as e:
+            raise OperationalError(str(e))
+
+    def execute(self, cursor, operation, vals):
+        cache, key, statement, args, params = self._lookup_statement(
+            operation, vals)
+
+        try:
+            ps = cache['ps'][key]
+            cursor.ps = ps
+        except KeyError:
+            ps = self._send_parse(statement, params)
+            cursor.ps = ps
+            self._sync()
+            self.handle_messages(cursor)
+            self._finish_ps(ps, params)
+            cache['ps'][key] = ps
+
+        cursor._cached_rows.clear()
+        cursor._row_count = -1
+        fetch = self._first_fetch(cursor, ps)
+        if fetch == 0:
+            # Runs to completion, so the unnamed portal will do and there's
+            # nothing to close afterwards.
+            cursor.portal_name = ""
+        else:
+            cursor.portal_name = "pg8000_portal_" + str(self.portal_number)
+            self.portal_number += 1
+        cursor.portal_name_bin = cursor.portal_name.encode('ascii') + NULL_BYTE
+        cursor.execute_msg = cursor.portal_name_bin + i_pack(fetch)
+
+        self._send_pending_closes()
+        self._send_bind(cursor.portal_name_bin, ps, args)
         self.send_EXECUTE(cursor)
         self._write(SYNC_MSG)
         self._flush()
-        self.handle_messages(cursor)
+        self._fetch_messages(cursor)
         if cursor.portal_suspended:
             if self.autocommit:
                 raise InterfaceError(
@@ -2023,7 +2396,125 @@ class Connection(object):
                     "when the transaction is closed.")
 
         else:
-            self.close_portal(cursor)
+            self._fetch_complete(cursor)
+
+    def _first_fetch(self, cursor, ps):
+        size = cursor.fetch_size
+        if size is None:
+            size = self.fetch_size
+        cursor._fetched_rows = cursor._fetched_bytes = 0
+        cursor._adaptive = size == 'adaptive'
+        if cursor._adaptive:
+            size = ps.get('fetch_hint', self._adaptive_first_fetch)
+        elif size == 0:
+            return 0
+        # fetchmany(arraysize) shouldn't take more than one round trip.
+        return max(size, cursor.arraysize)
+
+    def _fetch_messages(self, cursor):
+        # Reads one Execute's worth of rows into the cursor, keeping count
+        # for adaptive fetching.
+        rows, nbytes = self.rows_received, self.bytes_received
+        self.handle_messages(cursor)
+        rows, nbytes = self.rows_received - rows, self.bytes_received - nbytes
+        cursor._fetched_rows += rows
+        cursor._fetched_bytes += nbytes
+        if cursor._adaptive and cursor.portal_suspended:
+            size = min(
+                rows * 4, max(rows, self._adaptive_fetch_bytes * rows //
+                              max(nbytes, 1)))
+            cursor.execute_msg = cursor.portal_name_bin + i_pack(size)
+
+    def _fetch_complete(self, cursor):
+        # The portal has run to the end.  Closing it waits for the next
+        # message batch rather than costing a round trip of its own.
+        if cursor.portal_name:
+            self._portals_to_close.append(cursor.portal_name_bin)
+        if cursor._adaptive and cursor._fetched_rows > 0:
+            rows = cursor._fetched_rows
+            width = max(cursor._fetched_bytes // rows, 1)
+            cursor.ps['fetch_hint'] = max(
+                self._adaptive_first_fetch,
+                min(rows + rows // 4 + 1, self._adaptive_fetch_bytes // width))
+
+    def execute_pipeline(self, items):
+        """Runs several statements with a single Sync, so all of them cost
+        one network round trip (two if some still need to be parsed).
+
+        ``items`` is a sequence of ``(cursor, operation, args)``.  Every
+        result set is read in full into its cursor.  The caller must hold
+        the connection lock.
+        """
+        if not self.in_transaction and not self.autocommit:
+            items = [(self._cursor, "begin transaction", None)] + list(items)
+
+        to_parse = []
+        parsing = {}
+        bound = []
+        for cursor, operation, vals in items:
+            cache, key, statement, args, params = self._lookup_statement(
+                operation, vals)
+            try:
+                ps = cache['ps'][key]
+            except KeyError:
+                try:
+                    ps = parsing[key]
+                except KeyError:
+                    ps = parsing[key] = self._send_parse(statement, params)
+                    to_parse.append((cursor, ps, cache, key, params))
+            bound.append((cursor, ps, args))
+
+        if to_parse:
+            self._sync()
+            try:
+                self._handle_pipeline_messages(
+                    [(cursor, ps) for cursor, ps, _, _, _ in to_parse],
+                    PARSE_COMPLETE)
+            except ProgrammingError:
+                # Statements before the failing one were prepared but will
+                # never be cached.
+                for _, ps, _, _, _ in to_parse:
+                    self._statements_to_close.append(ps['statement_name_bin'])
+                raise
+            for cursor, ps, cache, key, params in to_parse:
+                self._finish_ps(ps, params)
+                cache['ps'][key] = cursor.ps = ps
+
+        for cursor, ps, args in bound:
+            cursor.ps = ps
+            cursor.stream = None
+            cursor._cached_rows.clear()
+            cursor._row_count = -1
+            cursor.portal_suspended = False
+            # The unnamed portal, run to completion (0 = no row limit).
+            self._send_bind(NULL_BYTE, ps, args)
+            self._send_message(EXECUTE, NULL_BYTE + i_pack(0))
+        self._sync()
+        self._handle_pipeline_messages(
+            [(cursor, ps) for cursor, ps, _ in bound], BIND_COMPLETE)
+
+    def _handle_pipeline_messages(self, steps, marker):
+        # Replies arrive in the order the statements were sent, and each
+        # statement's replies start with the ``marker`` message, so that's
+        # where we move on to the next (cursor, ps).  A cursor can appear
+        # more than once, with a different statement each time.
+        code = self.error = None
+        self.round_trips += 1
+        steps = iter(steps)
+        cursor = None
+
+        try:
+            while code != READY_FOR_QUERY:
+                code, data_len = ci_unpack(self._read(5))
+                if code == marker:
+                    cursor, cursor.ps = next(steps)
+                self.message_types[code](self._read(data_len - 4), cursor)
+        except:
+            self._close()
+            raise
+
+        if self.error is not None:
+            raise self.error
 
     def _send_message(self, code, data):
         try:
@@ -2067,20 +2558,13 @@ class Connection(object):
                 self._caches[k]['ps'].clear()
 
     def handle_DATA_ROW(self, data, cursor):
-        data_idx = 2
-        row = []
-        for func in cursor.ps['input_funcs']:
-            vlen = i_unpack(data, data_idx)[0]
-            data_idx += 4
-            if vlen == -1:
-                row.append(None)
-            else:
-                row.append(func(data, data_idx, vlen))
-                data_idx += vlen
-        cursor._cached_rows.append(row)
+        cursor._cached_rows.append(cursor.ps['decode_row'](data))
+        self.rows_received += 1
+        self.bytes_received += len(data)
 
     def handle_messages(self, cursor):
         code = self.error = None
+        self.round_trips += 1
 
         try:
             while code != READY_FOR_QUERY:
@@ -2118,6 +2602,9 @@ class Connection(object):
         if key == b("client_encoding"):
             encoding = value.decode("ascii").lower()
             self._client_encoding = pg_to_py_encodings.get(encoding, encoding)
+            # Cached statements decode text with the old encoding
+            for k in self._caches:
+                self._caches[k]['ps'].clear()
 
         elif key == b("integer_datetimes"):
             if value == b('on'):
@@ -58,15 +58,23 @@
 """
 import os
 import re
+import mmap
 import errno
+import struct
 import tempfile
 import platform
+import threading
+from contextlib import contextmanager
 from hashlib import md5
 from time import time
 try:
     import cPickle as pickle
 except ImportError:  # pragma: no cover
     import pickle
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
 
 from werkzeug._compat import iteritems, string_types, text_type, \
     integer_types, to_native
@@ -802,6 +810,398 @@ class FileSystemCache(BaseCache):
             return False
 
 
+class SharedMemoryCache(BaseCache):
+
+    """A cache in a memory-mapped file, shared by every process that opens
+    the same `path`, such as the worker processes of an application server
+    on one machine.  Unlike the :class:`MemcachedCache` or :class:`RedisCache`
+    no separate service is needed.  Put the file on a memory backed file
+    system (``/dev/shm`` on Linux) so that it never has to reach the disk.
+
+    The segment is divided into slots of `slot_size` bytes.  A key and its
+    pickled value take as many slots as they need, chained together, and
+    keys are found through a hash table with one chain of entries per
+    bucket.  When there are not enough free slots for a new value, entries
+    are evicted with the CLOCK algorithm, an approximation of least
+    recently used: a hand sweeps over the slots and evicts every entry that
+    has not been read since the hand last passed it.  Values that would
+    need more than a quarter of the slots are not stored at all.
+
+    Every operation holds an exclusive :func:`fcntl.flock` on the file, so
+    the cache can be used from any number of processes and threads, and
+    :meth:`inc` and :meth:`dec` are atomic.  Because of that it is only
+    available on platforms with :mod:`fcntl`.
+
+    The first process to create the file decides the size of the segment
+    and its slots; processes opening the file later use it as they find
+    it and ignore their `size` and `slot_size`.
+
+    :param path: the file the segment lives in, created if it is missing.
+    :param size: the size of the segment in bytes.
+    :param slot_size: the size of a slot in bytes.  32 bytes of every slot
+                      are taken by its header.
+    :param default_timeout: the default timeout that is used if no timeout is
+                            specified on :meth:`~BaseCache.set`. A timeout of
+                            0 indicates that the cache never expires.
+    :param mode: the file mode wanted for the segment file, default 0600
+    """
+
+    _magic = b'WZSHMC01'
+
+    #: magic, slot size, slots, buckets, clock hand, first free slot,
+    #: free slots, entries, (unused), hits, misses, evictions, expirations
+    _header = struct.Struct('<8s8i4Q')
+    _header_size = 128
+    _fields = {'hand': 20, 'free': 24, 'nfree': 28, 'entries': 32}
+    _counters = {'hits': 40, 'misses': 48, 'evictions': 56,
+                 'expirations': 64}
+
+    #: state, referenced, key length, next entry in the bucket, next slot
+    #: of the entry (or of the free list), key hash, expiry time and value
+    #: length.  Only the state and next slot matter for free and data slots.
+    _slot_header = struct.Struct('<BBHiiQdI')
+    _FREE, _HEAD, _DATA = 0, 1, 2
+
+    _int = struct.Struct('<i')
+    _uint64 = struct.Struct('<Q')
+    _double = struct.Struct('<d')
+
+    def __init__(self, path, size=64 * 1024 * 1024, slot_size=1024,
+                 default_timeout=300, mode=0o600):
+        BaseCache.__init__(self, default_timeout)
+        if fcntl is None:
+            raise RuntimeError('SharedMemoryCache needs fcntl, which is not '
+                               'available on this platform.')
+        if slot_size <= self._slot_header.size:
+            raise ValueError('slot_size must be more than %d bytes'
+                             % self._slot_header.size)
+        self._path = path
+        self._size = size
+        self._slot_size = slot_size
+        self._mode = mode
+        self._fd = self._mm = None
+        self._open()
+
+    def _open(self):
+        # A descriptor inherited through fork() shares its flock with the
+        # parent process, so a child opens the file again for its own
+        if self._mm is not None:
+            self._mm.close()
+            os.close(self._fd)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        fd = os.open(self._path, os.O_RDWR | os.O_CREAT, self._mode)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                mm = self._attach(fd)
+                if mm is None:
+                    mm = self._create(fd)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        except Exception:
+            os.close(fd)
+            raise
+        self._fd, self._mm = fd, mm
+
+    def _layout(self, slot_size, nslots, nbuckets):
+        self._slot_size = slot_size
+        self._payload = slot_size - self._slot_header.size
+        self._nslots = nslots
+        self._nbuckets = nbuckets
+        self._buckets = self._header_size
+        self._slots = self._buckets + 4 * nbuckets
+        return self._slots + nslots * slot_size
+
+    def _attach(self, fd):
+        size = os.fstat(fd).st_size
+        if size < self._header_size:
+            return None
+        mm = mmap.mmap(fd, size)
+        header = self._header.unpack_from(mm, 0)
+        if header[0] != self._magic or \
+           self._layout(*header[1:4]) != size:
+            mm.close()
+            return None
+        return mm
+
+    def _create(self, fd):
+        nslots = (self._size - self._header_size) // (self._slot_size + 4)
+        if nslots < 1:
+            raise ValueError('size is too small for a single slot')
+        size = self._layout(self._slot_size, nslots, nslots)
+        os.ftruncate(fd, size)
+        mm = mmap.mmap(fd, size)
+        self._reset(mm)
+        return mm
+
+    def _reset(self, mm):
+        # Every slot free and chained to the next, every bucket empty
+        self._header.pack_into(mm, 0, self._magic, self._slot_size,
+                               self._nslots, self._nbuckets, 0, 0,
+                               self._nslots, 0, 0, 0, 0, 0, 0)
+        mm[self._buckets:self._slots] = b'\xff' * (self._slots -
+                                                    self._buckets)
+        pack_into = self._slot_header.pack_into
+        for i in range(self._nslots):
+            pack_into(mm, self._slots + i * self._slot_size, self._FREE, 0,
+                      0, -1, i + 1 if i + 1 < self._nslots else -1, 0, 0, 0)
+
+    @contextmanager
+    def _locked(self):
+        if self._pid != os.getpid():
+            self._open()
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self._mm
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _get_field(self, mm, name):
+        return self._int.unpack_from(mm, self._fields[name])[0]
+
+    def _set_field(self, mm, name, value):
+        self._int.pack_into(mm, self._fields[name], value)
+
+    def _count(self, mm, name, n=1):
+        offset = self._counters[name]
+        self._uint64.pack_into(mm, offset,
+                               self._uint64.unpack_from(mm, offset)[0] + n)
+
+    def _offset(self, i):
+        return self._slots + i * self._slot_size
+
+    def _bucket(self, h):
+        return self._buckets + 4 * (h % self._nbuckets)
+
+    def _next_slot(self, mm, i):
+        return self._int.unpack_from(mm, self._offset(i) + 8)[0]
+
+    def _key(self, key):
+        if isinstance(key, text_type):
+            key = key.encode('utf-8')
+        return key, self._uint64.unpack(md5(key).digest()[:8])[0]
+
+    def _read(self, mm, i, n, skip=0):
+        """`n` bytes of the entry starting at slot `i`, after the first
+        `skip` bytes (the key, to read just the value)."""
+        chunks = []
+        while True:
+            if skip < self._payload:
+                start = self._offset(i) + self._slot_header.size + skip
+                chunk = mm[start:start + min(n, self._payload - skip)]
+                chunks.append(chunk)
+                n -= len(chunk)
+                skip = 0
+            else:
+                skip -= self._payload
+            if n <= 0:
+                return b''.join(chunks)
+            i = self._next_slot(mm, i)
+
+    def _lookup(self, mm, key, h):
+        """The first slot of the entry for `key`, or -1."""
+        i = self._int.unpack_from(mm, self._bucket(h))[0]
+        while i != -1:
+            _, _, klen, next_entry, _, entry_hash, _, _ = \
+                self._slot_header.unpack_from(mm, self._offset(i))
+            if entry_hash == h and klen == len(key) and \
+               self._read(mm, i, klen) == key:
+                return i
+            i = next_entry
+        return -1
+
+    def _find(self, mm, key, h):
+        """Like :meth:`_lookup` but drops the entry if it has expired."""
+        i = self._lookup(mm, key, h)
+        if i != -1:
+            expires = self._double.unpack_from(mm, self._offset(i) + 20)[0]
+            if expires != 0 and expires <= time():
+                self._remove(mm, i)
+                self._count(mm, 'expirations')
+                return -1
+        return i
+
+    def _remove(self, mm, i):
+        _, _, _, next_entry, _, h, _, _ = \
+            self._slot_header.unpack_from(mm, self._offset(i))
+        # Unlink the entry from its bucket
+        link = self._bucket(h)
+        j = self._int.unpack_from(mm, link)[0]
+        while j != i:
+            link = self._offset(j) + 4
+            j = self._int.unpack_from(mm, link)[0]
+        self._int.pack_into(mm, link, next_entry)
+        # and give its slots back to the free list
+        free = self._get_field(mm, 'free')
+        nfree = self._get_field(mm, 'nfree')
+        while i != -1:
+            next_slot = self._next_slot(mm, i)
+            self._slot_header.pack_into(mm, self._offset(i), self._FREE, 0,
+                                        0, -1, free, 0, 0, 0)
+            free = i
+            nfree += 1
+            i = next_slot
+        self._set_field(mm, 'free', free)
+        self._set_field(mm, 'nfree', nfree)
+        self._set_field(mm, 'entries', self._get_field(mm, 'entries') - 1)
+
+    def _evict(self, mm, nslots):
+        """Sweep the clock hand until `nslots` slots are free."""
+        hand = self._get_field(mm, 'hand')
+        now = time()
+        # After one turn every entry has lost its reference bit, so two
+        # turns free up as much as there is
+        for _ in range(2 * self._nslots):
+            if self._get_field(mm, 'nfree') >= nslots:
+                break
+            offset = self._offset(hand)
+            state, referenced, _, _, _, _, expires, _ = \
+                self._slot_header.unpack_from(mm, offset)
+            if state == self._HEAD:
+                if expires != 0 and expires <= now:
+                    self._remove(mm, hand)
+                    self._count(mm, 'expirations')
+                elif referenced:
+                    struct.pack_into('<B', mm, offset + 1, 0)
+                else:
+                    self._remove(mm, hand)
+                    self._count(mm, 'evictions')
+            hand = (hand + 1) % self._nslots
+        self._set_field(mm, 'hand', hand)
+
+    def _store(self, mm, key, h, value, expires):
+        i = self._lookup(mm, key, h)
+        if i != -1:
+            self._remove(mm, i)
+        data = key + value
+        nslots = max(1, -(-len(data) // self._payload))
+        if nslots > max(1, self._nslots // 4) or len(key) > 0xffff:
+            return False
+        self._evict(mm, nslots)
+
+        # Take the slots off the free list
+        slots = []
+        i = self._get_field(mm, 'free')
+        for _ in range(nslots):
+            slots.append(i)
+            i = self._next_slot(mm, i)
+        self._set_field(mm, 'free', i)
+        self._set_field(mm, 'nfree', self._get_field(mm, 'nfree') - nslots)
+
+        bucket = self._bucket(h)
+        pack_into = self._slot_header.pack_into
+        for n, i in enumerate(slots):
+            offset = self._offset(i)
+            next_slot = slots[n + 1] if n + 1 < nslots else -1
+            if n == 0:
+                pack_into(mm, offset, self._HEAD, 0, len(key),
+                          self._int.unpack_from(mm, bucket)[0], next_slot,
+                          h, expires, len(value))
+            else:
+                pack_into(mm, offset, self._DATA, 0, 0, -1, next_slot,
+                          0, 0, 0)
+            chunk = data[n * self._payload:(n + 1) * self._payload]
+            start = offset + self._slot_header.size
+            mm[start:start + len(chunk)] = chunk
+        self._int.pack_into(mm, bucket, slots[0])
+        self._set_field(mm, 'entries', self._get_field(mm, 'entries') + 1)
+        return True
+
+    def _normalize_timeout(self, timeout):
+        timeout = BaseCache._normalize_timeout(self, timeout)
+        if timeout != 0:
+            timeout = time() + timeout
+        return timeout
+
+    def get(self, key):
+        key, h = self._key(key)
+        with self._locked() as mm:
+            i = self._find(mm, key, h)
+            if i == -1:
+                self._count(mm, 'misses')
+                return None
+            offset = self._offset(i)
+            _, _, klen, _, _, _, _, vlen = \
+                self._slot_header.unpack_from(mm, offset)
+            struct.pack_into('<B', mm, offset + 1, 1)
+            self._count(mm, 'hits')
+            value = self._read(mm, i, vlen, skip=klen)
+        try:
+            return pickle.loads(value)
+        except pickle.PickleError:
+            return None
+
+    def set(self, key, value, timeout=None):
+        expires = self._normalize_timeout(timeout)
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        key, h = self._key(key)
+        with self._locked() as mm:
+            return self._store(mm, key, h, value, expires)
+
+    def add(self, key, value, timeout=None):
+        expires = self._normalize_timeout(timeout)
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        key, h = self._key(key)
+        with self._locked() as mm:
+            if self._find(mm, key, h) != -1:
+                return False
+            return self._store(mm, key, h, value, expires)
+
+    def delete(self, key):
+        key, h = self._key(key)
+        with self._locked() as mm:
+            i = self._lookup(mm, key, h)
+            if i == -1:
+                return False
+            self._remove(mm, i)
+            return True
+
+    def has(self, key):
+        key, h = self._key(key)
+        with self._locked() as mm:
+            return self._find(mm, key, h) != -1
+
+    def clear(self):
+        with self._locked() as mm:
+            self._reset(mm)
+        return True
+
+    def inc(self, key, delta=1):
+        key, h = self._key(key)
+        with self._locked() as mm:
+            i = self._find(mm, key, h)
+            if i == -1:
+                value, expires = delta, self._normalize_timeout(None)
+            else:
+                _, _, klen, _, _, _, expires, vlen = \
+                    self._slot_header.unpack_from(mm, self._offset(i))
+                value = pickle.loads(self._read(mm, i, vlen, skip=klen))
+                value += delta
+            if not self._store(mm, key, h,
+                               pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                               expires):
+                return None
+            return value
+
+    def dec(self, key, delta=1):
+        return self.inc(key, -delta)
+
+    def stats(self):
+        """A dict of the slots and entries in the segment, and the hits,
+        misses, evictions and expirations counted by all processes."""
+        with self._locked() as mm:
+            rv = dict((name, self._get_field(mm, name))
+                      for name in ('entries', 'nfree'))
+            for name, offset in iteritems(self._counters):
+                rv[name] = self._uint64.unpack_from(mm, offset)[0]
+        rv['free_slots'] = rv.pop('nfree')
+        rv.update(slots=self._nslots, slot_size=self._slot_size,
+                  size=len(self._mm))
+        return rv
+
+
 class UWSGICache(BaseCache):
     """ Implements the cache using uWSGI's caching framework.
 
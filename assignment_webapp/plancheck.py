@@ -0,0 +1,515 @@
+"""
+Query plan regression check.
+
+Loads a large synthetic catalogue into the database in config.ini, calls
+every query function in database.py against it, and runs each statement
+they send through EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON). The plan shapes,
+costs and timings are compared with a baseline file; the check fails (exit
+status 1) when a statement now sequentially scans a large table it didn't
+scan before, costs much more, or takes much longer; with no baseline it
+fails (exit status 2) until one is recorded with --update. Everything runs
+in one transaction that is rolled back, so the database is left as it was,
+but use a local copy: the load locks the tables it writes until the end.
+
+Run from this directory (like main.py) so config.ini and the bundled
+modules are found, e.g.
+
+    python3 plancheck.py --update          # record plan_baseline.json
+    python3 plancheck.py                   # compare with it
+    python3 plancheck.py --scale 1000000 --baseline big.json --update
+    python3 plancheck.py --only list_page get_song
+
+The load and the query functions need the schema and migrations applied.
+The bulk import functions are left out; bench.py times them.
+"""
+import argparse
+import json
+import sys
+import time
+
+from modules import *
+from flask import Flask
+import database
+
+
+#####################################################
+#   Synthetic catalogue
+#####################################################
+
+WORDS = """love star night dark city blue river king war girl house road last
+heart wild dead moon fire ghost secret dream lost summer winter iron black gold
+silent broken little final storm shadow island empire garden stranger hunter
+battle""".split()
+
+def counts(scale):
+    """Rows of each kind for a catalogue of `scale` movies"""
+    return {
+        'movie': scale, 'song': scale,
+        'podcastepisode': scale // 2, 'tvepisode': scale // 2,
+        'artist': max(scale // 10, 1), 'album': max(scale // 10, 1),
+        'podcast': max(scale // 200, 1), 'tvshow': max(scale // 200, 1),
+        'collection': max(scale // 50, 1), 'user': max(scale // 100, 1),
+    }
+
+# The sequence each kind of row takes its id from
+ID_SEQUENCES = {
+    'movie': ('mediaserver.mediaitem', 'media_id'),
+    'song': ('mediaserver.mediaitem', 'media_id'),
+    'podcastepisode': ('mediaserver.mediaitem', 'media_id'),
+    'tvepisode': ('mediaserver.mediaitem', 'media_id'),
+    'artist': ('mediaserver.artist', 'artist_id'),
+    'album': ('mediaserver.album', 'album_id'),
+    'podcast': ('mediaserver.podcast', 'podcast_id'),
+    'tvshow': ('mediaserver.tvshow', 'tvshow_id'),
+    'collection': ('mediaserver.mediacollection', 'collection_id'),
+}
+
+def title(n):
+    """Two of WORDS and the row number, e.g. 'star love 41'"""
+    words = "(array[{}])".format(", ".join("'%s'" % w for w in WORDS))
+    return "{w}[1 + mod({n}, {k})] || ' ' || {w}[1 + mod({n} / {k}, {k})] || ' ' || {n}".format(
+        w=words, n=n, k=len(WORDS))
+
+# Run in order with the counts and title() formatted in. pg8000 takes a
+# bare % as a parameter, hence mod() throughout.
+LOAD = [
+    # One refresh at the end instead of the triggers for every row
+    "select set_config('mediaserver.defer_search_documents', 'on', true)",
+    """create temp table plan_rows on commit drop as
+       select k.kind, n, nextval(pg_get_serial_sequence(k.seq_table, k.seq_column))::int as id
+       from (values {id_sequences}) as k(kind, seq_table, seq_column, total)
+           cross join lateral generate_series(1, k.total) n""",
+    "analyze plan_rows",
+    """insert into mediaserver.MetaDataType(md_type_name)
+       select name from unnest(array['description', 'film genre', 'song genre', 'podcast genre']) name
+       where not exists (select 1 from mediaserver.MetaDataType t where t.md_type_name = name)""",
+    """insert into mediaserver.ContactType(contact_type_name)
+       select 'email' where not exists (
+           select 1 from mediaserver.ContactType where contact_type_name = 'email')""",
+
+    # Media items
+    """insert into mediaserver.MediaItem(media_id, storage_location)
+       select id, 'plan://' || kind || '/' || n from plan_rows
+       where kind in ('movie', 'song', 'podcastepisode', 'tvepisode')""",
+    """insert into mediaserver.VideoMedia(media_id)
+       select id from plan_rows where kind in ('movie', 'tvepisode')""",
+    """insert into mediaserver.AudioMedia(media_id)
+       select id from plan_rows where kind in ('song', 'podcastepisode')""",
+    """insert into mediaserver.Movie(movie_id, movie_title, release_year)
+       select id, {title}, 1900 + mod(n, 120) from plan_rows where kind = 'movie'""",
+    """insert into mediaserver.Song(song_id, song_title, length)
+       select id, {title}, 60 + mod(n, 400) from plan_rows where kind = 'song'""",
+
+    # Artists and albums; every fifth song has a second artist
+    """insert into mediaserver.Artist(artist_id, artist_name)
+       select id, 'plan artist ' || n from plan_rows where kind = 'artist'""",
+    """insert into mediaserver.Song_Artists(song_id, performing_artist_id)
+       select s.id, a.id from plan_rows s
+           join plan_rows a on (a.kind = 'artist' and a.n = 1 + mod(s.n, {artist}))
+       where s.kind = 'song'
+       union
+       select s.id, a.id from plan_rows s
+           join plan_rows a on (a.kind = 'artist' and a.n = 1 + mod(s.n + 1, {artist}))
+       where s.kind = 'song' and mod(s.n, 5) = 0""",
+    """insert into mediaserver.Album(album_id, album_title)
+       select id, {title} from plan_rows where kind = 'album'""",
+    """insert into mediaserver.Album_Songs(song_id, album_id, track_num)
+       select s.id, a.id, 1 + s.n / {album} from plan_rows s
+           join plan_rows a on (a.kind = 'album' and a.n = 1 + mod(s.n, {album}))
+       where s.kind = 'song'""",
+
+    # Podcasts and TV shows with their episodes
+    """insert into mediaserver.Podcast(podcast_id, podcast_title, podcast_uri, podcast_last_updated)
+       select id, {title}, 'http://plan/podcast/' || n, date '2020-01-01' - mod(n, 365)
+       from plan_rows where kind = 'podcast'""",
+    """insert into mediaserver.PodcastEpisode(podcast_id, media_id, podcast_episode_title,
+           podcast_episode_URI, podcast_episode_published_date, podcast_episode_length)
+       select p.id, e.id, {title_e}, 'http://plan/episode/' || e.n,
+           date '2020-01-01' - mod(e.n, 365), 600 + mod(e.n, 3000)
+       from plan_rows e join plan_rows p on (p.kind = 'podcast' and p.n = 1 + mod(e.n, {podcast}))
+       where e.kind = 'podcastepisode'""",
+    """insert into mediaserver.TVShow(tvshow_id, tvshow_title)
+       select id, {title} from plan_rows where kind = 'tvshow'""",
+    """insert into mediaserver.TVEpisode(media_id, tvshow_id, tvshow_episode_title, season, episode, air_date)
+       select e.id, t.id, {title_e}, 1 + e.n / {tvshow} / 20, 1 + mod(e.n / {tvshow}, 20),
+           date '2020-01-01' - mod(e.n, 3650)
+       from plan_rows e join plan_rows t on (t.kind = 'tvshow' and t.n = 1 + mod(e.n, {tvshow}))
+       where e.kind = 'tvepisode'""",
+
+    # Twenty genres of each type, and a description of every item
+    """create temp table plan_genres on commit drop as
+       select nextval(pg_get_serial_sequence('mediaserver.metadata', 'md_id')) as md_id,
+           t.md_type_id, t.md_type_name, g
+       from mediaserver.MetaDataType t cross join generate_series(1, 20) g
+       where t.md_type_name in ('film genre', 'song genre', 'podcast genre')""",
+    """insert into mediaserver.MetaData(md_id, md_type_id, md_value)
+       select md_id, md_type_id, md_type_name || ' ' || g from plan_genres""",
+    """create temp table plan_descriptions on commit drop as
+       select nextval(pg_get_serial_sequence('mediaserver.metadata', 'md_id')) as md_id, kind, n, id
+       from plan_rows where kind not in ('collection', 'user')""",
+    "analyze plan_descriptions",
+    """insert into mediaserver.MetaData(md_id, md_type_id, md_value)
+       select d.md_id, t.md_type_id, 'about ' || d.kind || ' ' || {title_d}
+       from plan_descriptions d cross join mediaserver.MetaDataType t
+       where t.md_type_name = 'description'""",
+    """insert into mediaserver.MediaItemMetaData(media_id, md_id)
+       select id, md_id from plan_descriptions
+       where kind in ('movie', 'song', 'podcastepisode', 'tvepisode')
+       union all
+       select r.id, g.md_id from plan_rows r
+           join plan_genres g on (g.g = 1 + mod(r.n, 20) and g.md_type_name = case r.kind
+               when 'movie' then 'film genre' when 'song' then 'song genre' else 'podcast genre' end)
+       where r.kind in ('movie', 'song', 'podcastepisode')""",
+    """insert into mediaserver.PodcastMetaData(podcast_id, md_id)
+       select id, md_id from plan_descriptions where kind = 'podcast'
+       union all
+       select r.id, g.md_id from plan_rows r
+           join plan_genres g on (g.g = 1 + mod(r.n, 20) and g.md_type_name = 'podcast genre')
+       where r.kind = 'podcast'""",
+    """insert into mediaserver.TVShowMetaData(tvshow_id, md_id)
+       select id, md_id from plan_descriptions where kind = 'tvshow'""",
+    """insert into mediaserver.AlbumMetaData(album_id, md_id)
+       select id, md_id from plan_descriptions where kind = 'album'""",
+    """insert into mediaserver.ArtistMetaData(artist_id, md_id)
+       select id, md_id from plan_descriptions where kind = 'artist'""",
+
+    # Users, one in ten a superuser, and what they play, keep and follow
+    """insert into mediaserver.UserAccount(username, password, issuper)
+       select 'plan_user_' || n, public.crypt('plan', public.gen_salt('bf', 4)), mod(n, 10) = 0
+       from generate_series(1, {user}) n""",
+    """insert into mediaserver.ContactMethod(username, contact_type_id, contact_type_value)
+       select 'plan_user_' || n, t.contact_type_id, 'plan_user_' || n || '@example.com'
+       from generate_series(1, {user}) n
+           cross join mediaserver.ContactType t
+       where t.contact_type_name = 'email'""",
+    """create temp table plan_media on commit drop as
+       select id, row_number() over (order by id) as i from plan_rows
+       where kind in ('movie', 'song', 'podcastepisode', 'tvepisode')""",
+    "analyze plan_media",
+    """insert into mediaserver.UserMediaConsumption(username, media_id, play_count, progress, lastviewed)
+       select 'plan_user_' || u, m.id, 1 + mod(k, 7), mod(k, 3) / 2.0, date '2020-01-01' - mod(k, 365)
+       from generate_series(1, {user}) u cross join generate_series(1, 20) k
+           join plan_media m on (m.i = 1 + mod(u::bigint * 7919 + k * 104729, {media}))
+       on conflict do nothing""",
+    """insert into mediaserver.MediaCollection(collection_id, username, collection_name)
+       select id, 'plan_user_' || (1 + mod(n, {user})), {title}
+       from plan_rows where kind = 'collection'""",
+    """insert into mediaserver.MediaCollectionContents(collection_id, media_id)
+       select c.id, m.id from plan_rows c cross join generate_series(1, 10) k
+           join plan_media m on (m.i = 1 + mod(c.n::bigint * 104729 + k * 7919, {media}))
+       where c.kind = 'collection'
+       on conflict do nothing""",
+    """insert into mediaserver.Subscribed_Podcasts(username, podcast_id)
+       select distinct 'plan_user_' || u, p.id
+       from generate_series(1, {user}) u cross join generate_series(1, 3) k
+           join plan_rows p on (p.kind = 'podcast' and p.n = 1 + mod(u * 3 + k, {podcast}))""",
+
+    "select mediaserver.refresh_list_summaries()",
+    "select mediaserver.refresh_all_search_documents()",
+    "select set_config('mediaserver.defer_search_documents', 'off', true)",
+]
+
+# Row triggers that are off while loading, their tables refreshed in one go
+# by LOAD instead; they are back on for the functions checked
+LOAD_WITHOUT_TRIGGERS = [
+    ('ArtistMetaData', 'artistmetadata_summary'),
+    ('Song_Artists', 'song_artists_summary'),
+    ('PodcastEpisode', 'podcastepisode_summary'),
+    ('TVEpisode', 'tvepisode_summary'),
+    ('UserMediaConsumption', 'usermediaconsumption_search_popularity'),
+]
+
+def load(cur, scale):
+    c = counts(scale)
+    params = dict(
+        c, media=c['movie'] + c['song'] + c['podcastepisode'] + c['tvepisode'],
+        title=title('n'), title_d=title('d.n'), title_e=title('e.n'),
+        id_sequences=", ".join("('{}', '{}', '{}', {})".format(kind, table, column, c[kind])
+                               for kind, (table, column) in ID_SEQUENCES.items()))
+    for table, trigger in LOAD_WITHOUT_TRIGGERS:
+        cur.execute("alter table mediaserver.%s disable trigger %s" % (table, trigger))
+    for sql in LOAD:
+        cur.execute(sql.format(**params))
+    for table, trigger in LOAD_WITHOUT_TRIGGERS:
+        cur.execute("alter table mediaserver.%s enable trigger %s" % (table, trigger))
+    cur.execute("analyze")
+
+def sample_ids(cur, scale):
+    """Ids of rows from the middle of the synthetic catalogue"""
+    c = counts(scale)
+    cur.execute("select kind, id from plan_rows where n = greatest(1, (case kind {}end) / 2)".format(
+        "".join("when '{}' then {} ".format(kind, c[kind]) for kind in ID_SEQUENCES)))
+    ids = dict(cur.fetchall())
+    cur.execute("select podcast_id from mediaserver.PodcastEpisode where media_id = %s",
+                (ids['podcastepisode'],))
+    ids['episode_podcast'] = cur.fetchone()[0]
+    ids['username'] = 'plan_user_%d' % max(c['user'] // 2, 1)
+    return ids
+
+
+#####################################################
+#   What is checked
+#   (name, call) pairs; call(ids) runs a database
+#   function against the synthetic catalogue.
+#####################################################
+
+def list_page_cases():
+    cases = []
+    for name, listing in database.LISTINGS.items():
+        by_title = [col for col in listing.sorts if col != listing.id][0]
+        cases += [
+            ('list_page %s first' % name,
+             lambda ids, name=name, col=by_title: database.list_page(name, 0, 25, col)),
+            ('list_page %s deep' % name,
+             lambda ids, name=name, col=listing.id: database.list_page(name, 2000, 25, col, True)),
+            ('list_page %s search' % name,
+             lambda ids, name=name, col=by_title: database.list_page(name, 0, 25, col, search='ight')),
+        ]
+    return cases
+
+CASES = [
+    ('read_metadata_types', lambda ids: database.read_metadata_types()),
+    ('read_contact_types', lambda ids: database.read_contact_types()),
+    ('check_login', lambda ids: database.check_login(ids['username'], 'plan')),
+    ('is_superuser', lambda ids: database.is_superuser(ids['username'])),
+    ('user_playlists', lambda ids: database.user_playlists(ids['username'])),
+    ('user_podcast_subscriptions', lambda ids: database.user_podcast_subscriptions(ids['username'])),
+    ('user_in_progress_items', lambda ids: database.user_in_progress_items(ids['username'])),
+    ('get_user_dashboard', lambda ids: database.get_user_dashboard(ids['username'])),
+    ('get_user_contacts', lambda ids: database.get_user_contacts(ids['username'])),
+    ('get_allartists', lambda ids: database.get_allartists()),
+    ('get_allsongs', lambda ids: database.get_allsongs()),
+    ('get_allpodcasts', lambda ids: database.get_allpodcasts()),
+    ('get_allalbums', lambda ids: database.get_allalbums()),
+    ('get_alltvshows', lambda ids: database.get_alltvshows()),
+    ('get_allmovies', lambda ids: database.get_allmovies()),
+] + list_page_cases() + [
+    ('get_artist', lambda ids: database.get_artist(ids['artist'])),
+    ('get_song', lambda ids: database.get_song(ids['song'])),
+    ('get_song_metadata', lambda ids: database.get_song_metadata(ids['song'])),
+    ('get_song_page', lambda ids: database.get_song_page(ids['song'])),
+    ('get_podcast', lambda ids: database.get_podcast(ids['podcast'])),
+    ('get_podcast_metadata', lambda ids: database.get_podcast_metadata(ids['podcast'])),
+    ('get_all_podcasteps_for_podcast',
+     lambda ids: database.get_all_podcasteps_for_podcast(ids['podcast'])),
+    ('get_podcast_page', lambda ids: database.get_podcast_page(ids['podcast'])),
+    ('get_podcastep',
+     lambda ids: database.get_podcastep(ids['episode_podcast'], ids['podcastepisode'])),
+    ('get_album', lambda ids: database.get_album(ids['album'])),
+    ('get_album_songs', lambda ids: database.get_album_songs(ids['album'])),
+    ('get_album_genres', lambda ids: database.get_album_genres(ids['album'])),
+    ('get_album_page', lambda ids: database.get_album_page(ids['album'])),
+    ('get_tvshow', lambda ids: database.get_tvshow(ids['tvshow'])),
+    ('get_all_tvshoweps_for_tvshow', lambda ids: database.get_all_tvshoweps_for_tvshow(ids['tvshow'])),
+    ('get_tvshow_page', lambda ids: database.get_tvshow_page(ids['tvshow'])),
+    ('get_tvshowep', lambda ids: database.get_tvshowep(ids['tvepisode'])),
+    ('get_movie', lambda ids: database.get_movie(ids['movie'])),
+    ('get_last_movie', lambda ids: database.get_last_movie()),
+    ('get_last_song', lambda ids: database.get_last_song()),
+    ('find_matchingtvshows', lambda ids: database.find_matchingtvshows('ight')),
+    ('find_matchingmovies', lambda ids: database.find_matchingmovies('ight')),
+    ('movie_fuzzy_search', lambda ids: database.movie_fuzzy_search(['secrte', 'gardn'])),
+    ('movie_fuzzy_search metadata',
+     lambda ids: database.movie_fuzzy_search(['secret'], {'film genre': ['film genre 3', '-film genre 4']})),
+    ('search_documents', lambda ids: database.search_documents(['secret', 'garden'])),
+    ('search_documents hint', lambda ids: database.search_documents(['secr'], titles_only=True)),
+    ('search_documents podcast', lambda ids: database.search_documents(['storm'], 'podcast')),
+    # Writes: the same statements run again under EXPLAIN ANALYZE and are
+    # rolled back with the rest
+    ('add_movie_to_db',
+     lambda ids: database.add_movie_to_db('plan movie', 2001, 'plan', 'plan://movie', 'drama')),
+    ('add_song_to_db',
+     lambda ids: database.add_song_to_db('plan song', 180, 'plan', 'plan://song', 'pop', 'none',
+                                         'plan artist 1')),
+    ('signup', lambda ids: database.signup('plan_new_user', 'plan')),
+    ('update_user_credential', lambda ids: database.update_user_credential(ids['username'], 'plan')),
+    ('add_contact', lambda ids: database.add_contact(ids['username'], 'email', 'plan@example.com')),
+    ('delete_contact', lambda ids: database.delete_contact(
+        ids['username'], 'email', ids['username'] + '@example.com')),
+]
+
+EXPLAINABLE = ('select', 'with', 'insert', 'update', 'delete', 'values')
+
+
+#####################################################
+#   Plans
+#####################################################
+
+def plan_summary(explained, large_tables):
+    """Shape, cost, timing and buffers of one EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)"""
+    if isinstance(explained, str):
+        explained = json.loads(explained)
+    top = explained[0]
+    shape = []
+    seq_scans = set()
+
+    def walk(node, depth):
+        label = node['Node Type']
+        if 'Relation Name' in node:
+            label += ' on ' + node['Relation Name']
+        if 'Index Name' in node:
+            label += ' using ' + node['Index Name']
+        shape.append('  ' * depth + label)
+        if node['Node Type'] == 'Seq Scan':
+            seq_scans.add(node['Relation Name'])
+        for child in node.get('Plans', ()):
+            walk(child, depth + 1)
+
+    walk(top['Plan'], 0)
+    return {
+        'plan': shape,
+        'large_seq_scans': sorted(seq_scans & large_tables),
+        'cost': top['Plan']['Total Cost'],
+        'ms': top['Execution Time'],
+        'buffers': top['Plan'].get('Shared Hit Blocks', 0) + top['Plan'].get('Shared Read Blocks', 0),
+    }
+
+def explain_case(cur, name, call, ids, large_tables, repeat):
+    """{'name#n': summary} for the explainable statements call(ids) runs"""
+    cur.execute("savepoint plancheck")
+    try:
+        with database.capture_statements() as statements:
+            call(ids)
+    except Exception as e:
+        # The request's transaction, synthetic data and all, is gone by now
+        raise RuntimeError("%s failed: %r" % (name, e)) from e
+    cur.execute("rollback to savepoint plancheck")
+
+    results = {}
+    for _ in range(repeat):
+        cur.execute("savepoint plancheck")
+        n = 0
+        for sql, params in statements:
+            if sql.split(None, 1)[0].lower() not in EXPLAINABLE:
+                cur.execute(sql, params)
+                continue
+            n += 1
+            cur.execute("explain (analyze, buffers, format json) " + sql, params)
+            summary = plan_summary(cur.fetchone()[0], large_tables)
+            summary['sql'] = " ".join(sql.split())
+            key = "%s#%d" % (name, n)
+            if key in results:
+                summary['ms'] = min(summary['ms'], results[key]['ms'])
+            results[key] = summary
+        cur.execute("rollback to savepoint plancheck")
+    return results
+
+def run(scale, only, repeat, large_rows):
+    app = Flask(__name__)
+    with app.app_context():
+        database.open_request_session()
+        try:
+            # Caches are bypassed for the rest of the request
+            database.catalog_changed()
+            with database.get_cursor() as cur:
+                started = time.perf_counter()
+                load(cur, scale)
+                print("loaded %d movies and the rest in %.1fs" % (scale, time.perf_counter() - started))
+                ids = sample_ids(cur, scale)
+                database.refresh_reference_data()
+                cur.execute("""select relname from pg_class
+                               where relnamespace = 'mediaserver'::regnamespace and relkind = 'r'
+                                 and reltuples >= %s""", (large_rows,))
+                large_tables = {name for name, in cur.fetchall()}
+                results = {}
+                for name, call in CASES:
+                    if only and not any(name.startswith(o) for o in only):
+                        continue
+                    results.update(explain_case(cur, name, call, ids, large_tables, repeat))
+        finally:
+            # Nothing is kept: roll the whole request back
+            database.close_request_session(exc=True)
+    return results
+
+
+#####################################################
+#   Comparison with the baseline
+#####################################################
+
+def regressions(base, now, args):
+    """Why `now` is worse than `base`, if it is"""
+    problems = []
+    new_scans = sorted(set(now['large_seq_scans']) - set(base['large_seq_scans']))
+    if new_scans:
+        problems.append("new Seq Scan on " + ", ".join(new_scans))
+    if now['cost'] > base['cost'] * args.cost_ratio and now['cost'] - base['cost'] >= args.min_cost:
+        problems.append("cost %.0f -> %.0f" % (base['cost'], now['cost']))
+    if now['ms'] > base['ms'] * args.time_ratio and now['ms'] - base['ms'] >= args.min_ms:
+        problems.append("%.1fms -> %.1fms" % (base['ms'], now['ms']))
+    return problems
+
+def compare(baseline, results, args):
+    failed = 0
+    print("%-44s %10s %10s %12s %12s  %s" % ("statement", "ms", "base ms", "cost", "base cost", ""))
+    for key in sorted(results):
+        now = results[key]
+        base = baseline.get(key)
+        if base is None:
+            note = "new"
+        else:
+            problems = regressions(base, now, args)
+            if problems:
+                failed += 1
+                note = "REGRESSED: " + "; ".join(problems)
+            elif now['plan'] != base['plan']:
+                note = "plan changed"
+            else:
+                note = ""
+        print("%-44s %10.2f %10s %12.0f %12s  %s" % (
+            key, now['ms'], "-" if base is None else "%.2f" % base['ms'],
+            now['cost'], "-" if base is None else "%.0f" % base['cost'], note))
+        if note.startswith("REGRESSED") or note == "plan changed":
+            for line in base['plan']:
+                print("    was  " + line)
+            for line in now['plan']:
+                print("    now  " + line)
+    for key in sorted(set(baseline) - set(results)):
+        print("%-44s not run" % key)
+    return failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Query plan regression check")
+    parser.add_argument('--baseline', default='plan_baseline.json')
+    parser.add_argument('--update', action='store_true',
+                        help="write this run's plans to the baseline instead of failing on them")
+    parser.add_argument('--scale', type=int, default=100000,
+                        help="movies in the synthetic catalogue; the other tables scale with it")
+    parser.add_argument('--only', nargs='+', help="just the cases whose names start with these")
+    parser.add_argument('--repeat', type=int, default=3, help="timings are the best of this many runs")
+    parser.add_argument('--large-rows', type=int, default=10000,
+                        help="a Seq Scan on a table with this many rows fails the check")
+    parser.add_argument('--cost-ratio', type=float, default=2.0)
+    parser.add_argument('--min-cost', type=float, default=1000.0,
+                        help="cost increases smaller than this never fail the check")
+    parser.add_argument('--time-ratio', type=float, default=3.0)
+    parser.add_argument('--min-ms', type=float, default=5.0,
+                        help="slowdowns smaller than this never fail the check")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.baseline) as fp:
+            saved = json.load(fp)
+    except FileNotFoundError:
+        saved = {'scale': args.scale, 'queries': {}}
+    if not saved['queries'] and not args.update:
+        # Nothing to compare against would pass every plan
+        print("no baseline plans in %s; run with --update to record them" % args.baseline,
+              file=sys.stderr)
+        return 2
+    if saved['scale'] != args.scale:
+        print("warning: the baseline was recorded at scale %d" % saved['scale'])
+
+    results = run(args.scale, args.only, args.repeat, args.large_rows)
+
+    failed = compare(saved['queries'], results, args)
+    if args.update:
+        queries = results if not args.only else dict(saved['queries'], **results)
+        with open(args.baseline, 'w') as fp:
+            json.dump({'scale': args.scale, 'queries': queries}, fp, indent=1, sort_keys=True)
+        print("wrote %d statements to %s" % (len(queries), args.baseline))
+        return 0
+    print("%d of %d statements regressed" % (failed, len(results)))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
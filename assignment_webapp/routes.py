@@ -8,11 +8,19 @@ to be displayed.
 
 You will have to make
 """
+import csv
+import io
 import secrets
 import functools
+import hashlib
+import time
+from datetime import datetime
 
 from modules import *
 from flask import *
+import flask
+from werkzeug.http import is_resource_modified
+from werkzeug.routing import IntegerConverter
 import database
 
 user_details = {}                   # User details kept for us
@@ -26,7 +34,22 @@ eDkelBIB6HG0d077K1tsYRuh0K/JFWXk4Z6ieErNOfs6uOCZszJei7ga0IBJ1cuedeEx7iS7gFxm
 2bLrCt7kE5OYTgnOWkxqO43KGmWz4V+F1ry2//Rtn/Doi7dzcv9wJaEGCfV6mybDJCmzr9SMpuF9
 B9ahzy0c7E/tPo+S5tm62P9SSg4Qg17qLzYN0sk="""
 
-def route(_flask_rule, login: bool=True, admin: bool=False, **kwargs):
+class IdConverter(IntegerConverter):
+    """
+    <id:name> in a rule: a positive number that fits the serial id columns.
+    Anything else is a 404 before the view runs, not a database error.
+    """
+    def __init__(self, map):
+        IntegerConverter.__init__(self, map, min=1, max=2 ** 31 - 1)
+
+app.url_map.converters['id'] = IdConverter
+
+def route(_flask_rule, login: bool=True, admin: bool=False, conditional: bool=False, **kwargs):
+    """
+    app.route with login and admin checks. With `conditional`, the page
+    gets ETag and Last-Modified validators (see page_validators) and a
+    request that still has the current page gets a 304 before the view runs.
+    """
     def decorator(func):
         @functools.wraps(func)
         def wrapped(*args, **kwargs):
@@ -35,7 +58,29 @@ def route(_flask_rule, login: bool=True, admin: bool=False, **kwargs):
                     return redirect(url_for('login'))
 
                 if admin:
-                    database.ensure_super(user_details['username'])
+                    # Answered from the signed session until the user's credentials change
+                    auth = flask.session.get('auth')
+                    checked = database.check_super(auth, user_details['username'])
+                    if checked is not auth:
+                        flask.session['auth'] = checked
+
+                # A pending flash message makes this render one of a kind, and
+                # only GET and HEAD can be answered "not modified" (a POST
+                # handler may render a conditional view, e.g. add_movie)
+                if (conditional and request.method in ('GET', 'HEAD')
+                        and '_flashes' not in flask.session):
+                    etag, last_modified = page_validators()
+                    if not is_resource_modified(request.environ, etag, last_modified=last_modified):
+                        response = Response(status=304)
+                    else:
+                        response = make_response(func(*args, **kwargs))
+                        if response.status_code != 200:
+                            return response
+                    response.set_etag(etag, weak=True)
+                    response.last_modified = last_modified
+                    response.cache_control.private = True
+                    response.cache_control.no_cache = True
+                    return response
 
                 return func(*args, **kwargs)
             except database.UserException as e:
@@ -50,6 +95,61 @@ def route(_flask_rule, login: bool=True, admin: bool=False, **kwargs):
         return flask_decorator(wrapped)
     return decorator
 
+# What the page chrome shows of the user, and since when
+_page_user_state = None
+_page_user_state_since = time.time()
+
+def page_validators():
+    """
+    (etag, last_modified) for a catalog page as the current user sees it.
+    Catalog and item pages only change when the catalog does, so both come
+    from database.catalog_version(), plus the user, login state and notice
+    bar that every page shows. Last-Modified moves when either changes.
+    The catalog version is the database's, so a change made through any
+    worker, or by bulk_import.py, changes the ETag in all of them.
+    """
+    global _page_user_state, _page_user_state_since
+    version, changed_at = database.catalog_version()
+    user_state = repr((session.get('logged_in'), sorted(user_details.items()), page.get('bar')))
+    if user_state != _page_user_state:
+        _page_user_state, _page_user_state_since = user_state, time.time()
+    # changed_at too: a rebuilt database counts versions from 1 again
+    etag = hashlib.md5(("%s/%r/%s" % (version, changed_at, user_state)).encode('utf-8')).hexdigest()
+    return etag, datetime.utcfromtimestamp(max(changed_at, _page_user_state_since))
+
+# Metadata types the podcast pages list on their own; the rest go in "other"
+PODCAST_METADATA_LISTS = ('description', 'artwork', 'copyright holder', 'podcast genre')
+
+def split_podcast_metadata(metadata):
+    """
+    md_values of podcast or podcast episode metadata rows as
+    (description, artwork, copyrights, genre, other) lists
+    """
+    ids = database.metadata_type_ids()
+    lists = {ids[name]: [] for name in PODCAST_METADATA_LISTS if name in ids}
+    other = []
+    for item in metadata:
+        if item['md_type_id'] is not None:
+            lists.get(item['md_type_id'], other).append(item['md_value'])
+    return tuple(lists.get(ids.get(name), []) for name in PODCAST_METADATA_LISTS) + (other,)
+
+#####################################################
+#   One database connection and transaction per request
+#####################################################
+
+@app.before_request
+def open_db_session():
+    database.open_request_session()
+
+@app.after_request
+def commit_db_session(response):
+    database.commit_request_session()
+    return response
+
+@app.teardown_request
+def close_db_session(exc):
+    database.close_request_session(exc)
+
 #####################################################
 #   INDEX
 #####################################################
@@ -66,10 +166,8 @@ def index():
 
     username = user_details['username']
 
-    user_playlists = database.user_playlists(username)
-    user_subscribed_podcasts = database.user_podcast_subscriptions(username)
-    user_in_progress_items = database.user_in_progress_items(username)
-    contacts = database.get_user_contacts(username)
+    (user_playlists, user_subscribed_podcasts,
+     user_in_progress_items, contacts) = database.get_user_dashboard(username)
 
     return render_template(
         'index.html',
@@ -99,10 +197,13 @@ def login():
         return render_template('login.html', session=session, page=page)
 
     try:
+        credential_version = database.credential_version(request.form['username'])
         login_return_data = database.check_login(
             request.form['username'],
             request.form['password']
         )
+        flask.session['auth'] = database.authorization(
+            login_return_data['username'], login_return_data['issuper'], credential_version)
         page['bar'] = True
         flash('You have been logged in successfully')
         session['logged_in'] = True
@@ -127,6 +228,7 @@ def logout():
         - Removes any stored user data.
     """
     session['logged_in'] = False
+    flask.session.pop('auth', None)
     page['bar'] = True
     flash('You have been logged out')
     return redirect(url_for('index'))
@@ -142,7 +244,7 @@ def logout():
 #####################################################
 #   List Artists
 #####################################################
-@route('/list/artists')
+@route('/list/artists', conditional=True)
 def list_artists():
     """
     Lists all the artists in your media server
@@ -154,26 +256,18 @@ def list_artists():
 
     page['title'] = 'List Artists'
 
-    # Get a list of all artists from the database
-    allartists = None
-    allartists = database.get_allartists()
-
-    # Data integrity checks
-    if allartists == None:
-        allartists = []
-
-
+    # The rows come a page at a time from api_list_page
     return render_template('listitems/listartists.html',
                            session=session,
                            page=page,
                            user=user_details,
-                           allartists=allartists)
+                           listing='artists')
 
 
 #####################################################
 #   List Songs
 #####################################################
-@route('/list/songs')
+@route('/list/songs', conditional=True)
 def list_songs():
     """
     Lists all the songs in your media server
@@ -185,26 +279,17 @@ def list_songs():
 
     page['title'] = 'List Songs'
 
-    # Get a list of all songs from the database
-    allsongs = None
-    allsongs = database.get_allsongs()
-
-
-    # Data integrity checks
-    if allsongs == None:
-        allsongs = []
-
-
+    # The rows come a page at a time from api_list_page
     return render_template('listitems/listsongs.html',
                            session=session,
                            page=page,
                            user=user_details,
-                           allsongs=allsongs)
+                           listing='songs')
 
 #####################################################
 #   List Podcasts
 #####################################################
-@route('/list/podcasts')
+@route('/list/podcasts', conditional=True)
 def list_podcasts():
     """
     Lists all the podcasts in your media server
@@ -216,26 +301,18 @@ def list_podcasts():
 
     page['title'] = 'List podcasts'
 
-    # Get a list of all podcasts from the database
-    allpodcasts = None
-    allpodcasts = database.get_allpodcasts()
-
-    # Data integrity checks
-    if allpodcasts == None:
-        allpodcasts = []
-
-
+    # The rows come a page at a time from api_list_page
     return render_template('listitems/listpodcasts.html',
                            session=session,
                            page=page,
                            user=user_details,
-                           allpodcasts=allpodcasts)
+                           listing='podcasts')
 
 
 #####################################################
 #   List Movies
 #####################################################
-@route('/list/movies')
+@route('/list/movies', conditional=True)
 def list_movies():
     """
     Lists all the movies in your media server
@@ -247,27 +324,18 @@ def list_movies():
 
     page['title'] = 'List Movies'
 
-    # Get a list of all movies from the database
-    allmovies = None
-    allmovies = database.get_allmovies()
-
-
-    # Data integrity checks
-    if allmovies == None:
-        allmovies = []
-
-
+    # The rows come a page at a time from api_list_page
     return render_template('listitems/listmovies.html',
                            session=session,
                            page=page,
                            user=user_details,
-                           allmovies=allmovies)
+                           listing='movies')
 
 
 #####################################################
 #   List Albums
 #####################################################
-@route('/list/albums')
+@route('/list/albums', conditional=True)
 def list_albums():
     """
     Lists all the albums in your media server
@@ -279,27 +347,18 @@ def list_albums():
 
     page['title'] = 'List Albums'
 
-    # Get a list of all Albums from the database
-    allalbums = None
-    allalbums = database.get_allalbums()
-
-
-    # Data integrity checks
-    if allalbums == None:
-        allalbums = []
-
-
+    # The rows come a page at a time from api_list_page
     return render_template('listitems/listalbums.html',
                            session=session,
                            page=page,
                            user=user_details,
-                           allalbums=allalbums)
+                           listing='albums')
 
 
 #####################################################
 #   List TVShows
 #####################################################
-@route('/list/tvshows')
+@route('/list/tvshows', conditional=True)
 def list_tvshows():
     """
     Lists all the tvshows in your media server
@@ -311,22 +370,103 @@ def list_tvshows():
 
     page['title'] = 'List TV Shows'
 
-    # Get a list of all tvshows from the database
-    alltvshows = None
-    alltvshows = database.get_alltvshows()
-
-
-    # Data integrity checks
-    if alltvshows == None:
-        alltvshows = []
-
-
+    # The rows come a page at a time from api_list_page
     return render_template('listitems/listtvshows.html',
                            session=session,
                            page=page,
                            user=user_details,
-                           alltvshows=alltvshows)
+                           listing='tvshows')
+
 
+#####################################################
+#   List pages, a page at a time
+#####################################################
+
+# The page each listing's rows link to, and the id it is opened by
+LIST_ROW_LINKS = {
+    'artists': ('single_artist', 'artist_id'),
+    'songs': ('single_song', 'song_id'),
+    'podcasts': ('single_podcast', 'podcast_id'),
+    'albums': ('single_album', 'album_id'),
+    'tvshows': ('single_tvshow', 'tvshow_id'),
+    'movies': ('single_movie', 'movie_id'),
+}
+
+@route('/api/list/<listing>')
+def api_list_page(listing):
+    """
+    A page of a listing for DataTables' server-side processing: draw,
+    start, length, order[0] and search[value] in, and draw, recordsTotal,
+    recordsFiltered and data out, or error
+    """
+    args = request.args
+    try:
+        draw = int(args['draw'])
+        start = int(args.get('start', 0))
+        length = int(args.get('length', 10))
+        order_by = args['columns[%d][data]' % int(args.get('order[0][column]', 0))]
+        descending = args.get('order[0][dir]') == 'desc'
+        search = args.get('search[value]', '')
+    except (KeyError, ValueError):
+        return jsonify({'error': 'invaild request'})
+    try:
+        total, matching, rows = database.list_page(listing, start, length, order_by, descending, search)
+    except database.UserException as e:
+        return jsonify({'draw': draw, 'error': str(e)})
+
+    endpoint, id_column = LIST_ROW_LINKS[listing]
+    for r in rows:
+        # Rows link to their item like the ones rendered into the page did
+        r['DT_RowClass'] = 'clickable-tr'
+        r['DT_RowAttr'] = {'data-href': url_for(endpoint, **{id_column: r[id_column]})}
+    return jsonify({
+        'draw': draw,
+        'recordsTotal': total,
+        'recordsFiltered': matching,
+        'data': rows,
+    })
+
+#####################################################
+#   Whole listings as CSV
+#####################################################
+
+LIST_EXPORTS = {
+    'artists': database.iter_allartists,
+    'songs': database.iter_allsongs,
+    'podcasts': database.iter_allpodcasts,
+    'albums': database.iter_allalbums,
+    'tvshows': database.iter_alltvshows,
+    'movies': database.iter_allmovies,
+}
+
+@route('/list/<listing>/csv')
+def export_listing(listing):
+    """
+    Every row of a listing as a CSV download. The rows are written out as
+    the query returns them, so memory doesn't grow with the catalog and
+    the first rows go out before the query finishes.
+    """
+    if listing not in LIST_EXPORTS:
+        abort(404)
+    rows = LIST_EXPORTS[listing](row_factory=database.slotted_row)
+    response = Response(stream_with_context(_csv_chunks(rows)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = 'attachment; filename=%s.csv' % listing
+    return response
+
+def _csv_chunks(rows, chunk_size=16384):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    columns = None
+    for row in rows:
+        if columns is None:
+            columns = list(row.keys())
+            writer.writerow(columns)
+        writer.writerow([row[c] for c in columns])
+        if buf.tell() >= chunk_size:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
 
 
 
@@ -339,7 +479,7 @@ def list_tvshows():
 #####################################################
 #   Individual Artist
 #####################################################
-@route('/artist/<artist_id>')
+@route('/artist/<id:artist_id>', conditional=True)
 def single_artist(artist_id):
     """
     Show a single artist by artist_id in your media server
@@ -349,7 +489,7 @@ def single_artist(artist_id):
     # if('logged_in' not in session or not session['logged_in']):
     #     return redirect(url_for('login'))
 
-    page['title'] = 'Artist ID: '+artist_id
+    page['title'] = 'Artist ID: %d' % artist_id
 
     # Get a list of all artist by artist_id from the database
     artist = None
@@ -363,13 +503,13 @@ def single_artist(artist_id):
                            session=session,
                            page=page,
                            user=user_details,
-                           artist=artist)
+                           artist=artist), 200 if artist else 404
 
 
 #####################################################
 #   Individual Song
 #####################################################
-@route('/song/<song_id>')
+@route('/song/<id:song_id>', conditional=True)
 def single_song(song_id):
     """
     Show a single song by song_id in your media server
@@ -382,12 +522,8 @@ def single_song(song_id):
     page['title'] = 'Song'
 
 
-    # Get a list of all song by song_id from the database
-    song = None
-    song = database.get_song(song_id)
-
-    songmetadata = None
-    songmetadata = database.get_song_metadata(song_id)
+    # Get the song and its metadata from the database
+    song, songmetadata = database.get_song_page(song_id)
 
     # Data integrity checks
     if song == None:
@@ -401,13 +537,13 @@ def single_song(song_id):
                            page=page,
                            user=user_details,
                            song=song,
-                           songmetadata=songmetadata)
+                           songmetadata=songmetadata), 200 if song else 404
 
 #####################################################
 #   Query 6
 #   Individual Podcast
 #####################################################
-@route('/podcast/<podcast_id>')
+@route('/podcast/<id:podcast_id>', conditional=True)
 def single_podcast(podcast_id):
     """
     Show a single podcast by podcast_id in your media server
@@ -428,37 +564,16 @@ def single_podcast(podcast_id):
 
     # Set up some variables to manage the returns from the database fucntions
     # Get a list of all podcasts from the database
-    alleppodcasts = None
-    alleppodcasts = database.get_all_podcasteps_for_podcast(podcast_id)
-    podcast_meta = None
-    podcast_meta = database.get_podcast_metadata(podcast_id)
-    podcast = database.get_podcast(podcast_id)
-    page['title'] = podcast['podcast_title']
-    print(podcast)
-    artwork_list = []
-    description_list = []
-    copyrights_list = []
-    other_data_list = []
-    genre_list = []
+    podcast, alleppodcasts, podcast_meta = database.get_podcast_page(podcast_id)
+    page['title'] = podcast['podcast_title'] if podcast else "Nothing is here"
     # Data integrity checks
     if alleppodcasts == None:
         alleppodcasts = []
 
     if podcast_meta == None:
         podcast_meta = []
-    else :
-        for item in podcast_meta:
-            print(item)
-            if (item['md_type_name'] == 'description') :
-                description_list.append(item['md_value'])
-            elif (item['md_type_name'] == 'artwork') :
-                artwork_list.append(item['md_value'])
-            elif (item['md_type_name'] == 'copyright holder') :
-                copyrights_list.append(item['md_value'])
-            elif (item['md_type_name'] == 'podcast genre') :
-                genre_list.append(item['md_value'])
-            else :
-                other_data_list.append(item['md_value'])
+    (description_list, artwork_list, copyrights_list,
+     genre_list, other_data_list) = split_podcast_metadata(podcast_meta)
 
     # NOTE :: YOU WILL NEED TO MODIFY THIS TO PASS THE APPROPRIATE VARIABLES
     return render_template('singleitems/podcast.html',
@@ -472,14 +587,14 @@ def single_podcast(podcast_id):
                            artwork_list = artwork_list,
                            copyrights_list = copyrights_list,
                            other_data_list = other_data_list,
-                           genre_list = genre_list)
+                           genre_list = genre_list), 200 if podcast else 404
 
 #####################################################
 #   Query 7
 #   Individual Podcast Episode
 #####################################################
 # /podcastep/
-@route('/podcast/<podcast_id>/podcastep/<media_id>')
+@route('/podcast/<id:podcast_id>/podcastep/<id:media_id>', conditional=True)
 def single_podcastep(podcast_id, media_id):
     """
     Show a single podcast epsiode by media_id in your media server
@@ -495,27 +610,14 @@ def single_podcastep(podcast_id, media_id):
     podcasteplist = database.get_podcastep(podcast_id, media_id)
     podcastep =  None
     page['title'] = "Nothing is here" # Add the title
-    artwork_list = []
-    description_list = []
-    copyrights_list = []
-    other_data_list = []
-    genre_list = []
     # Data integrity check
-    if podcasteplist != None:
+    if podcasteplist:
         podcastep = podcasteplist[0]
         page['title'] = podcastep['podcast_episode_title'] # Add the title
-        for item in podcasteplist:
-            print(item)
-            if (item['md_type_name'] == 'description') :
-                description_list.append(item['md_value'])
-            elif (item['md_type_name'] == 'artwork') :
-                artwork_list.append(item['md_value'])
-            elif (item['md_type_name'] == 'copyright holder') :
-                copyrights_list.append(item['md_value'])
-            elif (item['md_type_name'] == 'podcast genre') :
-                genre_list.append(item['md_value'])
-            else :
-                other_data_list.append(item['md_value'])
+    else:
+        podcasteplist = []
+    (description_list, artwork_list, copyrights_list,
+     genre_list, other_data_list) = split_podcast_metadata(podcasteplist)
     # Set up some variables to manage the returns from the database fucntions
 
     # Once retrieved, do some data integrity checks on the data
@@ -530,13 +632,13 @@ def single_podcastep(podcast_id, media_id):
                            artwork_list = artwork_list,
                            copyrights_list = copyrights_list,
                            other_data_list = other_data_list,
-                           genre_list = genre_list)
+                           genre_list = genre_list), 200 if podcastep else 404
 
 
 #####################################################
 #   Individual Movie
 #####################################################
-@route('/movie/<movie_id>')
+@route('/movie/<id:movie_id>', conditional=True)
 def single_movie(movie_id):
     """
     Show a single movie by movie_id in your media server
@@ -562,13 +664,13 @@ def single_movie(movie_id):
                            session=session,
                            page=page,
                            user=user_details,
-                           movie=movie)
+                           movie=movie), 200 if movie else 404
 
 
 #####################################################
 #   Individual Album
 #####################################################
-@route('/album/<album_id>')
+@route('/album/<id:album_id>', conditional=True)
 def single_album(album_id):
     """
     Show a single album by album_id in your media server
@@ -581,14 +683,7 @@ def single_album(album_id):
     page['title'] = 'List Albums'
 
     # Get the album plus associated metadata from the database
-    album = None
-    album = database.get_album(album_id)
-
-    album_songs = None
-    album_songs = database.get_album_songs(album_id)
-
-    album_genres = None
-    album_genres = database.get_album_genres(album_id)
+    album, album_songs, album_genres = database.get_album_page(album_id)
 
     # Data integrity checks
     if album_songs == None:
@@ -606,13 +701,13 @@ def single_album(album_id):
                            user=user_details,
                            album=album,
                            album_songs=album_songs,
-                           album_genres=album_genres)
+                           album_genres=album_genres), 200 if album else 404
 
 
 #####################################################
 #   Individual TVShow
 #####################################################
-@route('/tvshow/<tvshow_id>')
+@route('/tvshow/<id:tvshow_id>', conditional=True)
 def single_tvshow(tvshow_id):
     """
     Show a single tvshows and its eps in your media server
@@ -625,11 +720,7 @@ def single_tvshow(tvshow_id):
     page['title'] = 'TV Show'
 
     # Get a list of all tvshows by tvshow_id from the database
-    tvshow = None
-    tvshow = database.get_tvshow(tvshow_id)
-
-    tvshoweps = None
-    tvshoweps = database.get_all_tvshoweps_for_tvshow(tvshow_id)
+    tvshow, tvshoweps = database.get_tvshow_page(tvshow_id)
 
     # Data integrity checks
     if tvshow == None:
@@ -643,12 +734,12 @@ def single_tvshow(tvshow_id):
                            page=page,
                            user=user_details,
                            tvshow=tvshow,
-                           tvshoweps=tvshoweps)
+                           tvshoweps=tvshoweps), 200 if tvshow else 404
 
 #####################################################
 #   Individual TVShow Episode
 #####################################################
-@route('/tvshowep/<tvshowep_id>')
+@route('/tvshowep/<id:tvshowep_id>', conditional=True)
 def single_tvshowep(tvshowep_id):
     """
     Show a single tvshow episode in your media server
@@ -674,7 +765,7 @@ def single_tvshowep(tvshowep_id):
                            session=session,
                            page=page,
                            user=user_details,
-                           tvshowep=tvshowep)
+                           tvshowep=tvshowep), 200 if tvshowep else 404
 
 
 #####################################################
@@ -784,9 +875,7 @@ def add_movie():
     page['title'] = 'Movie Creation'
 
     movies = None
-    print("request form is:")
     newdict = {}
-    print(request.form)
 
     # Check your incoming parameters
     if(request.method == 'POST'):
@@ -796,47 +885,37 @@ def add_movie():
             newdict['movie_title'] = 'Empty Film Value'
         else:
             newdict['movie_title'] = request.form['movie_title']
-            print("We have a value: ",newdict['movie_title'])
 
         if ('release_year' not in request.form):
             newdict['release_year'] = '0'
         else:
             newdict['release_year'] = request.form['release_year']
-            print("We have a value: ",newdict['release_year'])
 
         if ('description' not in request.form):
             newdict['description'] = 'Empty description field'
         else:
             newdict['description'] = request.form['description']
-            print("We have a value: ",newdict['description'])
 
         if ('storage_location' not in request.form):
             newdict['storage_location'] = 'Empty storage location'
         else:
             newdict['storage_location'] = request.form['storage_location']
-            print("We have a value: ",newdict['storage_location'])
 
         if ('film_genre' not in request.form):
             newdict['film_genre'] = 'drama'
         else:
             newdict['film_genre'] = request.form['film_genre']
-            print("We have a value: ",newdict['film_genre'])
 
         if ('artwork' not in request.form):
             newdict['artwork'] = 'https://user-images.githubusercontent.com/24848110/33519396-7e56363c-d79d-11e7-969b-09782f5ccbab.png'
         else:
             newdict['artwork'] = request.form['artwork']
-            print("We have a value: ",newdict['artwork'])
-
-        print('newdict is:')
-        print(newdict)
 
         #forward to the database to manage insert
         movies = database.add_movie_to_db(newdict['movie_title'],newdict['release_year'],newdict['description'],newdict['storage_location'],newdict['film_genre'])
 
 
         max_movie_id = database.get_last_movie()[0]['movie_id']
-        print(movies)
         if movies is not None:
             max_movie_id = movies[0]
 
@@ -873,9 +952,7 @@ def add_song():
     page['title'] = 'Song Creation' # Add the title
 
     songs = None
-    print("request form is:")
     newdict = {}
-    print(request.form)
 
     if request.method == 'POST':
 
@@ -884,46 +961,36 @@ def add_song():
             newdict['song_title'] = 'Empty Song Value'
         else:
             newdict['song_title'] = request.form['song_title']
-            print("We have a value: ",newdict['song_title'])
 
         if ('song_length' not in request.form):
             newdict['song_length'] = '0'
         else:
             newdict['song_length'] = request.form['song_length']
-            print("We have a value: ",newdict['song_length'])
 
         if ('description' not in request.form):
             newdict['description'] = 'Empty description field'
         else:
             newdict['description'] = request.form['description']
-            print("We have a value: ",newdict['description'])
 
         if ('storage_location' not in request.form):
             newdict['storage_location'] = 'Empty storage location'
         else:
             newdict['storage_location'] = request.form['storage_location']
-            print("We have a value: ",newdict['storage_location'])
 
         if ('song_genre' not in request.form):
             newdict['song_genre'] = 'Pop'
         else:
             newdict['song_genre'] = request.form['song_genre']
-            print("We have a value: ",newdict['song_genre'])
 
         if ('artwork' not in request.form):
             newdict['artwork'] = 'https://user-images.githubusercontent.com/24848110/33519396-7e56363c-d79d-11e7-969b-09782f5ccbab.png'
         else:
             newdict['artwork'] = request.form['artwork']
-            print("We have a value: ",newdict['artwork'])
 
         if ('artist_name' not in request.form):
             newdict['artist'] = 'No artist'
         else:
             newdict['artist'] = request.form['artist_name']
-            print("We have a value: ",newdict['artist'])
-
-        print('newdict is:')
-        print(newdict)
 
         #forward to the database to manage insert
 
@@ -1045,8 +1112,9 @@ title or maybe description contains some words similiar to batman.
 
 XHR payload:
 {
-# allowed values ["all", "movie", "podcast", "song", "tvshow"]
-# only movie is implemented
+# allowed values ["all", "movie", "podcast", "song", "tvshow", "album",
+# "podcastepisode", "tvepisode"]; podcast and tvshow include their episodes.
+# metadata tags are only for movie
    "type": "all",
    "query":
    {
@@ -1074,19 +1142,56 @@ api response:
 
 for movie item
 {
-    "type": "music", # or movie ...
-    "title": "some title",
+    "movie_id": 1,
+    "movie_title": "some title",
     "release_year": "1990",
     "similarity": 1
 }
 
+for any other type, or "all"
+{
+    "media_type": "song", # or movie, album, podcast, podcastepisode ...
+    "item_id": 1,
+    "parent_id": null, # the podcast or tvshow of an episode
+    "title": "some title",
+    "release_year": null, # for movies
+    "popularity": 3, # plays
+    "similarity": 1.2,
+    "url": "/song/1"
+}
+
 """
 
+# Where a search result of each media type links to
+SEARCH_RESULT_LINKS = {
+    'movie': lambda r: url_for('single_movie', movie_id=r['item_id']),
+    'song': lambda r: url_for('single_song', song_id=r['item_id']),
+    'album': lambda r: url_for('single_album', album_id=r['item_id']),
+    'podcast': lambda r: url_for('single_podcast', podcast_id=r['item_id']),
+    'podcastepisode': lambda r: url_for('single_podcastep', podcast_id=r['parent_id'],
+                                        media_id=r['item_id']),
+    'tvshow': lambda r: url_for('single_tvshow', tvshow_id=r['item_id']),
+    'tvepisode': lambda r: url_for('single_tvshowep', tvshowep_id=r['item_id']),
+}
+
+def _search(mtype, terms, metadata=None, limit=10, offset=0, titles_only=False):
+    """
+    Movies through movie_fuzzy_search, which also filters on metadata;
+    every other type, and all of them at once, through search_documents
+    """
+    if mtype == 'movie':
+        return database.movie_fuzzy_search(terms, metadata or {}, limit, offset)
+    if metadata:
+        raise database.UserException("metadata tags are only for movies")
+    items = database.search_documents(terms, mtype, limit, offset, titles_only)
+    for r in items:
+        r['url'] = SEARCH_RESULT_LINKS[r['media_type']](r)
+    return items
+
 @app.route("/api/gethint", methods=['POST'])
 def api_get_hint():
     """only search for term not metadata tags"""
     json = request.json
-    print(json)
     try:
         mtype = json['type']
         terms = json['query']['term']
@@ -1096,7 +1201,7 @@ def api_get_hint():
             "errmsg": "invaild request"
         })
     try:
-        ret = database.movie_fuzzy_search(terms)
+        ret = _search(mtype, terms, titles_only=True)
     except database.UserException as e:
         return jsonify({
             "code": 1,
@@ -1111,20 +1216,21 @@ def api_get_hint():
 @app.route("/api/search", methods=['POST'])
 def api_fuzzy_search():
     json = request.json
-    print(json)
     try:
         mtype = json['type']
         terms = json['query']['term']
         meta = json['query']['metadata']
-        limit = json['query']['limit']
-        offset = json['query']['offset']
+        limit = int(json['query']['limit'])
+        offset = int(json['query']['offset'])
+        if limit < 0 or offset < 0:
+            raise ValueError(limit, offset)
     except Exception:
         return jsonify({
             "code": 1000,
             "errmsg": "invaild request"
         })
     try:
-        ret = database.movie_fuzzy_search(terms, meta, limit)
+        ret = _search(mtype, terms, meta, limit, offset)
     except database.UserException as e:
         return jsonify({
             "code": 1,
@@ -1160,3 +1266,30 @@ def debug_api_setuser():
         request.form['issuper'],
     )
     return jsonify({'code': 'success'})
+
+@app.route('/debug/api/querystats', methods=['GET', 'DELETE'])
+@debug_api
+def debug_api_querystats():
+    """Per call site query metrics; DELETE clears them after reading"""
+    stats = {
+        'code': 'success',
+        'queries': database.query_stats(),
+        'pool': database.pool_stats(),
+        'statements': database.statement_cache_stats(),
+        'catalog_cache': database.catalog_cache_stats(),
+        'search_cache': database.search_cache_stats(),
+        'missing_ids': database.missing_ids_stats(),
+        'page_keys': database.page_keys_stats(),
+        'shared_cache': database.shared_cache_stats(),
+    }
+    if request.method == 'DELETE':
+        database.reset_query_stats()
+    return jsonify(stats)
+
+@app.route('/debug/api/referencedata', methods=['GET', 'POST'])
+@debug_api
+def debug_api_referencedata():
+    """Cached lookup table stats; POST reloads them on next use"""
+    if request.method == 'POST':
+        database.refresh_reference_data()
+    return jsonify({'code': 'success', 'tables': database.reference_data_stats()})
@@ -15,7 +15,7 @@ class App
             'metadata': {},
             'invaild': [],
             'limit': limit,
-            'offset': offset, // not implemented yet
+            'offset': offset,
         };
 
         text.split(';').forEach(
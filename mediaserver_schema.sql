@@ -37,6 +37,7 @@ DROP TABLE IF EXISTS Song_Featured_Artists CASCADE;
 DROP TABLE IF EXISTS BandMembership CASCADE;
 DROP TABLE IF EXISTS VideoMedia CASCADE;
 DROP TABLE IF EXISTS Movie CASCADE;
+DROP TABLE IF EXISTS TitleWord CASCADE;
 DROP TABLE IF EXISTS TVShow CASCADE;
 DROP TABLE IF EXISTS TVEpisode CASCADE;
 DROP TABLE IF EXISTS MetaDataType CASCADE;
@@ -48,11 +49,19 @@ DROP TABLE IF EXISTS AlbumMetaData CASCADE;
 DROP TABLE IF EXISTS ArtistMetaData CASCADE;
 DROP TABLE IF EXISTS TVShowMetaData CASCADE;
 DROP TABLE IF EXISTS PodcastMetaData CASCADE;
+DROP TABLE IF EXISTS ArtistSummary CASCADE;
+DROP TABLE IF EXISTS SongSummary CASCADE;
+DROP TABLE IF EXISTS PodcastSummary CASCADE;
+DROP TABLE IF EXISTS TVShowSummary CASCADE;
+DROP TABLE IF EXISTS SearchDocument CASCADE;
 
 CREATE TABLE UserAccount (
     username VARCHAR(50) PRIMARY KEY,
     password VARCHAR(72) NOT NULL,
-    isSuper boolean DEFAULT FALSE
+    isSuper boolean DEFAULT FALSE,
+    -- moves on with every credential change, so sessions holding the old
+    -- authorization check again (see migrations/007_credential_version.sql)
+    credential_version INTEGER NOT NULL DEFAULT 0
 );
 
 CREATE TABLE ContactType(
@@ -225,10 +234,18 @@ CREATE TABLE Movie (
     title_words varchar[]
 );
 
+-- Every word that is or was in a title, for movie_fuzzy_search and
+-- search_documents to find the words similar to the search terms through
+-- titleword_trgm_idx
+CREATE TABLE TitleWord (
+    word VARCHAR PRIMARY KEY
+);
+
 CREATE FUNCTION update_movie_title_words() RETURNS trigger AS
 $$
 begin
   new.title_words := array_agg(distinct lower(w)) from unnest(string_to_array(new.movie_title, ' ')) w;
+  insert into mediaserver.TitleWord select unnest(new.title_words) on conflict do nothing;
   return new;
 end
 $$ language plpgsql;
@@ -268,6 +285,549 @@ CREATE TABLE PodcastMetaData (
     PRIMARY KEY (podcast_id,md_id)
 );
 
+--------------------------
+-- List summaries       --
+--------------------------
+-- The counts and artist lists the get_all* listings show, kept current by
+-- triggers on the child tables instead of aggregated over them on every
+-- listing. refresh_list_summaries() rebuilds them all from the child
+-- tables (see migrations/004_list_summaries.sql). A parent without
+-- children may have no summary row yet.
+CREATE TABLE ArtistSummary (
+    artist_id INTEGER PRIMARY KEY REFERENCES Artist(artist_id) ON DELETE CASCADE,
+    metadata_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE SongSummary (
+    song_id INTEGER PRIMARY KEY REFERENCES Song(song_id) ON DELETE CASCADE,
+    artists text
+);
+
+CREATE TABLE PodcastSummary (
+    podcast_id INTEGER PRIMARY KEY REFERENCES Podcast(podcast_id) ON DELETE CASCADE,
+    episode_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE TVShowSummary (
+    tvshow_id INTEGER PRIMARY KEY REFERENCES TVShow(tvshow_id) ON DELETE CASCADE,
+    episode_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE FUNCTION update_artist_summary() RETURNS trigger AS
+$$
+begin
+  if tg_op in ('DELETE', 'UPDATE') then
+    update mediaserver.ArtistSummary set metadata_count = metadata_count - 1
+    where artist_id = old.artist_id;
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into mediaserver.ArtistSummary values (new.artist_id, 1)
+    on conflict (artist_id) do update set metadata_count = ArtistSummary.metadata_count + 1;
+  end if;
+  return null;
+end
+$$ language plpgsql;
+
+CREATE TRIGGER artistmetadata_summary
+       AFTER INSERT OR UPDATE OF artist_id OR DELETE ON ArtistMetaData
+       FOR EACH ROW EXECUTE PROCEDURE update_artist_summary();
+
+-- The song's artist list, from its Song_Artists as they are now
+CREATE FUNCTION summarise_song(song INTEGER) RETURNS void AS
+$$
+  insert into mediaserver.SongSummary
+      select song, string_agg(a.artist_name, ',' order by a.artist_name)
+      from mediaserver.Song_Artists sa join mediaserver.Artist a on (a.artist_id = sa.performing_artist_id)
+      where sa.song_id = song
+  on conflict (song_id) do update set artists = excluded.artists;
+$$ language sql;
+
+CREATE FUNCTION update_song_summary() RETURNS trigger AS
+$$
+begin
+  if tg_op in ('DELETE', 'UPDATE') then
+    perform mediaserver.summarise_song(old.song_id);
+  end if;
+  if tg_op = 'INSERT' or (tg_op = 'UPDATE' and new.song_id <> old.song_id) then
+    perform mediaserver.summarise_song(new.song_id);
+  end if;
+  return null;
+end
+$$ language plpgsql;
+
+CREATE TRIGGER song_artists_summary
+       AFTER INSERT OR UPDATE OR DELETE ON Song_Artists
+       FOR EACH ROW EXECUTE PROCEDURE update_song_summary();
+
+CREATE FUNCTION update_artist_songs_summary() RETURNS trigger AS
+$$
+begin
+  perform mediaserver.summarise_song(song_id)
+  from mediaserver.Song_Artists where performing_artist_id = new.artist_id;
+  return null;
+end
+$$ language plpgsql;
+
+CREATE TRIGGER artist_name_summary
+       AFTER UPDATE OF artist_name ON Artist
+       FOR EACH ROW WHEN (new.artist_name IS DISTINCT FROM old.artist_name)
+       EXECUTE PROCEDURE update_artist_songs_summary();
+
+CREATE FUNCTION update_podcast_summary() RETURNS trigger AS
+$$
+begin
+  if tg_op in ('DELETE', 'UPDATE') then
+    update mediaserver.PodcastSummary set episode_count = episode_count - 1
+    where podcast_id = old.podcast_id;
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into mediaserver.PodcastSummary values (new.podcast_id, 1)
+    on conflict (podcast_id) do update set episode_count = PodcastSummary.episode_count + 1;
+  end if;
+  return null;
+end
+$$ language plpgsql;
+
+CREATE TRIGGER podcastepisode_summary
+       AFTER INSERT OR UPDATE OF podcast_id OR DELETE ON PodcastEpisode
+       FOR EACH ROW EXECUTE PROCEDURE update_podcast_summary();
+
+CREATE FUNCTION update_tvshow_summary() RETURNS trigger AS
+$$
+begin
+  if tg_op in ('DELETE', 'UPDATE') then
+    update mediaserver.TVShowSummary set episode_count = episode_count - 1
+    where tvshow_id = old.tvshow_id;
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into mediaserver.TVShowSummary values (new.tvshow_id, 1)
+    on conflict (tvshow_id) do update set episode_count = TVShowSummary.episode_count + 1;
+  end if;
+  return null;
+end
+$$ language plpgsql;
+
+CREATE TRIGGER tvepisode_summary
+       AFTER INSERT OR UPDATE OF tvshow_id OR DELETE ON TVEpisode
+       FOR EACH ROW EXECUTE PROCEDURE update_tvshow_summary();
+
+-- Every summary worked out again from the child tables, e.g. after
+-- loading data with the triggers disabled
+CREATE FUNCTION refresh_list_summaries() RETURNS void AS
+$$
+  delete from mediaserver.ArtistSummary;
+  insert into mediaserver.ArtistSummary
+      select a.artist_id, count(amd.md_id)
+      from mediaserver.Artist a left outer join mediaserver.ArtistMetaData amd on (amd.artist_id = a.artist_id)
+      group by a.artist_id;
+
+  delete from mediaserver.SongSummary;
+  insert into mediaserver.SongSummary
+      select s.song_id, string_agg(a.artist_name, ',' order by a.artist_name)
+      from mediaserver.Song s
+          left outer join (mediaserver.Song_Artists sa join mediaserver.Artist a on (a.artist_id = sa.performing_artist_id))
+          on (sa.song_id = s.song_id)
+      group by s.song_id;
+
+  delete from mediaserver.PodcastSummary;
+  insert into mediaserver.PodcastSummary
+      select p.podcast_id, count(pe.media_id)
+      from mediaserver.Podcast p left outer join mediaserver.PodcastEpisode pe on (pe.podcast_id = p.podcast_id)
+      group by p.podcast_id;
+
+  delete from mediaserver.TVShowSummary;
+  insert into mediaserver.TVShowSummary
+      select t.tvshow_id, count(e.media_id)
+      from mediaserver.TVShow t left outer join mediaserver.TVEpisode e on (e.tvshow_id = t.tvshow_id)
+      group by t.tvshow_id;
+$$ language sql;
+
+--------------------------
+-- Search documents     --
+--------------------------
+-- One row per searchable item of every media type, for /api/search and
+-- /api/gethint: its title and title words, its title (weight A) and
+-- description metadata (weight B) as a tsvector, and how many users
+-- have played it or, for podcasts, TV shows and albums, its episodes or
+-- songs. Kept current by the triggers below; refresh_search_documents()
+-- works rows out again from SearchDocumentSource
+-- (see migrations/005_search_documents.sql).
+CREATE TABLE SearchDocument (
+    media_type VARCHAR(20) NOT NULL,
+    item_id INTEGER NOT NULL,
+    -- the podcast or TV show of an episode
+    parent_id INTEGER,
+    title VARCHAR(250),
+    release_year SMALLINT,
+    title_words varchar[],
+    document tsvector NOT NULL,
+    popularity INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (media_type, item_id)
+);
+
+CREATE VIEW SearchDocumentSource AS
+    select media_type, item_id, parent_id, title, release_year,
+           (select array_agg(distinct lower(w)) from unnest(string_to_array(title, ' ')) w
+            where w <> '')::varchar[] as title_words,
+           setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(descriptions, '')), 'B') as document,
+           popularity
+    from (
+        select 'movie'::varchar as media_type, m.movie_id as item_id, null::integer as parent_id,
+               m.movie_title::varchar as title, m.release_year,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.MediaItemMetaData mimd
+                    join mediaserver.MetaData md on (md.md_id = mimd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where mimd.media_id = m.movie_id and mt.md_type_name = 'description') as descriptions,
+               (select count(*) from mediaserver.UserMediaConsumption c
+                where c.media_id = m.movie_id)::integer as popularity
+        from mediaserver.Movie m
+        union all
+        select 'song', s.song_id, null, s.song_title, null,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.MediaItemMetaData mimd
+                    join mediaserver.MetaData md on (md.md_id = mimd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where mimd.media_id = s.song_id and mt.md_type_name = 'description'),
+               (select count(*) from mediaserver.UserMediaConsumption c
+                where c.media_id = s.song_id)::integer
+        from mediaserver.Song s
+        union all
+        -- An episode in more than one podcast or show is one document, under
+        -- the first of them
+        select 'podcastepisode', pe.media_id, min(pe.podcast_id), min(pe.podcast_episode_title), null,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.MediaItemMetaData mimd
+                    join mediaserver.MetaData md on (md.md_id = mimd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where mimd.media_id = pe.media_id and mt.md_type_name = 'description'),
+               (select count(*) from mediaserver.UserMediaConsumption c
+                where c.media_id = pe.media_id)::integer
+        from mediaserver.PodcastEpisode pe
+        group by pe.media_id
+        union all
+        select 'tvepisode', e.media_id, min(e.tvshow_id), min(e.tvshow_episode_title), null,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.MediaItemMetaData mimd
+                    join mediaserver.MetaData md on (md.md_id = mimd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where mimd.media_id = e.media_id and mt.md_type_name = 'description'),
+               (select count(*) from mediaserver.UserMediaConsumption c
+                where c.media_id = e.media_id)::integer
+        from mediaserver.TVEpisode e
+        group by e.media_id
+        union all
+        select 'podcast', p.podcast_id, null, p.podcast_title, null,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.PodcastMetaData pmd
+                    join mediaserver.MetaData md on (md.md_id = pmd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where pmd.podcast_id = p.podcast_id and mt.md_type_name = 'description'),
+               (select count(*) from mediaserver.PodcastEpisode pe
+                    join mediaserver.UserMediaConsumption c on (c.media_id = pe.media_id)
+                where pe.podcast_id = p.podcast_id)::integer
+        from mediaserver.Podcast p
+        union all
+        select 'tvshow', t.tvshow_id, null, t.tvshow_title, null,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.TVShowMetaData tmd
+                    join mediaserver.MetaData md on (md.md_id = tmd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where tmd.tvshow_id = t.tvshow_id and mt.md_type_name = 'description'),
+               (select count(*) from mediaserver.TVEpisode e
+                    join mediaserver.UserMediaConsumption c on (c.media_id = e.media_id)
+                where e.tvshow_id = t.tvshow_id)::integer
+        from mediaserver.TVShow t
+        union all
+        select 'album', a.album_id, null, a.album_title, null,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.AlbumMetaData amd
+                    join mediaserver.MetaData md on (md.md_id = amd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where amd.album_id = a.album_id and mt.md_type_name = 'description'),
+               (select count(*) from mediaserver.Album_Songs als
+                    join mediaserver.UserMediaConsumption c on (c.media_id = als.song_id)
+                where als.album_id = a.album_id)::integer
+        from mediaserver.Album a
+    ) items;
+
+-- The documents of the items of type `kind` with the given ids, worked
+-- out again; kind 'media' is any of the types whose id is a media_id
+CREATE FUNCTION refresh_search_documents(kind VARCHAR, ids INTEGER[]) RETURNS void AS
+$$
+  delete from mediaserver.SearchDocument
+  where item_id = any(ids)
+    and (media_type = kind or (kind = 'media' and media_type in ('movie', 'song', 'podcastepisode', 'tvepisode')));
+  insert into mediaserver.SearchDocument
+      select * from mediaserver.SearchDocumentSource
+      where item_id = any(ids)
+        and (media_type = kind or (kind = 'media' and media_type in ('movie', 'song', 'podcastepisode', 'tvepisode')));
+  insert into mediaserver.TitleWord
+      select distinct unnest(title_words) from mediaserver.SearchDocument
+      where item_id = any(ids)
+        and (media_type = kind or (kind = 'media' and media_type in ('movie', 'song', 'podcastepisode', 'tvepisode')))
+  on conflict do nothing;
+$$ language sql;
+
+-- Every document worked out again, e.g. after loading data with the
+-- triggers disabled
+CREATE FUNCTION refresh_all_search_documents() RETURNS void AS
+$$
+  delete from mediaserver.SearchDocument;
+  insert into mediaserver.SearchDocument select * from mediaserver.SearchDocumentSource;
+  insert into mediaserver.TitleWord
+      select distinct unnest(title_words) from mediaserver.SearchDocument
+  on conflict do nothing;
+$$ language sql;
+
+-- Trigger arguments: the document type and the column with its id, then
+-- optionally the same for a second document, e.g. an episode's show. The
+-- bulk import sets mediaserver.defer_search_documents and refreshes the
+-- documents it added in one go instead.
+CREATE FUNCTION update_search_documents() RETURNS trigger AS
+$$
+declare
+  old_row jsonb := case when tg_op <> 'INSERT' then to_jsonb(old) end;
+  new_row jsonb := case when tg_op <> 'DELETE' then to_jsonb(new) end;
+  i integer := 0;
+begin
+  if current_setting('mediaserver.defer_search_documents', true) = 'on' then
+    return null;
+  end if;
+  while i < tg_nargs loop
+    if old_row is not null then
+      perform mediaserver.refresh_search_documents(tg_argv[i], array[(old_row ->> tg_argv[i + 1])::integer]);
+    end if;
+    if new_row is not null and (old_row is null or new_row -> tg_argv[i + 1] <> old_row -> tg_argv[i + 1]) then
+      perform mediaserver.refresh_search_documents(tg_argv[i], array[(new_row ->> tg_argv[i + 1])::integer]);
+    end if;
+    i := i + 2;
+  end loop;
+  return null;
+end
+$$ language plpgsql;
+
+CREATE TRIGGER movie_search_document
+       AFTER INSERT OR UPDATE OF movie_title, release_year OR DELETE ON Movie
+       FOR EACH ROW EXECUTE PROCEDURE update_search_documents('movie', 'movie_id');
+CREATE TRIGGER song_search_document
+       AFTER INSERT OR UPDATE OF song_title OR DELETE ON Song
+       FOR EACH ROW EXECUTE PROCEDURE update_search_documents('song', 'song_id');
+CREATE TRIGGER podcastepisode_search_document
+       AFTER INSERT OR UPDATE OF podcast_episode_title, podcast_id, media_id OR DELETE ON PodcastEpisode
+       FOR EACH ROW EXECUTE PROCEDURE update_search_documents('podcastepisode', 'media_id', 'podcast', 'podcast_id');
+CREATE TRIGGER tvepisode_search_document
+       AFTER INSERT OR UPDATE OF tvshow_episode_title, tvshow_id, media_id OR DELETE ON TVEpisode
+       FOR EACH ROW EXECUTE PROCEDURE update_search_documents('tvepisode', 'media_id', 'tvshow', 'tvshow_id');
+CREATE TRIGGER podcast_search_document
+       AFTER INSERT OR UPDATE OF podcast_title OR DELETE ON Podcast
+       FOR EACH ROW EXECUTE PROCEDURE update_search_documents('podcast', 'podcast_id');
+CREATE TRIGGER tvshow_search_document
+       AFTER INSERT OR UPDATE OF tvshow_title OR DELETE ON TVShow
+       FOR EACH ROW EXECUTE PROCEDURE update_search_documents('tvshow', 'tvshow_id');
+CREATE TRIGGER album_search_document
+       AFTER INSERT OR UPDATE OF album_title OR DELETE ON Album
+       FOR EACH ROW EXECUTE PROCEDURE update_search_documents('album', 'album_id');
+-- Descriptions, and the songs an album's popularity comes from
+CREATE TRIGGER mediaitemmetadata_search_document
+       AFTER INSERT OR UPDATE OR DELETE ON MediaItemMetaData
+       FOR EACH ROW EXECUTE PROCEDURE update_search_documents('media', 'media_id');
+CREATE TRIGGER podcastmetadata_search_document
+       AFTER INSERT OR UPDATE OR DELETE ON PodcastMetaData
+       FOR EACH ROW EXECUTE PROCEDURE update_search_documents('podcast', 'podcast_id');
+CREATE TRIGGER tvshowmetadata_search_document
+       AFTER INSERT OR UPDATE OR DELETE ON TVShowMetaData
+       FOR EACH ROW EXECUTE PROCEDURE update_search_documents('tvshow', 'tvshow_id');
+CREATE TRIGGER albummetadata_search_document
+       AFTER INSERT OR UPDATE OR DELETE ON AlbumMetaData
+       FOR EACH ROW EXECUTE PROCEDURE update_search_documents('album', 'album_id');
+CREATE TRIGGER album_songs_search_document
+       AFTER INSERT OR UPDATE OR DELETE ON Album_Songs
+       FOR EACH ROW EXECUTE PROCEDURE update_search_documents('album', 'album_id');
+
+-- An edited description: every document with it
+CREATE FUNCTION update_metadata_search_documents() RETURNS trigger AS
+$$
+begin
+  perform mediaserver.refresh_search_documents('media', array(
+      select media_id from mediaserver.MediaItemMetaData where md_id = new.md_id));
+  perform mediaserver.refresh_search_documents('podcast', array(
+      select podcast_id from mediaserver.PodcastMetaData where md_id = new.md_id));
+  perform mediaserver.refresh_search_documents('tvshow', array(
+      select tvshow_id from mediaserver.TVShowMetaData where md_id = new.md_id));
+  perform mediaserver.refresh_search_documents('album', array(
+      select album_id from mediaserver.AlbumMetaData where md_id = new.md_id));
+  return null;
+end
+$$ language plpgsql;
+
+CREATE TRIGGER metadata_search_document
+       AFTER UPDATE OF md_value, md_type_id ON MetaData
+       FOR EACH ROW EXECUTE PROCEDURE update_metadata_search_documents();
+
+-- A play added or taken away: one more or less for the item and for the
+-- podcast, show or albums it is in
+CREATE FUNCTION update_search_popularity() RETURNS trigger AS
+$$
+declare
+  media integer := case when tg_op = 'DELETE' then old.media_id else new.media_id end;
+begin
+  if tg_op = 'UPDATE' then
+    if new.media_id = old.media_id then
+      return null;
+    end if;
+    media := old.media_id;
+  end if;
+  update mediaserver.SearchDocument d
+  set popularity = popularity + case when tg_op = 'INSERT' then 1 else -1 end
+  where (d.media_type, d.item_id) in (
+      select t, media from unnest(array['movie', 'song', 'podcastepisode', 'tvepisode']) t
+      union all
+      select 'podcast', podcast_id from mediaserver.PodcastEpisode where media_id = media
+      union all
+      select 'tvshow', tvshow_id from mediaserver.TVEpisode where media_id = media
+      union all
+      select 'album', album_id from mediaserver.Album_Songs where song_id = media);
+  if tg_op = 'UPDATE' then
+    update mediaserver.SearchDocument d
+    set popularity = popularity + 1
+    where (d.media_type, d.item_id) in (
+        select t, new.media_id from unnest(array['movie', 'song', 'podcastepisode', 'tvepisode']) t
+        union all
+        select 'podcast', podcast_id from mediaserver.PodcastEpisode where media_id = new.media_id
+        union all
+        select 'tvshow', tvshow_id from mediaserver.TVEpisode where media_id = new.media_id
+        union all
+        select 'album', album_id from mediaserver.Album_Songs where song_id = new.media_id);
+  end if;
+  return null;
+end
+$$ language plpgsql;
+
+CREATE TRIGGER usermediaconsumption_search_popularity
+       AFTER INSERT OR UPDATE OF media_id OR DELETE ON UserMediaConsumption
+       FOR EACH ROW EXECUTE PROCEDURE update_search_popularity();
+
+--------------------------
+-- Catalog version      --
+--------------------------
+-- One row whose version moves on, once per transaction, whenever the
+-- catalog tables change, so every server process can tell when its cached
+-- listings, searches and missing items are out of date
+-- (see migrations/006_catalog_version.sql).
+CREATE TABLE CatalogVersion (
+    version BIGINT NOT NULL,
+    changed_at timestamptz NOT NULL DEFAULT now(),
+    -- the transaction that last moved it on
+    changed_by BIGINT
+);
+
+INSERT INTO CatalogVersion (version) VALUES (1);
+
+CREATE FUNCTION bump_catalog_version() RETURNS trigger AS
+$$
+begin
+  update mediaserver.CatalogVersion
+  set version = version + 1, changed_at = now(), changed_by = txid_current()
+  where changed_by is distinct from txid_current();
+  return null;
+end
+$$ language plpgsql;
+
+CREATE TRIGGER mediaitem_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON MediaItem
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER audiomedia_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON AudioMedia
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER videomedia_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON VideoMedia
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER metadata_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON MetaData
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER metadatatype_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON MetaDataType
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER mediaitemmetadata_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON MediaItemMetaData
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER artist_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Artist
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER artistmetadata_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON ArtistMetaData
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER bandmembership_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON BandMembership
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER song_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Song
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER song_artists_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Song_Artists
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER album_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Album
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER album_songs_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Album_Songs
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER albummetadata_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON AlbumMetaData
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER podcast_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Podcast
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER podcastepisode_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON PodcastEpisode
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER podcastmetadata_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON PodcastMetaData
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER tvshow_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON TVShow
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER tvepisode_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON TVEpisode
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER tvshowmetadata_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON TVShowMetaData
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+CREATE TRIGGER movie_catalog_version
+       AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Movie
+       FOR EACH STATEMENT EXECUTE PROCEDURE bump_catalog_version();
+
+--------------------------
+-- Indexes              --
+--------------------------
+-- Title searches match lower(title) LIKE '%term%', which only a trigram
+-- index can serve (see migrations/001_title_trigram_indexes.sql)
+CREATE INDEX movie_title_trgm_idx ON Movie USING gin (lower(movie_title) gin_trgm_ops);
+CREATE INDEX tvshow_title_trgm_idx ON TVShow USING gin (lower(tvshow_title) gin_trgm_ops);
+-- Episodes by show; the primary key starts with media_id
+CREATE INDEX tvepisode_tvshow_id_idx ON TVEpisode (tvshow_id);
+-- movie_fuzzy_search: title words similar to the terms, then the movies
+-- with any of those words (see migrations/002_movie_fuzzy_search_indexes.sql)
+CREATE INDEX titleword_trgm_idx ON TitleWord USING gin (word gin_trgm_ops);
+CREATE INDEX movie_title_words_idx ON Movie USING gin (title_words);
+-- The list pages sort by id or by title and page by keyset, the sort key
+-- then the id (see migrations/003_listing_sort_indexes.sql)
+CREATE INDEX artist_name_sort_idx ON Artist ((coalesce(artist_name, '')), artist_id);
+CREATE INDEX song_title_sort_idx ON Song ((coalesce(song_title, '')), song_id);
+CREATE INDEX podcast_title_sort_idx ON Podcast ((coalesce(podcast_title, '')), podcast_id);
+CREATE INDEX album_title_sort_idx ON Album (album_title, album_id);
+CREATE INDEX tvshow_title_sort_idx ON TVShow ((coalesce(tvshow_title, '')), tvshow_id);
+CREATE INDEX movie_title_sort_idx ON Movie ((coalesce(movie_title, '')), movie_id);
+CREATE INDEX movie_release_year_sort_idx ON Movie ((coalesce(release_year, 0)), movie_id);
+-- search_documents: every media type in one query, by its full text
+-- search terms or by title words similar to them, and the plays of an item
+-- for its popularity (see migrations/005_search_documents.sql)
+CREATE INDEX searchdocument_document_idx ON SearchDocument USING gin (document);
+CREATE INDEX searchdocument_title_words_idx ON SearchDocument USING gin (title_words);
+CREATE INDEX usermediaconsumption_media_id_idx ON UserMediaConsumption (media_id);
+
 --------------------------
 -- Helper Functions     --
 --------------------------
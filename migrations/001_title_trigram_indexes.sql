@@ -0,0 +1,31 @@
+/**
+Trigram indexes for the title searches
+
+find_matchingmovies and find_matchingtvshows match lower(title) LIKE
+'%term%' (they used an unanchored regex before). Neither can use a btree
+index, but a GIN trigram index on the lowered title serves both.
+find_matchingtvshows also counts episodes per matching show, which needs
+TVEpisode by tvshow_id; its primary key starts with media_id.
+
+Apply to a database loaded from an older mediaserver_schema.sql:
+    psql -f migrations/001_title_trigram_indexes.sql
+*/
+
+start transaction;
+
+set search_path to 'mediaserver', 'public';
+
+create extension if not exists pg_trgm;
+
+create index if not exists movie_title_trgm_idx
+    on Movie using gin (lower(movie_title) gin_trgm_ops);
+create index if not exists tvshow_title_trgm_idx
+    on TVShow using gin (lower(tvshow_title) gin_trgm_ops);
+create index if not exists tvepisode_tvshow_id_idx
+    on TVEpisode (tvshow_id);
+
+analyze Movie;
+analyze TVShow;
+analyze TVEpisode;
+
+commit;
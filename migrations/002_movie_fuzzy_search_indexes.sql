@@ -0,0 +1,45 @@
+/**
+Indexes for movie_fuzzy_search
+
+movie_fuzzy_search used to rank every movie by
+total_similarity(title_words, terms). It now looks up the words similar to
+the terms in TitleWord, the vocabulary of movie titles, through a trigram
+index. It then reads only the movies having one of those words, through
+a GIN index on Movie.title_words. update_movie_title_words adds the words
+of new and renamed titles to TitleWord. Words no longer in any title stay
+in it; they match no movie.
+
+Apply after 001_title_trigram_indexes.sql:
+    psql -f migrations/002_movie_fuzzy_search_indexes.sql
+*/
+
+start transaction;
+
+set search_path to 'mediaserver', 'public';
+
+create table if not exists TitleWord (
+    word varchar primary key
+);
+
+insert into TitleWord
+    select distinct unnest(title_words) from Movie
+    on conflict do nothing;
+
+create or replace function update_movie_title_words() returns trigger as
+$$
+begin
+  new.title_words := array_agg(distinct lower(w)) from unnest(string_to_array(new.movie_title, ' ')) w;
+  insert into mediaserver.TitleWord select unnest(new.title_words) on conflict do nothing;
+  return new;
+end
+$$ language plpgsql;
+
+create index if not exists titleword_trgm_idx
+    on TitleWord using gin (word gin_trgm_ops);
+create index if not exists movie_title_words_idx
+    on Movie using gin (title_words);
+
+analyze TitleWord;
+analyze Movie;
+
+commit;
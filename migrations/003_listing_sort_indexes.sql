@@ -0,0 +1,40 @@
+/**
+Indexes for the list pages
+
+The /list pages fetch their rows a page at a time from /api/list. A page
+is ordered by id or by title (or by release year for movies), then by id,
+and the next page starts after the last row's (sort key, id). These
+indexes let both directions read just the page. NULL titles sort as ''
+so the keys compare.
+
+Apply after 002_movie_fuzzy_search_indexes.sql:
+    psql -f migrations/003_listing_sort_indexes.sql
+*/
+
+start transaction;
+
+set search_path to 'mediaserver', 'public';
+
+create index if not exists artist_name_sort_idx
+    on Artist ((coalesce(artist_name, '')), artist_id);
+create index if not exists song_title_sort_idx
+    on Song ((coalesce(song_title, '')), song_id);
+create index if not exists podcast_title_sort_idx
+    on Podcast ((coalesce(podcast_title, '')), podcast_id);
+create index if not exists album_title_sort_idx
+    on Album (album_title, album_id);
+create index if not exists tvshow_title_sort_idx
+    on TVShow ((coalesce(tvshow_title, '')), tvshow_id);
+create index if not exists movie_title_sort_idx
+    on Movie ((coalesce(movie_title, '')), movie_id);
+create index if not exists movie_release_year_sort_idx
+    on Movie ((coalesce(release_year, 0)), movie_id);
+
+analyze Artist;
+analyze Song;
+analyze Podcast;
+analyze Album;
+analyze TVShow;
+analyze Movie;
+
+commit;
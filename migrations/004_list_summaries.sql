@@ -0,0 +1,184 @@
+/**
+Summary tables for the list pages
+
+The artist, song, podcast and TV show listings used to aggregate over
+ArtistMetaData, Song_Artists, PodcastEpisode and TVEpisode every time
+they were read. Their counts and artist lists are now kept in
+ArtistSummary, SongSummary, PodcastSummary and TVShowSummary. Triggers
+on the child tables, and on Artist for renames, keep them current. The
+listings read them instead. refresh_list_summaries() rebuilds them all.
+It fills them in here and can repair them after a load with the
+triggers disabled.
+
+Apply after 003_listing_sort_indexes.sql:
+    psql -f migrations/004_list_summaries.sql
+*/
+
+start transaction;
+
+set search_path to 'mediaserver', 'public';
+
+create table if not exists ArtistSummary (
+    artist_id integer primary key references Artist(artist_id) on delete cascade,
+    metadata_count integer not null default 0
+);
+
+create table if not exists SongSummary (
+    song_id integer primary key references Song(song_id) on delete cascade,
+    artists text
+);
+
+create table if not exists PodcastSummary (
+    podcast_id integer primary key references Podcast(podcast_id) on delete cascade,
+    episode_count integer not null default 0
+);
+
+create table if not exists TVShowSummary (
+    tvshow_id integer primary key references TVShow(tvshow_id) on delete cascade,
+    episode_count integer not null default 0
+);
+
+create or replace function update_artist_summary() returns trigger as
+$$
+begin
+  if tg_op in ('DELETE', 'UPDATE') then
+    update mediaserver.ArtistSummary set metadata_count = metadata_count - 1
+    where artist_id = old.artist_id;
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into mediaserver.ArtistSummary values (new.artist_id, 1)
+    on conflict (artist_id) do update set metadata_count = ArtistSummary.metadata_count + 1;
+  end if;
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists artistmetadata_summary on ArtistMetaData;
+create trigger artistmetadata_summary
+       after insert or update of artist_id or delete on ArtistMetaData
+       for each row execute procedure update_artist_summary();
+
+-- The song's artist list, from its Song_Artists as they are now
+create or replace function summarise_song(song integer) returns void as
+$$
+  insert into mediaserver.SongSummary
+      select song, string_agg(a.artist_name, ',' order by a.artist_name)
+      from mediaserver.Song_Artists sa join mediaserver.Artist a on (a.artist_id = sa.performing_artist_id)
+      where sa.song_id = song
+  on conflict (song_id) do update set artists = excluded.artists;
+$$ language sql;
+
+create or replace function update_song_summary() returns trigger as
+$$
+begin
+  if tg_op in ('DELETE', 'UPDATE') then
+    perform mediaserver.summarise_song(old.song_id);
+  end if;
+  if tg_op = 'INSERT' or (tg_op = 'UPDATE' and new.song_id <> old.song_id) then
+    perform mediaserver.summarise_song(new.song_id);
+  end if;
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists song_artists_summary on Song_Artists;
+create trigger song_artists_summary
+       after insert or update or delete on Song_Artists
+       for each row execute procedure update_song_summary();
+
+create or replace function update_artist_songs_summary() returns trigger as
+$$
+begin
+  perform mediaserver.summarise_song(song_id)
+  from mediaserver.Song_Artists where performing_artist_id = new.artist_id;
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists artist_name_summary on Artist;
+create trigger artist_name_summary
+       after update of artist_name on Artist
+       for each row when (new.artist_name is distinct from old.artist_name)
+       execute procedure update_artist_songs_summary();
+
+create or replace function update_podcast_summary() returns trigger as
+$$
+begin
+  if tg_op in ('DELETE', 'UPDATE') then
+    update mediaserver.PodcastSummary set episode_count = episode_count - 1
+    where podcast_id = old.podcast_id;
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into mediaserver.PodcastSummary values (new.podcast_id, 1)
+    on conflict (podcast_id) do update set episode_count = PodcastSummary.episode_count + 1;
+  end if;
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists podcastepisode_summary on PodcastEpisode;
+create trigger podcastepisode_summary
+       after insert or update of podcast_id or delete on PodcastEpisode
+       for each row execute procedure update_podcast_summary();
+
+create or replace function update_tvshow_summary() returns trigger as
+$$
+begin
+  if tg_op in ('DELETE', 'UPDATE') then
+    update mediaserver.TVShowSummary set episode_count = episode_count - 1
+    where tvshow_id = old.tvshow_id;
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into mediaserver.TVShowSummary values (new.tvshow_id, 1)
+    on conflict (tvshow_id) do update set episode_count = TVShowSummary.episode_count + 1;
+  end if;
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists tvepisode_summary on TVEpisode;
+create trigger tvepisode_summary
+       after insert or update of tvshow_id or delete on TVEpisode
+       for each row execute procedure update_tvshow_summary();
+
+-- Every summary worked out again from the child tables, e.g. after
+-- loading data with the triggers disabled
+create or replace function refresh_list_summaries() returns void as
+$$
+  delete from mediaserver.ArtistSummary;
+  insert into mediaserver.ArtistSummary
+      select a.artist_id, count(amd.md_id)
+      from mediaserver.Artist a left outer join mediaserver.ArtistMetaData amd on (amd.artist_id = a.artist_id)
+      group by a.artist_id;
+
+  delete from mediaserver.SongSummary;
+  insert into mediaserver.SongSummary
+      select s.song_id, string_agg(a.artist_name, ',' order by a.artist_name)
+      from mediaserver.Song s
+          left outer join (mediaserver.Song_Artists sa join mediaserver.Artist a on (a.artist_id = sa.performing_artist_id))
+          on (sa.song_id = s.song_id)
+      group by s.song_id;
+
+  delete from mediaserver.PodcastSummary;
+  insert into mediaserver.PodcastSummary
+      select p.podcast_id, count(pe.media_id)
+      from mediaserver.Podcast p left outer join mediaserver.PodcastEpisode pe on (pe.podcast_id = p.podcast_id)
+      group by p.podcast_id;
+
+  delete from mediaserver.TVShowSummary;
+  insert into mediaserver.TVShowSummary
+      select t.tvshow_id, count(e.media_id)
+      from mediaserver.TVShow t left outer join mediaserver.TVEpisode e on (e.tvshow_id = t.tvshow_id)
+      group by t.tvshow_id;
+$$ language sql;
+
+-- The new triggers hold off writes to the child tables until this
+-- commits, so none are missed between the refresh and the triggers
+select refresh_list_summaries();
+
+analyze ArtistSummary;
+analyze SongSummary;
+analyze PodcastSummary;
+analyze TVShowSummary;
+
+commit;
@@ -0,0 +1,308 @@
+/**
+A search document for every media type
+
+/api/search and /api/gethint only searched movies, whatever type was asked
+for. SearchDocument now has a row for every movie, song, podcast, podcast
+episode, TV show, TV episode and album: its title and title words, a
+tsvector of its title and description metadata, its media type and how
+many users have played it. One query over its GIN indexes answers a search
+of any type. Triggers on the media tables, their metadata and
+UserMediaConsumption keep it current; the bulk import holds them off and
+refreshes the documents it added in one statement.
+refresh_all_search_documents() fills it in here and can repair it after a
+load with the triggers disabled.
+
+Apply after 004_list_summaries.sql:
+    psql -f migrations/005_search_documents.sql
+*/
+
+start transaction;
+
+set search_path to 'mediaserver', 'public';
+
+create table if not exists SearchDocument (
+    media_type varchar(20) not null,
+    item_id integer not null,
+    -- the podcast or TV show of an episode
+    parent_id integer,
+    title varchar(250),
+    release_year smallint,
+    title_words varchar[],
+    document tsvector not null,
+    popularity integer not null default 0,
+    primary key (media_type, item_id)
+);
+
+create or replace view SearchDocumentSource as
+    select media_type, item_id, parent_id, title, release_year,
+           (select array_agg(distinct lower(w)) from unnest(string_to_array(title, ' ')) w
+            where w <> '')::varchar[] as title_words,
+           setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+           setweight(to_tsvector('simple', coalesce(descriptions, '')), 'B') as document,
+           popularity
+    from (
+        select 'movie'::varchar as media_type, m.movie_id as item_id, null::integer as parent_id,
+               m.movie_title::varchar as title, m.release_year,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.MediaItemMetaData mimd
+                    join mediaserver.MetaData md on (md.md_id = mimd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where mimd.media_id = m.movie_id and mt.md_type_name = 'description') as descriptions,
+               (select count(*) from mediaserver.UserMediaConsumption c
+                where c.media_id = m.movie_id)::integer as popularity
+        from mediaserver.Movie m
+        union all
+        select 'song', s.song_id, null, s.song_title, null,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.MediaItemMetaData mimd
+                    join mediaserver.MetaData md on (md.md_id = mimd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where mimd.media_id = s.song_id and mt.md_type_name = 'description'),
+               (select count(*) from mediaserver.UserMediaConsumption c
+                where c.media_id = s.song_id)::integer
+        from mediaserver.Song s
+        union all
+        -- An episode in more than one podcast or show is one document, under
+        -- the first of them
+        select 'podcastepisode', pe.media_id, min(pe.podcast_id), min(pe.podcast_episode_title), null,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.MediaItemMetaData mimd
+                    join mediaserver.MetaData md on (md.md_id = mimd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where mimd.media_id = pe.media_id and mt.md_type_name = 'description'),
+               (select count(*) from mediaserver.UserMediaConsumption c
+                where c.media_id = pe.media_id)::integer
+        from mediaserver.PodcastEpisode pe
+        group by pe.media_id
+        union all
+        select 'tvepisode', e.media_id, min(e.tvshow_id), min(e.tvshow_episode_title), null,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.MediaItemMetaData mimd
+                    join mediaserver.MetaData md on (md.md_id = mimd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where mimd.media_id = e.media_id and mt.md_type_name = 'description'),
+               (select count(*) from mediaserver.UserMediaConsumption c
+                where c.media_id = e.media_id)::integer
+        from mediaserver.TVEpisode e
+        group by e.media_id
+        union all
+        select 'podcast', p.podcast_id, null, p.podcast_title, null,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.PodcastMetaData pmd
+                    join mediaserver.MetaData md on (md.md_id = pmd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where pmd.podcast_id = p.podcast_id and mt.md_type_name = 'description'),
+               (select count(*) from mediaserver.PodcastEpisode pe
+                    join mediaserver.UserMediaConsumption c on (c.media_id = pe.media_id)
+                where pe.podcast_id = p.podcast_id)::integer
+        from mediaserver.Podcast p
+        union all
+        select 'tvshow', t.tvshow_id, null, t.tvshow_title, null,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.TVShowMetaData tmd
+                    join mediaserver.MetaData md on (md.md_id = tmd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where tmd.tvshow_id = t.tvshow_id and mt.md_type_name = 'description'),
+               (select count(*) from mediaserver.TVEpisode e
+                    join mediaserver.UserMediaConsumption c on (c.media_id = e.media_id)
+                where e.tvshow_id = t.tvshow_id)::integer
+        from mediaserver.TVShow t
+        union all
+        select 'album', a.album_id, null, a.album_title, null,
+               (select string_agg(md.md_value, ' ')
+                from mediaserver.AlbumMetaData amd
+                    join mediaserver.MetaData md on (md.md_id = amd.md_id)
+                    join mediaserver.MetaDataType mt on (mt.md_type_id = md.md_type_id)
+                where amd.album_id = a.album_id and mt.md_type_name = 'description'),
+               (select count(*) from mediaserver.Album_Songs als
+                    join mediaserver.UserMediaConsumption c on (c.media_id = als.song_id)
+                where als.album_id = a.album_id)::integer
+        from mediaserver.Album a
+    ) items;
+
+-- The documents of the items of type `kind` with the given ids, worked
+-- out again; kind 'media' is any of the types whose id is a media_id
+create or replace function refresh_search_documents(kind varchar, ids integer[]) returns void as
+$$
+  delete from mediaserver.SearchDocument
+  where item_id = any(ids)
+    and (media_type = kind or (kind = 'media' and media_type in ('movie', 'song', 'podcastepisode', 'tvepisode')));
+  insert into mediaserver.SearchDocument
+      select * from mediaserver.SearchDocumentSource
+      where item_id = any(ids)
+        and (media_type = kind or (kind = 'media' and media_type in ('movie', 'song', 'podcastepisode', 'tvepisode')));
+  insert into mediaserver.TitleWord
+      select distinct unnest(title_words) from mediaserver.SearchDocument
+      where item_id = any(ids)
+        and (media_type = kind or (kind = 'media' and media_type in ('movie', 'song', 'podcastepisode', 'tvepisode')))
+  on conflict do nothing;
+$$ language sql;
+
+-- Every document worked out again, e.g. after loading data with the
+-- triggers disabled
+create or replace function refresh_all_search_documents() returns void as
+$$
+  delete from mediaserver.SearchDocument;
+  insert into mediaserver.SearchDocument select * from mediaserver.SearchDocumentSource;
+  insert into mediaserver.TitleWord
+      select distinct unnest(title_words) from mediaserver.SearchDocument
+  on conflict do nothing;
+$$ language sql;
+
+-- Trigger arguments: the document type and the column with its id, then
+-- optionally the same for a second document, e.g. an episode's show. The
+-- bulk import sets mediaserver.defer_search_documents and refreshes the
+-- documents it added in one go instead.
+create or replace function update_search_documents() returns trigger as
+$$
+declare
+  old_row jsonb := case when tg_op <> 'INSERT' then to_jsonb(old) end;
+  new_row jsonb := case when tg_op <> 'DELETE' then to_jsonb(new) end;
+  i integer := 0;
+begin
+  if current_setting('mediaserver.defer_search_documents', true) = 'on' then
+    return null;
+  end if;
+  while i < tg_nargs loop
+    if old_row is not null then
+      perform mediaserver.refresh_search_documents(tg_argv[i], array[(old_row ->> tg_argv[i + 1])::integer]);
+    end if;
+    if new_row is not null and (old_row is null or new_row -> tg_argv[i + 1] <> old_row -> tg_argv[i + 1]) then
+      perform mediaserver.refresh_search_documents(tg_argv[i], array[(new_row ->> tg_argv[i + 1])::integer]);
+    end if;
+    i := i + 2;
+  end loop;
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists movie_search_document on Movie;
+create trigger movie_search_document
+       after insert or update of movie_title, release_year or delete on Movie
+       for each row execute procedure update_search_documents('movie', 'movie_id');
+drop trigger if exists song_search_document on Song;
+create trigger song_search_document
+       after insert or update of song_title or delete on Song
+       for each row execute procedure update_search_documents('song', 'song_id');
+drop trigger if exists podcastepisode_search_document on PodcastEpisode;
+create trigger podcastepisode_search_document
+       after insert or update of podcast_episode_title, podcast_id, media_id or delete on PodcastEpisode
+       for each row execute procedure update_search_documents('podcastepisode', 'media_id', 'podcast', 'podcast_id');
+drop trigger if exists tvepisode_search_document on TVEpisode;
+create trigger tvepisode_search_document
+       after insert or update of tvshow_episode_title, tvshow_id, media_id or delete on TVEpisode
+       for each row execute procedure update_search_documents('tvepisode', 'media_id', 'tvshow', 'tvshow_id');
+drop trigger if exists podcast_search_document on Podcast;
+create trigger podcast_search_document
+       after insert or update of podcast_title or delete on Podcast
+       for each row execute procedure update_search_documents('podcast', 'podcast_id');
+drop trigger if exists tvshow_search_document on TVShow;
+create trigger tvshow_search_document
+       after insert or update of tvshow_title or delete on TVShow
+       for each row execute procedure update_search_documents('tvshow', 'tvshow_id');
+drop trigger if exists album_search_document on Album;
+create trigger album_search_document
+       after insert or update of album_title or delete on Album
+       for each row execute procedure update_search_documents('album', 'album_id');
+-- Descriptions, and the songs an album's popularity comes from
+drop trigger if exists mediaitemmetadata_search_document on MediaItemMetaData;
+create trigger mediaitemmetadata_search_document
+       after insert or update or delete on MediaItemMetaData
+       for each row execute procedure update_search_documents('media', 'media_id');
+drop trigger if exists podcastmetadata_search_document on PodcastMetaData;
+create trigger podcastmetadata_search_document
+       after insert or update or delete on PodcastMetaData
+       for each row execute procedure update_search_documents('podcast', 'podcast_id');
+drop trigger if exists tvshowmetadata_search_document on TVShowMetaData;
+create trigger tvshowmetadata_search_document
+       after insert or update or delete on TVShowMetaData
+       for each row execute procedure update_search_documents('tvshow', 'tvshow_id');
+drop trigger if exists albummetadata_search_document on AlbumMetaData;
+create trigger albummetadata_search_document
+       after insert or update or delete on AlbumMetaData
+       for each row execute procedure update_search_documents('album', 'album_id');
+drop trigger if exists album_songs_search_document on Album_Songs;
+create trigger album_songs_search_document
+       after insert or update or delete on Album_Songs
+       for each row execute procedure update_search_documents('album', 'album_id');
+
+-- An edited description: every document with it
+create or replace function update_metadata_search_documents() returns trigger as
+$$
+begin
+  perform mediaserver.refresh_search_documents('media', array(
+      select media_id from mediaserver.MediaItemMetaData where md_id = new.md_id));
+  perform mediaserver.refresh_search_documents('podcast', array(
+      select podcast_id from mediaserver.PodcastMetaData where md_id = new.md_id));
+  perform mediaserver.refresh_search_documents('tvshow', array(
+      select tvshow_id from mediaserver.TVShowMetaData where md_id = new.md_id));
+  perform mediaserver.refresh_search_documents('album', array(
+      select album_id from mediaserver.AlbumMetaData where md_id = new.md_id));
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists metadata_search_document on MetaData;
+create trigger metadata_search_document
+       after update of md_value, md_type_id on MetaData
+       for each row execute procedure update_metadata_search_documents();
+
+-- A play added or taken away: one more or less for the item and for the
+-- podcast, show or albums it is in
+create or replace function update_search_popularity() returns trigger as
+$$
+declare
+  media integer := case when tg_op = 'DELETE' then old.media_id else new.media_id end;
+begin
+  if tg_op = 'UPDATE' then
+    if new.media_id = old.media_id then
+      return null;
+    end if;
+    media := old.media_id;
+  end if;
+  update mediaserver.SearchDocument d
+  set popularity = popularity + case when tg_op = 'INSERT' then 1 else -1 end
+  where (d.media_type, d.item_id) in (
+      select t, media from unnest(array['movie', 'song', 'podcastepisode', 'tvepisode']) t
+      union all
+      select 'podcast', podcast_id from mediaserver.PodcastEpisode where media_id = media
+      union all
+      select 'tvshow', tvshow_id from mediaserver.TVEpisode where media_id = media
+      union all
+      select 'album', album_id from mediaserver.Album_Songs where song_id = media);
+  if tg_op = 'UPDATE' then
+    update mediaserver.SearchDocument d
+    set popularity = popularity + 1
+    where (d.media_type, d.item_id) in (
+        select t, new.media_id from unnest(array['movie', 'song', 'podcastepisode', 'tvepisode']) t
+        union all
+        select 'podcast', podcast_id from mediaserver.PodcastEpisode where media_id = new.media_id
+        union all
+        select 'tvshow', tvshow_id from mediaserver.TVEpisode where media_id = new.media_id
+        union all
+        select 'album', album_id from mediaserver.Album_Songs where song_id = new.media_id);
+  end if;
+  return null;
+end
+$$ language plpgsql;
+
+drop trigger if exists usermediaconsumption_search_popularity on UserMediaConsumption;
+create trigger usermediaconsumption_search_popularity
+       after insert or update of media_id or delete on UserMediaConsumption
+       for each row execute procedure update_search_popularity();
+
+-- The new triggers hold off writes to the media tables until this
+-- commits, so none are missed between the refresh and the triggers
+select refresh_all_search_documents();
+
+create index if not exists searchdocument_document_idx
+    on SearchDocument using gin (document);
+create index if not exists searchdocument_title_words_idx
+    on SearchDocument using gin (title_words);
+create index if not exists usermediaconsumption_media_id_idx
+    on UserMediaConsumption (media_id);
+
+analyze SearchDocument;
+analyze TitleWord;
+
+commit;
@@ -0,0 +1,63 @@
+/**
+A catalog version every process reads from the database
+
+The listing, search and missing item caches, and the ETags of the
+catalog pages, went by a version each server process kept in memory. A
+catalog change made by another process, e.g. a bulk_import.py run, or by
+hand was never seen by the others. CatalogVersion now holds the version
+in one row. Statement triggers on the catalog tables move it on in the
+transaction that writes to them, once per transaction, so others see it
+change on commit and never before. The caches and the ETags read it once
+per request.
+
+Writers to the catalog tables now wait for each other's commit on that
+row; catalog writes are rare, and reads don't take the lock.
+
+Apply after 005_search_documents.sql:
+    psql -f migrations/006_catalog_version.sql
+*/
+
+start transaction;
+
+set search_path to 'mediaserver', 'public';
+
+create table if not exists CatalogVersion (
+    version bigint not null,
+    changed_at timestamptz not null default now(),
+    -- the transaction that last moved it on
+    changed_by bigint
+);
+
+insert into CatalogVersion (version)
+    select 1 where not exists (select 1 from CatalogVersion);
+
+create or replace function bump_catalog_version() returns trigger as
+$$
+begin
+  update mediaserver.CatalogVersion
+  set version = version + 1, changed_at = now(), changed_by = txid_current()
+  where changed_by is distinct from txid_current();
+  return null;
+end
+$$ language plpgsql;
+
+do $$
+declare
+  t text;
+begin
+  foreach t in array array[
+      'MediaItem', 'AudioMedia', 'VideoMedia', 'MetaData', 'MetaDataType', 'MediaItemMetaData',
+      'Artist', 'ArtistMetaData', 'BandMembership', 'Song', 'Song_Artists',
+      'Album', 'Album_Songs', 'AlbumMetaData', 'Podcast', 'PodcastEpisode', 'PodcastMetaData',
+      'TVShow', 'TVEpisode', 'TVShowMetaData', 'Movie'] loop
+    -- %I would quote the mixed case names
+    t := lower(t);
+    execute format('drop trigger if exists %I on %I', t || '_catalog_version', t);
+    execute format('create trigger %I after insert or update or delete or truncate on %I'
+                   ' for each statement execute procedure bump_catalog_version()',
+                   t || '_catalog_version', t);
+  end loop;
+end
+$$;
+
+commit;
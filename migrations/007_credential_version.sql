@@ -0,0 +1,23 @@
+/**
+A credential version per user
+
+Admin pages trust the superuser flag kept in the signed session until the
+user's credentials change. What changed was only known to the process that
+made the change, and each process numbered its changes from a random
+epoch of its own. UserAccount.credential_version now moves on with every
+update_user_credential() (and /debug/api/setuser), so a session's check
+can be compared with what the database says whichever process made the
+change, and survives restarts.
+
+Apply after 006_catalog_version.sql:
+    psql -f migrations/007_credential_version.sql
+*/
+
+start transaction;
+
+set search_path to 'mediaserver', 'public';
+
+alter table UserAccount
+    add column if not exists credential_version integer not null default 0;
+
+commit;